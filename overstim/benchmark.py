@@ -0,0 +1,276 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Runs every detector over a labelled frame set and reports accuracy, score margins and time per detector. Results can
+# be saved as a baseline, and later runs fail if they are worse than the baseline.
+#
+# A labelled frame set is a directory with images and a labels.json that maps each filename to the HUD elements shown
+# as "template[:notif row[:position]]", as written by overstim.synthetic.
+#
+# Usage: python -m overstim.benchmark synthetic --save-baseline baseline.json
+#        python -m overstim.benchmark synthetic --baseline baseline.json
+#        python -m overstim.benchmark --synthetic 100 --resolution 2560x1440
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import cv2
+import numpy
+
+from .computer_vision import ComputerVision, Coord
+from .frame_source import FrameSource
+from .synthetic import HudElement, SyntheticHud, parse_resolution
+from .utils import Config
+
+
+class LabelledFrame(NamedTuple):
+    name: str
+    image: numpy.ndarray
+    labels: set[tuple[str, int]]  # Template names with notif rows
+
+
+class Detector(NamedTuple):
+    name: str
+    template_name: str
+    row: int = 0
+
+    def coord(self, coords: dict[str, Coord]) -> Coord | None:
+        if self.row == 0:
+            return None
+        coord = coords[self.template_name]
+        # Same rows as PlayerState.detect_new_notifs
+        return coord._replace(top=coord.top + self.row * self.row * ComputerVision.NOTIF_ROW_OFFSET)
+
+
+class DetectorResult(NamedTuple):
+    detector: str
+    true_positives: int = 0
+    false_positives: int = 0
+    false_negatives: int = 0
+    true_negatives: int = 0
+    # Lowest score of a frame with the element and highest score of a frame without it, relative to the threshold
+    positive_margin: float | None = None
+    negative_margin: float | None = None
+    mean_time: float = 0.0
+
+    @property
+    def precision(self) -> float:
+        detected = self.true_positives + self.false_positives
+        return self.true_positives / detected if detected else 1.0
+
+    @property
+    def recall(self) -> float:
+        expected = self.true_positives + self.false_negatives
+        return self.true_positives / expected if expected else 1.0
+
+    def to_dict(self) -> dict:
+        return {**self._asdict(), "precision": self.precision, "recall": self.recall}
+
+
+def get_detectors() -> list[Detector]:
+    detectors = []
+    for template_name in ComputerVision.COORDS:
+        if template_name in ComputerVision.NOTIF_NAMES:
+            for row in range(ComputerVision.NOTIF_ROWS):
+                detectors.append(Detector(f"{template_name}@{row + 1}", template_name, row))
+        else:
+            detectors.append(Detector(template_name, template_name))
+    return detectors
+
+
+class ImageFrameSource(FrameSource):
+    def __init__(self, images: Sequence[numpy.ndarray]) -> None:
+        self.images = images
+        self.index = -1
+
+    @property
+    def resolution(self) -> tuple[int, int]:
+        return self.images[0].shape[1], self.images[0].shape[0]
+
+    def get_latest_frame(self) -> numpy.ndarray:
+        self.index = (self.index + 1) % len(self.images)
+        return self.images[self.index]
+
+
+def parse_labels(labels: Sequence[str]) -> set[tuple[str, int]]:
+    elements = [HudElement.from_str(label) for label in labels]
+    return {(element.name, element.row) for element in elements}
+
+
+def load_frames(directory: str) -> list[LabelledFrame]:
+    with open(os.path.join(directory, "labels.json")) as file:
+        labels = json.load(file)
+    frames = []
+    for filename, frame_labels in labels.items():
+        image = cv2.imread(os.path.join(directory, filename), cv2.IMREAD_COLOR)
+        assert image is not None, f"Failed to read frame {filename}"
+        frames.append(LabelledFrame(filename, image, parse_labels(frame_labels)))
+    return frames
+
+
+def synthetic_frames(template_path: str, count: int, resolutions: Sequence[tuple[int, int]],
+                     seed: int) -> list[LabelledFrame]:
+    hud = SyntheticHud(template_path, seed)
+    frames = []
+    for index in range(count):
+        scene = hud.random_scene()
+        for resolution in resolutions:
+            image = hud.render(scene, resolution)
+            frames.append(LabelledFrame(f"synthetic_{resolution[0]}x{resolution[1]}_{index:04d}", image,
+                                        parse_labels([str(element) for element in scene])))
+    return frames
+
+
+def run_benchmark(frames: Sequence[LabelledFrame], template_path: str,
+                  calibration_profile: str = "") -> list[DetectorResult]:
+    detectors = get_detectors()
+    counts: dict[str, dict[tuple[bool, bool], int]] = defaultdict(lambda: defaultdict(int))
+    positive_scores: dict[str, list[float]] = defaultdict(list)
+    negative_scores: dict[str, list[float]] = defaultdict(list)
+    times: dict[str, float] = defaultdict(float)
+    thresholds: dict[str, float] = {}
+
+    # Frames of the same resolution share a ComputerVision, like frames of one screen
+    frames_by_resolution: dict[tuple[int, ...], list[LabelledFrame]] = defaultdict(list)
+    for frame in frames:
+        frames_by_resolution[frame.image.shape].append(frame)
+    for resolution_frames in frames_by_resolution.values():
+        source = ImageFrameSource([frame.image for frame in resolution_frames])
+        computer_vision = ComputerVision(Config(calibration_profile=calibration_profile), template_path,
+                                         frame_source=source)
+        for frame in resolution_frames:
+            computer_vision.wait_for_frame()
+            computer_vision.capture_frame()
+            for detector in detectors:
+                coord = detector.coord(computer_vision.coords)
+                threshold = computer_vision.get_threshold(detector.template_name)
+                thresholds[detector.name] = threshold
+                detection_start = time.perf_counter()
+                detected = computer_vision.detect_single(detector.template_name, coord_override=coord)
+                times[detector.name] += time.perf_counter() - detection_start
+                score = computer_vision.match_score(detector.template_name, coord_override=coord)
+                expected = (detector.template_name, detector.row) in frame.labels
+                if expected:
+                    positive_scores[detector.name].append(score)
+                else:
+                    negative_scores[detector.name].append(score)
+                counts[detector.name][(detected, expected)] += 1
+
+    results = []
+    for detector in detectors:
+        positives = positive_scores[detector.name]
+        negatives = negative_scores[detector.name]
+        results.append(DetectorResult(
+            detector=detector.name,
+            true_positives=counts[detector.name][(True, True)],
+            false_positives=counts[detector.name][(True, False)],
+            false_negatives=counts[detector.name][(False, True)],
+            true_negatives=counts[detector.name][(False, False)],
+            positive_margin=min(positives) - thresholds[detector.name] if positives else None,
+            negative_margin=thresholds[detector.name] - max(negatives) if negatives else None,
+            mean_time=times[detector.name] / max(len(frames), 1)))
+    return results
+
+
+def format_results(results: Sequence[DetectorResult]) -> str:
+    def margin(value: float | None) -> str:
+        return f"{value:>+8.3f}" if value is not None else f"{'-':>8}"
+
+    lines = [f"{'Detector':<28} {'TP':>5} {'FP':>5} {'FN':>5} {'Prec.':>6} {'Recall':>6} "
+             f"{'+Margin':>8} {'-Margin':>8} {'Mean ms':>8}"]
+    for result in results:
+        lines.append(f"{result.detector:<28} {result.true_positives:>5} {result.false_positives:>5} "
+                     f"{result.false_negatives:>5} {result.precision:>6.3f} {result.recall:>6.3f} "
+                     f"{margin(result.positive_margin)} {margin(result.negative_margin)} "
+                     f"{1000 * result.mean_time:>8.3f}")
+    total_time = sum(result.mean_time for result in results)
+    lines.append(f"Total time per frame for all detectors: {1000 * total_time:.2f}ms")
+    return "\n".join(lines)
+
+
+def compare_to_baseline(results: Sequence[DetectorResult], baseline: dict, tolerance: float,
+                        max_slowdown: float) -> list[str]:
+    regressions = []
+    for result in results:
+        base = baseline["detectors"].get(result.detector)
+        if base is None:
+            continue
+        for metric in ["precision", "recall"]:
+            value = getattr(result, metric)
+            if value < base[metric] - tolerance:
+                regressions.append(f"{result.detector}: {metric} {value:.3f} < baseline {base[metric]:.3f}")
+        if max_slowdown > 0.0 and base["mean_time"] > 0.0 and result.mean_time > base["mean_time"] * max_slowdown:
+            regressions.append(f"{result.detector}: {1000 * result.mean_time:.3f}ms > "
+                               f"{max_slowdown:.1f} x baseline {1000 * base['mean_time']:.3f}ms")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the accuracy and speed of every detector.")
+    parser.add_argument("frames", nargs="?", help="Directory with frames and labels.json.")
+    parser.add_argument("--templates", default=os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                            "assets", "templates"))
+    parser.add_argument("--synthetic", type=int, default=0, help="Add this many random synthetic scenes.")
+    parser.add_argument("--resolution", type=parse_resolution, action="append", default=[],
+                        help='Resolution of synthetic frames as "WIDTHxHEIGHT"; repeatable. Default 1920x1080.')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--calibration", default="", help="Calibration profile to use, see overstim.calibration.")
+    parser.add_argument("--save-baseline", help="Write the results to this baseline JSON file.")
+    parser.add_argument("--baseline", help="Fail if the results are worse than this baseline JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Allowed drop of precision and recall.")
+    parser.add_argument("--max-slowdown", type=float, default=0.0,
+                        help="Fail if a detector is this many times slower than the baseline, 0 to ignore time.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    frames = load_frames(args.frames) if args.frames else []
+    if args.synthetic:
+        frames.extend(synthetic_frames(args.templates, args.synthetic, args.resolution or [(1920, 1080)], args.seed))
+    if not frames:
+        parser.error("No frames; give a frame directory or --synthetic.")
+
+    results = run_benchmark(frames, args.templates, args.calibration)
+    print(f"Frames: {len(frames)}")
+    print(format_results(results))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"frames": len(frames), "detectors": {result.detector: result.to_dict() for result in results}},
+                      file, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(results, baseline, args.tolerance, args.max_slowdown)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions compared to the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Picks a threshold for every template between the scores of frames with and without the element, and the tightest
+# search window that still covers every position the element was found at. The result is a calibration profile that
+# is loaded by ComputerVision (see the "Calibration profile" setting).
+#
+# Frames come from a labelled frame set (see overstim.benchmark), or from a frame recording. Recordings have no labels,
+# so the current detections are used as labels.
+#
+# Usage: python -m overstim.calibration --frames synthetic --output calibration.json
+#        python -m overstim.calibration --recording log/OverStim_Frames_20250101_120000 --output calibration.json
+
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from collections.abc import Iterator, Sequence
+
+import cv2
+
+from .benchmark import ImageFrameSource, LabelledFrame, get_detectors, load_frames, synthetic_frames
+from .computer_vision import ComputerVision, Coord
+from .frame_source import RecordedFrameSource
+from .synthetic import parse_resolution
+from .utils import Config
+
+
+class TemplateSamples:
+    def __init__(self) -> None:
+        self.positive_scores: list[float] = []
+        self.negative_scores: list[float] = []
+        # Position of the best match within the search window of the point it was found at, as (down, right)
+        self.locations: list[tuple[int, int]] = []
+
+
+def match_location(computer_vision: ComputerVision, template_name: str, coord: Coord) -> tuple[float, tuple[int, int]]:
+    template = computer_vision.templates[template_name]
+    height = template.shape[0] + coord.add_height
+    width = template.shape[1] + coord.add_width
+    best_score, best_location = -1.0, (0, 0)
+    for left, top in computer_vision.get_points(coord):
+        cropped_frame = computer_vision.frame[top:top + height, left:left + width]
+        result = cv2.matchTemplate(cropped_frame, template, cv2.TM_CCOEFF_NORMED,
+                                   mask=computer_vision.masks.get(template_name, None))
+        _, score, _, location = cv2.minMaxLoc(result)
+        if score > best_score:
+            best_score, best_location = score, (location[1], location[0])
+    return best_score, best_location
+
+
+def labelled_frames(frames: Sequence[LabelledFrame], template_path: str) -> Iterator[tuple[ComputerVision, set | None]]:
+    frames_by_resolution: dict[tuple[int, ...], list[LabelledFrame]] = defaultdict(list)
+    for frame in frames:
+        frames_by_resolution[frame.image.shape].append(frame)
+    for resolution_frames in frames_by_resolution.values():
+        source = ImageFrameSource([frame.image for frame in resolution_frames])
+        computer_vision = ComputerVision(Config(), template_path, frame_source=source)
+        for frame in resolution_frames:
+            computer_vision.wait_for_frame()
+            computer_vision.capture_frame()
+            yield computer_vision, frame.labels
+
+
+def recorded_frames(directory: str, template_path: str) -> Iterator[tuple[ComputerVision, set | None]]:
+    source = RecordedFrameSource(directory, speed=0.0)
+    computer_vision = ComputerVision(Config(), template_path, frame_source=source)
+    while True:
+        computer_vision.wait_for_frame()
+        if source.finished:
+            break
+        computer_vision.capture_frame()
+        yield computer_vision, None
+
+
+def collect_samples(frames: Iterator[tuple[ComputerVision, set | None]]) -> tuple[dict[str, TemplateSamples], int]:
+    samples: dict[str, TemplateSamples] = defaultdict(TemplateSamples)
+    frame_count = 0
+    for computer_vision, labels in frames:
+        frame_count += 1
+        for detector in get_detectors():
+            # Always search the default windows, which are the widest
+            coord = detector.coord(ComputerVision.COORDS) or ComputerVision.COORDS[detector.template_name]
+            score, location = match_location(computer_vision, detector.template_name, coord)
+            if labels is None:
+                expected = score > computer_vision.get_threshold(detector.template_name)
+            else:
+                expected = (detector.template_name, detector.row) in labels
+            template_samples = samples[detector.template_name]
+            if expected:
+                template_samples.positive_scores.append(score)
+                template_samples.locations.append(location)
+            else:
+                template_samples.negative_scores.append(score)
+    return samples, frame_count
+
+
+def calibrate(samples: dict[str, TemplateSamples], min_samples: int, margin: int, min_threshold: float,
+              max_threshold: float, max_change: float) -> tuple[dict[str, float], dict[str, Coord]]:
+    thresholds = {}
+    coords = {}
+    for template_name, coord in ComputerVision.COORDS.items():
+        template_samples = samples.get(template_name)
+        if template_samples is None or len(template_samples.positive_scores) < min_samples:
+            continue
+
+        # Threshold halfway between the lowest score with the element and the highest score without it
+        lowest_positive = min(template_samples.positive_scores)
+        highest_negative = max(template_samples.negative_scores, default=min_threshold)
+        if lowest_positive > highest_negative:
+            threshold = (lowest_positive + highest_negative) / 2
+            # Frame sets rarely cover everything the game shows, so stay near the proven defaults
+            default_threshold = ComputerVision.THRESHOLDS.get(template_name, ComputerVision.DEFAULT_THRESHOLD)
+            threshold = min(max(threshold, default_threshold - max_change), default_threshold + max_change)
+            thresholds[template_name] = round(min(max(threshold, min_threshold), max_threshold), 4)
+        else:
+            logging.warning(f"{template_name}: Scores with and without the element overlap "
+                            f"({lowest_positive:.3f} <= {highest_negative:.3f}); keeping the threshold")
+
+        # Search window that covers every match with a few pixels to spare, within the default window.
+        # Windows with alternative absolute points stay as they are, the points would not move along.
+        if coord.more is not None:
+            continue
+        downs = [location[0] for location in template_samples.locations]
+        rights = [location[1] for location in template_samples.locations]
+        top = max(0, min(downs) - margin)
+        bottom = min(coord.add_height, max(downs) + margin)
+        left = max(0, min(rights) - margin)
+        right = min(coord.add_width, max(rights) + margin)
+        if (bottom - top, right - left) != (coord.add_height, coord.add_width):
+            coords[template_name] = coord._replace(top=coord.top + top, left=coord.left + left,
+                                                   add_height=bottom - top, add_width=right - left)
+    return thresholds, coords
+
+
+def search_positions(coord: Coord) -> int:
+    # Number of template positions matched per point, which the matching cost grows with
+    return (coord.add_height + 1) * (coord.add_width + 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calibrate detection thresholds and search windows.")
+    parser.add_argument("--frames", help="Directory with frames and labels.json.")
+    parser.add_argument("--recording", help="Frame recording directory; the current detections are used as labels.")
+    parser.add_argument("--synthetic", type=int, default=0, help="Add this many random synthetic scenes.")
+    parser.add_argument("--resolution", type=parse_resolution, action="append", default=[],
+                        help='Resolution of synthetic frames as "WIDTHxHEIGHT"; repeatable. Default 1920x1080.')
+    parser.add_argument("--templates", default=os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                            "assets", "templates"))
+    parser.add_argument("--output", required=True, help="Calibration profile to write.")
+    parser.add_argument("--min-samples", type=int, default=5,
+                        help="Frames with the element needed to calibrate a template.")
+    parser.add_argument("--margin", type=int, default=2, help="Pixels added around the observed matches.")
+    parser.add_argument("--min-threshold", type=float, default=0.75)
+    parser.add_argument("--max-threshold", type=float, default=0.98)
+    parser.add_argument("--max-change", type=float, default=0.05, help="Largest change of a default threshold.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.getLogger().setLevel(logging.WARNING)
+    frames = load_frames(args.frames) if args.frames else []
+    if args.synthetic:
+        frames.extend(synthetic_frames(args.templates, args.synthetic, args.resolution or [(1920, 1080)], 0))
+    if not frames and not args.recording:
+        parser.error("No frames; give --frames, --recording or --synthetic.")
+
+    samples: dict[str, TemplateSamples] = defaultdict(TemplateSamples)
+    frame_count = 0
+    sources = []
+    if frames:
+        sources.append(labelled_frames(frames, args.templates))
+    if args.recording:
+        sources.append(recorded_frames(args.recording, args.templates))
+    for source in sources:
+        source_samples, source_frame_count = collect_samples(source)
+        frame_count += source_frame_count
+        for template_name, template_samples in source_samples.items():
+            samples[template_name].positive_scores.extend(template_samples.positive_scores)
+            samples[template_name].negative_scores.extend(template_samples.negative_scores)
+            samples[template_name].locations.extend(template_samples.locations)
+
+    thresholds, coords = calibrate(samples, args.min_samples, args.margin, args.min_threshold, args.max_threshold,
+                                   args.max_change)
+    profile = {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "frames": frame_count,
+        "thresholds": thresholds,
+        "coords": {key: [coord.top, coord.left, coord.add_height, coord.add_width] for key, coord in coords.items()},
+    }
+    with open(args.output, "w") as file:
+        json.dump(profile, file, indent=2)
+
+    print(f"Frames: {frame_count}")
+    print(f"{'Template':<28} {'Samples':>8} {'Threshold':>16} {'Search positions':>18}")
+    positions_before = positions_after = 0
+    for template_name, coord in ComputerVision.COORDS.items():
+        default_threshold = ComputerVision.THRESHOLDS.get(template_name, ComputerVision.DEFAULT_THRESHOLD)
+        threshold = thresholds.get(template_name, default_threshold)
+        before = search_positions(coord)
+        after = search_positions(coords.get(template_name, coord))
+        positions_before += before
+        positions_after += after
+        print(f"{template_name:<28} {len(samples[template_name].positive_scores):>8} "
+              f"{default_threshold:>7.3f} -> {threshold:<5.3f} {before:>8} -> {after:<6}")
+    print(f"Search positions: {positions_before} -> {positions_after}")
+    print(f"Wrote calibration profile to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
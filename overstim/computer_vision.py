@@ -17,14 +17,18 @@
 #
 #  SPDX-License-Identifier: AGPL-3.0-or-later
 
+import json
 import logging
 import os
+import time
 from typing import NamedTuple
 
 import cv2
-import dxcam_cpp
 import numpy
 
+from .frame_source import FrameSource, DxcamFrameSource, FrameRecorder, Region
+from .metrics import Metrics
+from .profiler import Profiler
 from .utils import Config
 
 
@@ -82,8 +86,29 @@ class ComputerVision:
     }
     MASK_NAMES: list[str] = [
     ]
+    DEFAULT_THRESHOLD = 0.9
+    THRESHOLDS: dict[str, float] = {
+        # Weapons are used for hero detection
+        "baptiste_weapon": 0.97,
+        "brigitte_weapon": 0.97,
+        "kiriko_weapon": 0.97,
+        "lucio_weapon": 0.97,
+        "mercy_staff": 0.97,
+        "mercy_pistol": 0.97,
+        "mercy_pistol_ult": 0.97,
+        "zenyatta_weapon": 0.97,
+        "juno_weapon": 0.97,
+        "juno_glide_boost": 0.85,
+    }
+
+    # Notifs are checked in this many rows, with this many pixels between rows @ 1080p
+    NOTIF_ROWS = 2
+    NOTIF_ROW_OFFSET = 35
+    NOTIF_NAMES = ["elimination", "assist", "save"]
+    # Pixels checked by color, e.g. the Pulsar Torpedoes firing indicator
+    COLOR_POINTS: list[tuple[int, int]] = [(464, 346), (1920 - 464, 346)]
 
-    def __init__(self, config: Config, template_path: str) -> None:
+    def __init__(self, config: Config, template_path: str, frame_source: FrameSource | None = None) -> None:
         self.config = config
 
         # Define the base screen resolution used for all detections
@@ -91,17 +116,14 @@ class ComputerVision:
         self.base_aspect_ratio = self.base_resolution.width / self.base_resolution.height
 
         # Detect the user's screen resolution
-        self.camera = dxcam_cpp.create(self.config.gpu_id, self.config.monitor_id, max_buffer_len=1)
-        test_frame_shape = self.camera.grab().shape
-        self.user_resolution = Resolution(width=test_frame_shape[1], height=test_frame_shape[0])
+        if frame_source is None:
+            frame_source = DxcamFrameSource(self.config.gpu_id, self.config.monitor_id)
+        self.frame_source = frame_source
+        self.user_resolution = Resolution(*self.frame_source.resolution)
         self.user_aspect_ratio = self.user_resolution.width / self.user_resolution.height
         logging.info(f"Detected monitor resolution {self.user_resolution} "
                      f"and aspect ratio {self.user_aspect_ratio:.3f}:1")
 
-        # Create record of improved resolution detection
-        user_resolution_improved = Resolution(width=self.camera.width, height=self.camera.height)
-        logging.info(f"Detected monitor resolution {user_resolution_improved} (test of new approach)")
-
         # Enable frame cropping, if the users aspect ratio differs from the base aspect ratio
         self.horizontal_padding: int | None = None
         self.vertical_padding: int | None = None
@@ -129,21 +151,109 @@ class ComputerVision:
             assert mask is not None, f"Failed to read mask {filename}"
             self.masks[key] = mask
         self.frame: numpy.ndarray = numpy.empty(shape=(0, 0), dtype=numpy.uint8)
+        self.frame_time = 0.0
+        # Best match score of every template checked in the current frame
+        self.scores: dict[str, float] = {}
+        self.profiler = Profiler(enabled=False)
+        self.metrics = Metrics()
+        self.detection_stages = {key: f"detect {key}" for key in self.COORDS}
+        self.frame_recorder: FrameRecorder | None = None
+
+        # Thresholds and search windows, which can be overridden by a calibration profile
+        self.thresholds: dict[str, float] = {}
+        self.coords: dict[str, Coord] = {}
+        self.load_calibration(self.config.calibration_profile)
+
+    def set_config(self, config: Config) -> None:
+        if self.config.preview_window and not config.preview_window:
+            cv2.destroyAllWindows()
+        if config.calibration_profile != self.config.calibration_profile:
+            self.load_calibration(config.calibration_profile)
+        self.config = config
+
+    def load_calibration(self, filename: str) -> None:
+        self.thresholds = dict(self.THRESHOLDS)
+        self.coords = dict(self.COORDS)
+        if not filename:
+            return
+        try:
+            with open(filename) as file:
+                profile = json.load(file)
+            for key, threshold in profile.get("thresholds", {}).items():
+                if key in self.COORDS:
+                    self.thresholds[key] = float(threshold)
+            for key, window in profile.get("coords", {}).items():
+                if key in self.COORDS:
+                    self.coords[key] = self.COORDS[key]._replace(
+                        top=window[0], left=window[1], add_height=window[2], add_width=window[3])
+        except Exception as e:
+            logging.error(f"Failed to load calibration profile {filename}; using defaults.", exc_info=e)
+            self.thresholds = dict(self.THRESHOLDS)
+            self.coords = dict(self.COORDS)
+            return
+        logging.info(f"Loaded calibration profile {filename}")
+
+    @staticmethod
+    def get_points(coord: Coord) -> list[tuple[int, int]]:
+        # Get top left points
+        points = [(coord.left, coord.top)]
+        if coord.more is not None:
+            points.extend(coord.more)
+        if coord.offsets is not None:
+            for offset in coord.offsets:
+                points.append((coord.left + offset[1], coord.top + offset[0]))
+        return points
+
+    def get_threshold(self, template_name: str) -> float:
+        return self.thresholds.get(template_name, self.DEFAULT_THRESHOLD)
+
+    def get_regions(self) -> list[Region]:
+        # Every region of the base frame that is checked by a detection, with the search windows of the calibration
+        regions = []
+        for key, coord in self.coords.items():
+            height = self.templates[key].shape[0] + coord.add_height
+            width = self.templates[key].shape[1] + coord.add_width
+            rows = self.NOTIF_ROWS if key in self.NOTIF_NAMES else 1
+            for left, top in self.get_points(coord):
+                for row in range(rows):
+                    regions.append(Region(top + row * row * self.NOTIF_ROW_OFFSET, left, height, width))
+        regions.extend(Region(top, left, 1, 1) for left, top in self.COLOR_POINTS)
+        # Keep regions within the frame and skip duplicates
+        clipped_regions = []
+        for region in regions:
+            region = region._replace(height=min(region.height, self.base_resolution.height - region.top),
+                                     width=min(region.width, self.base_resolution.width - region.left))
+            if region not in clipped_regions:
+                clipped_regions.append(region)
+        return clipped_regions
+
+    def start_recording(self, directory: str) -> None:
+        self.frame_recorder = FrameRecorder(directory, self.base_resolution, self.get_regions())
+
+    def stop_recording(self) -> None:
+        if self.frame_recorder is not None:
+            self.frame_recorder.close()
+            self.frame_recorder = None
 
     def start_capturing(self, target_fps: int = 60) -> None:
-        self.camera.start(target_fps=target_fps, video_mode=True)
+        self.frame_source.start(target_fps)
 
     def stop_capturing(self) -> None:
-        self.camera.stop()
-        self.camera.release()
+        self.frame_source.stop()
         # Close preview window
         if self.config.preview_window:
             cv2.destroyAllWindows()
 
+    def release(self) -> None:
+        self.frame_source.release()
+
     def wait_for_frame(self) -> None:
-        self.frame = self.camera.get_latest_frame()
+        self.frame = self.frame_source.get_latest_frame()
+        self.frame_time = time.perf_counter()
 
     def capture_frame(self) -> None:
+        preparation_start = time.perf_counter()
+        self.scores = {}
         # Show preview window with original
         if self.config.preview_window:
             preview = cv2.resize(self.frame, (self.frame.shape[1] // 4, self.frame.shape[0] // 4))
@@ -155,41 +265,92 @@ class ComputerVision:
             self.frame = self.frame[self.vertical_padding:-self.vertical_padding, :]
         if self.frame.shape[1] != self.base_resolution.width or self.frame.shape[0] != self.base_resolution.height:
             self.frame = cv2.resize(self.frame, (self.base_resolution.width, self.base_resolution.height))
-        self.frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+        if self.frame.ndim == 3:
+            self.frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
         # Show preview window
         if self.config.preview_window:
             preview = cv2.resize(self.frame, (self.frame.shape[1] // 4, self.frame.shape[0] // 4))
             cv2.imshow("OverStim Preview Processed", preview)
             cv2.waitKey(1)
+        if self.frame_recorder is not None:
+            self.frame_recorder.add(time.time(), self.frame)
+        self.profiler.record("frame preparation", time.perf_counter() - preparation_start)
 
-    def detect_single(self, template_name: str, threshold: float = 0.9, coord_override: Coord | None = None) -> bool:
+    def detect_single(self, template_name: str, threshold: float | None = None,
+                      coord_override: Coord | None = None) -> bool:
+        if threshold is None:
+            threshold = self.get_threshold(template_name)
+        # Only measured while the timings are looked at
+        if not (self.profiler.enabled or self.metrics.enabled):
+            return self._detect_single(template_name, threshold, coord_override)
+        detection_start = time.perf_counter()
+        detected = self._detect_single(template_name, threshold, coord_override)
+        detection_time = time.perf_counter() - detection_start
+        self.profiler.record(self.detection_stages[template_name], detection_time)
+        self.metrics.inc("overstim_detections_total")
+        self.metrics.inc("overstim_detection_seconds_total", detection_time)
+        return detected
+
+    def _detect_single(self, template_name: str, threshold: float, coord_override: Coord | None) -> bool:
         # Get detection coordinates
         if coord_override is not None:
             coord = coord_override
         else:
-            coord = self.COORDS[template_name]
-        # Get top left points
-        points = [(coord.left, coord.top)]
-        if coord.more is not None:
-            points.extend(coord.more)
-        if coord.offsets is not None:
-            for offset in coord.offsets:
-                points.append((coord.left + offset[1], coord.top + offset[0]))
+            coord = self.coords[template_name]
         # Check each offset
-        template = self.templates[template_name]
-        height = template.shape[0] + coord.add_height
-        width = template.shape[1] + coord.add_width
-        for point in points:
-            left, top = point
-            cropped_frame = self.frame[top:top + height, left:left + width]
-            mask = self.masks.get(template_name, None)
-            result = cv2.matchTemplate(cropped_frame, template, cv2.TM_CCOEFF_NORMED, mask=mask)
-            score = float(numpy.nanmax(result))
+        best_score = self.scores.get(template_name, 0.0)
+        for point in self.get_points(coord):
+            score = self._match_point(template_name, coord, point)
+            best_score = max(best_score, score)
             if score > threshold:
+                self.scores[template_name] = best_score
                 return True
+        self.scores[template_name] = best_score
         return False
 
+    def _match_point(self, template_name: str, coord: Coord, point: tuple[int, int]) -> float:
+        template = self.templates[template_name]
+        height = template.shape[0] + coord.add_height
+        width = template.shape[1] + coord.add_width
+        left, top = point
+        cropped_frame = self.frame[top:top + height, left:left + width]
+        mask = self.masks.get(template_name, None)
+        result = cv2.matchTemplate(cropped_frame, template, cv2.TM_CCOEFF_NORMED, mask=mask)
+        return float(numpy.nanmax(result))
+
+    def match_score(self, template_name: str, coord_override: Coord | None = None) -> float:
+        # Best score over all points, without stopping at the first match
+        coord = coord_override if coord_override is not None else self.coords[template_name]
+        return max(self._match_point(template_name, coord, point) for point in self.get_points(coord))
+
     def detect_color(self, xy: tuple[int, int], target: float, deviation: float) -> bool:
         color = self.frame[xy[1], xy[0]] / 255.0
         diff = abs(color - target)
         return diff <= deviation
+
+
+class CaptureService:
+    def __init__(self, template_path: str) -> None:
+        self.template_path = template_path
+        self.computer_vision: ComputerVision | None = None
+        self.capture_device: tuple[int, int] | None = None
+
+    def acquire(self, config: Config) -> ComputerVision:
+        # Keep the camera and templates between runs, unless a different screen is captured
+        capture_device = (config.gpu_id, config.monitor_id)
+        if self.computer_vision is not None and self.capture_device != capture_device:
+            self.release()
+        if self.computer_vision is None:
+            self.computer_vision = ComputerVision(config, self.template_path)
+            self.capture_device = capture_device
+        else:
+            self.computer_vision.config = config
+            self.computer_vision.load_calibration(config.calibration_profile)
+            logging.info("Reusing screen capture")
+        return self.computer_vision
+
+    def release(self) -> None:
+        if self.computer_vision is not None:
+            self.computer_vision.release()
+            self.computer_vision = None
+            self.capture_device = None
@@ -19,85 +19,214 @@
 
 import asyncio
 import logging
+import os
 import time
 from collections.abc import Mapping, Callable
-from typing import NamedTuple
-
-from buttplug import Client, WebsocketConnector, ProtocolSpec, Device
 
+from .computer_vision import ComputerVision
+from .event_api import EventServer
 from .heroes import Hero2
-from .triggers import Trigger, Response, is_conditional
+from .metrics import Metrics
+from .music import MusicAnalysis, create_audio_source
+from .outputs import OutputState, create_outputs
+from .triggers import Trigger, Response
 from .player_state import PlayerState
-from .utils import Config, FPSCalculator
+from .profiler import Profiler
+from .session import DetectionFrame, SessionRecorder, dispatch_triggers
+from .stats import ControllerInfo, FrameStats, FrameStatsSnapshot
+from .utils import Config
 from .vibe import VibeManager
 
 
-class ControllerInfo(NamedTuple):
-    vibe_intensity: float = 0.0
-    current_hero: Hero2 = Hero2.OTHER
-    devices_connected: int = 0
-    fps: int = 0
-    calculation_time: float = 0.0
-    all_intensities: dict[Trigger, list[float]] = {}
-
-
 class Controller:
-    def __init__(self, config: Config, asset_path: str, update_info: Callable[[ControllerInfo], None]) -> None:
+    # Settings of the screen capture and the connections to Intiface, which are only applied by starting again
+    RESTART_FIELDS = ["gpu_id", "monitor_id", "using_intiface", "websocket_address", "additional_websocket_addresses"]
+    # Seconds between frame pacing summaries for the UI, which sort the frame times
+    FRAME_STATS_INTERVAL = 0.5
+
+    def __init__(self, config: Config, computer_vision: ComputerVision,
+                 update_info: Callable[[ControllerInfo], None], metrics: Metrics | None = None,
+                 path_log: str | None = None) -> None:
         self.config = config
+        # Settings last applied from the UI and the newest ones. The running settings in self.config keep the values of
+        # RESTART_FIELDS they were started with.
+        self.applied_config = config
+        self.new_config = config
         self.update_info = update_info
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.path_log = path_log
 
         # Input attributes
         self.responses: Mapping[Hero2, Mapping[Trigger, Response]] = {}
         self.stop_request = False
+        self.event_loop: asyncio.AbstractEventLoop | None = None
 
         # Prepare resources
-        self.client = Client("OverStim", ProtocolSpec.v3)
-        self.vibe_manager = VibeManager(self.config)
-        self.player_state = PlayerState(self.config, asset_path)
+        self.profiler = Profiler(enabled=self.config.stage_profiling)
+        self.vibe_manager = VibeManager(self.config, self.profiler, self.metrics)
+        self.outputs = create_outputs(self.config, self.profiler, self.metrics)
+        self.player_state = PlayerState(self.config, computer_vision)
+        self.session_recorder: SessionRecorder | None = None
+        self.event_server: EventServer | None = None
+        self.event_task: asyncio.Task | None = None
+        self.music: MusicAnalysis | None = None
+        computer_vision.profiler = self.profiler
+        computer_vision.metrics = self.metrics
 
         # Program state
-        self.fps_calculator = FPSCalculator()
+        self.frame_stats = FrameStats(target_rate=self.config.max_refresh_rate)
+        self.frame_stats_snapshot = FrameStatsSnapshot()
+        self.frame_stats_time = float("-inf")
         self.state_device_count = 0
 
     async def run(self) -> None:
-        scanning = False
+        self.event_loop = asyncio.get_running_loop()
         try:
 
-            # Connect to Intiface
-            if self.config.using_intiface:
-                connector = WebsocketConnector(self.config.websocket_address, logger=self.client.logger)
-                await self.client.connect(connector)
-                logging.info("Connected to Intiface")
-
-                if self.client.connected:
-                    await self.client.start_scanning()
-                    scanning = True
-                    if not self.config.continuous_scanning:
-                        await asyncio.sleep(0.2)
-                        await self.client.stop_scanning()
-                        scanning = False
-                    logging.info("Started scanning")
+            # Record detections to replay the session later
+            if self.config.record_session:
+                self.start_session_recording()
+            if self.config.record_frames:
+                self.start_frame_recording()
+            self.start_music()
+
+            # Connect the outputs, which then keep up with the intensity on their own tasks
+            await self.outputs.start()
+            await self.start_event_api()
 
             # Run main loop
             await self.loop()
 
         finally:
-            await self.vibe_manager.stop_all_devices(self.get_devices())
+            await self.stop_event_api()
+            self.stop_music()
+            self.vibe_manager.stop()
+            await self.outputs.stop_devices()
             self.player_state.stop_tracking()
-            if self.config.using_intiface and self.client.connected:
-                if scanning:
-                    await self.client.stop_scanning()
-                await self.client.disconnect()
-                logging.info("Disconnected.")
-
-    async def loop(self) -> None:
-        # Initialize player state
+            self.stop_session_recording()
+            self.player_state.computer_vision.stop_recording()
+            await self.outputs.close()
+            self.event_loop = None
+
+    def start_session_recording(self) -> None:
+        if self.path_log is None or self.session_recorder is not None:
+            return
+        filename = os.path.join(self.path_log, f"OverStim_Session_{time.strftime('%Y%m%d_%H%M%S')}.ostm")
+        self.session_recorder = SessionRecorder(filename, list(self.player_state.computer_vision.COORDS))
+
+    def stop_session_recording(self) -> None:
+        if self.session_recorder is not None:
+            self.session_recorder.close()
+            self.session_recorder = None
+
+    def start_frame_recording(self) -> None:
+        if self.path_log is None:
+            return
+        directory = os.path.join(self.path_log, f"OverStim_Frames_{time.strftime('%Y%m%d_%H%M%S')}")
+        self.player_state.computer_vision.start_recording(directory)
+
+    async def start_event_api(self) -> None:
+        if not self.config.event_api_port or self.event_server is not None:
+            return
+        event_server = EventServer(self.config.event_api_port, profiler=self.profiler, metrics=self.metrics)
+        try:
+            await event_server.start()
+        except OSError as e:
+            logging.error(f"Failed to accept events on port {self.config.event_api_port}.", exc_info=e)
+            return
+        self.event_server = event_server
+        self.event_task = asyncio.create_task(self.ingest_events(event_server), name="Event API")
+
+    async def stop_event_api(self) -> None:
+        if self.event_task is not None:
+            self.event_task.cancel()
+            await asyncio.gather(self.event_task, return_exceptions=True)
+            self.event_task = None
+        if self.event_server is not None:
+            await self.event_server.stop()
+            self.event_server = None
+
+    async def ingest_events(self, event_server: EventServer) -> None:
+        # Events are vibed as soon as they arrive, without waiting for the next frame. This task is the only consumer of
+        # the event queue, so it must never end on an error: the producers would wait for the full queue forever.
+        while True:
+            batches = await event_server.next_batches()
+            try:
+                event_server.apply(batches, self.vibe_manager, self.responses.get(self.player_state.hero.name, {}))
+                self.vibe_manager.update(time.time())
+                self.outputs.publish(self.vibe_manager.real_intensity, self.vibe_manager.take_pending_latencies())
+            except Exception as e:
+                logging.error("Failed to apply API events; continuing with the next ones.", exc_info=e)
+
+    def start_music(self) -> None:
+        if not self.config.music_source or self.music is not None:
+            return
+        try:
+            source = create_audio_source(self.config.music_source)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to play music from {self.config.music_source}.", exc_info=e)
+            return
+        self.music = MusicAnalysis(source, self.vibe_manager, self.config.music_depth, self.profiler, self.metrics)
+        self.music.start()
+        logging.info(f"Lucio's songs follow the music from {self.config.music_source}")
+
+    def stop_music(self) -> None:
+        if self.music is not None:
+            self.music.stop()
+            self.music = None
+
+    def set_buffer_sizes(self) -> None:
         self.player_state.supported_heroes[Hero2.LUCIO].crossfade_buffer_size = \
             self.config.lucio_crossfade_buffer
         self.player_state.supported_heroes[Hero2.MERCY].beam_disconnect_buffer_size = \
             self.config.mercy_beam_disconnect_buffer
         self.player_state.supported_heroes[Hero2.ZENYATTA].orb_disconnect_buffer_size = \
             self.config.zen_orb_disconnect_buffer
+
+    async def apply_config(self, config: Config) -> None:
+        # Applies each changed setting without starting over, the rest of the pipeline keeps running
+        self.applied_config = config
+        restart_fields = [name for name in self.RESTART_FIELDS if getattr(config, name) != getattr(self.config, name)]
+        if restart_fields:
+            logging.warning(f"Stop and start OverStim to apply: {', '.join(restart_fields)}")
+        config = config._replace(**{name: getattr(self.config, name) for name in self.RESTART_FIELDS})
+        changed = {name for name, value in config._asdict().items() if value != getattr(self.config, name)}
+        self.config = config
+        if not changed:
+            return
+        logging.info(f"Applying changed settings: {', '.join(sorted(changed))}")
+        self.vibe_manager.set_config(config)
+        await self.outputs.set_config(config)
+        self.player_state.config = config
+        self.player_state.computer_vision.set_config(config)
+        self.profiler.enabled = config.stage_profiling
+        self.set_buffer_sizes()
+        if "max_refresh_rate" in changed:
+            self.player_state.stop_tracking()
+            self.player_state.start_tracking(config.max_refresh_rate)
+            self.frame_stats.set_target_rate(config.max_refresh_rate)
+        if "record_session" in changed:
+            if config.record_session:
+                self.start_session_recording()
+            else:
+                self.stop_session_recording()
+        if "record_frames" in changed:
+            if config.record_frames:
+                self.start_frame_recording()
+            else:
+                self.player_state.computer_vision.stop_recording()
+        if "music_source" in changed:
+            self.stop_music()
+            self.start_music()
+        elif self.music is not None:
+            self.music.depth = config.music_depth
+        if "event_api_port" in changed:
+            await self.stop_event_api()
+            await self.start_event_api()
+
+    async def loop(self) -> None:
+        # Initialize player state
+        self.set_buffer_sizes()
         self.player_state.start_tracking(self.config.max_refresh_rate)
 
         # Initialize variables
@@ -109,108 +238,39 @@ class Controller:
             # Gives main time to respond to pings from Intiface
             await asyncio.sleep(0)
 
-            if self.config.using_intiface:
-                assert self.client.connected, "Lost connection to Intiface."
+            # Settings changed while running are applied between iterations
+            new_config = self.new_config
+            if new_config is not self.applied_config:
+                await self.apply_config(new_config)
 
             counter += 1
-            devices = self.get_devices()
             current_time = time.time()
-            await self.vibe_manager.update(devices, current_time)
+            self.vibe_manager.update(current_time)
+            self.outputs.publish(self.vibe_manager.real_intensity, self.vibe_manager.take_pending_latencies())
+            self.metrics.inc("overstim_loops_total")
+            self.metrics.set("overstim_intensity", self.vibe_manager.real_intensity)
 
             if not self.player_state.is_dead or (
                     self.player_state.is_dead and
                     current_time >= last_refresh + (1 / float(self.config.dead_refresh_rate))):
                 last_refresh = current_time
-                self.player_state.wait_for_frame()
+                frame_wait_start = time.perf_counter()
+                # Wait in another thread, so the event loop stays free for pings and emergency stops
+                await asyncio.to_thread(self.player_state.wait_for_frame)
+                self.profiler.record("frame wait", time.perf_counter() - frame_wait_start)
                 processing_time_start = time.time()
                 self.player_state.refresh()
+                trigger_start = time.perf_counter()
+                self.vibe_manager.frame_time = self.player_state.frame_time
 
                 # Add other Vibes if not hacked
-                for trigger, response in self.responses[self.player_state.hero.name].items():
-                    if not is_conditional(trigger):
-
-                        if trigger is Trigger.ELIMINATION:
-                            new_elims = self.player_state.new_notifs.get("elimination", 0)
-                            if new_elims > 0:
-                                self.vibe_manager.add_vibe(trigger, response)
-
-                        elif trigger is Trigger.ASSIST:
-                            new_assists = self.player_state.new_notifs.get("assist", 0)
-                            if new_assists > 0:
-                                self.vibe_manager.add_vibe(trigger, response)
-
-                        elif trigger is Trigger.SAVE:
-                            new_saves = self.player_state.new_notifs.get("save", 0)
-                            if new_saves > 0 and (self.player_state.hero.name is not Hero2.MERCY or
-                                                  not self.player_state.hero.resurrecting):
-                                self.vibe_manager.add_vibe(trigger, response)
-
-                        elif trigger is Trigger.RESURRECT:
-                            if self.player_state.hero.resurrecting and \
-                                    not self.vibe_manager.vibe_for_trigger_created_within_seconds(trigger, 3):
-                                self.vibe_manager.add_vibe(trigger, response)
-
-                        elif trigger is Trigger.FLASH_HEAL:
-                            if self.player_state.hero.flash_heal:
-                                self.vibe_manager.add_vibe(trigger, response, suppression_secs=3.0)
-
-                        elif trigger is Trigger.GLIDE_BOOST:
-                            if self.player_state.hero.glide_boost and \
-                                    not self.vibe_manager.vibe_exists_for_trigger(trigger):
-                                self.vibe_manager.add_vibe(trigger, response)
-
-                        elif trigger is Trigger.PULSAR_TORPEDOES_FIRE:
-                            if self.player_state.hero.pulsar_torpedoes_firing and \
-                                    not self.vibe_manager.vibe_exists_for_trigger(trigger):
-                                self.vibe_manager.add_vibe(trigger, response)
-
-                        elif trigger is Trigger.ENDORSEMENT_RECEIVED:
-                            if self.player_state.endorsed:
-                                self.vibe_manager.add_vibe(trigger, response, suppression_secs=4.8)
-
-                    else:
-
-                        if trigger is Trigger.HACKED_BY_SOMBRA:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hacked)
-
-                        elif trigger is Trigger.BEAMED_BY_MERCY:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.being_beamed)
-
-                        elif trigger is Trigger.ORBED_BY_ZENYATTA:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.being_orbed)
-
-                        elif trigger is Trigger.PULSAR_TORPEDOES_LOCK:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response,
-                                self.player_state.hero.pulsar_torpedoes_lock and
-                                not self.vibe_manager.vibe_exists_for_trigger(Trigger.PULSAR_TORPEDOES_FIRE))
-
-                        elif trigger is Trigger.HEALING_SONG:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hero.healing_song)
-
-                        elif trigger is Trigger.SPEED_SONG:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hero.speed_song)
-
-                        elif trigger is Trigger.HEAL_BEAM:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hero.heal_beam)
-
-                        elif trigger is Trigger.DAMAGE_BEAM:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hero.damage_beam)
-
-                        elif trigger is Trigger.HARMONY_ORB:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hero.harmony_orb)
-
-                        elif trigger is Trigger.DISCORD_ORB:
-                            self.vibe_manager.toggle_vibe_to_condition(
-                                trigger, response, self.player_state.hero.discord_orb)
+                frame = DetectionFrame.from_player_state(self.player_state, current_time)
+                if self.event_server is not None:
+                    frame = self.event_server.apply_conditions(frame)
+                dispatch_triggers(self.vibe_manager, self.responses[frame.hero], frame)
+                if self.session_recorder is not None:
+                    self.session_recorder.write_frame(frame, self.responses)
+                self.profiler.record("triggers", time.perf_counter() - trigger_start)
 
                 if self.player_state.hero_auto_detect and \
                         self.player_state.detected_hero is not self.player_state.hero.name:
@@ -218,16 +278,32 @@ class Controller:
                     self.vibe_manager.clear_vibes()
                     self.player_state.switch_hero(self.player_state.hero_auto_detect, self.player_state.detected_hero)
 
+                devices = self.outputs.devices
                 processing_time_end = time.time()
+                self.frame_stats.update(current_time)
+                if current_time - self.frame_stats_time >= self.FRAME_STATS_INTERVAL:
+                    self.frame_stats_snapshot = self.frame_stats.snapshot()
+                    self.frame_stats_time = current_time
+                self.metrics.inc("overstim_frames_total")
+                self.metrics.set("overstim_fps", self.frame_stats.fps)
+                self.metrics.set("overstim_processing_seconds", processing_time_end - processing_time_start)
+                self.metrics.set("overstim_devices_connected", len(devices))
+                self.metrics.set("overstim_active_vibes", self.vibe_manager.vibe_count)
                 self.update_info(ControllerInfo(
                     vibe_intensity=self.vibe_manager.real_intensity,
                     current_hero=self.player_state.hero.name,
                     devices_connected=len(devices),
-                    fps=self.fps_calculator.update(current_time),
+                    fps=round(self.frame_stats.fps),
+                    frame_stats=self.frame_stats_snapshot,
                     calculation_time=processing_time_end - processing_time_start,
-                    all_intensities=self.vibe_manager.all_intensities))
-
-        await self.vibe_manager.stop_all_devices(self.get_devices())
+                    trigger_intensities=self.vibe_manager.trigger_intensities,
+                    trigger_counts=self.vibe_manager.trigger_counts))
+                self.outputs.publish_state(OutputState(current_time, self.vibe_manager.real_intensity,
+                                                       self.frame_stats.fps, self.player_state.hero.name,
+                                                       self.vibe_manager.trigger_intensities))
+
+        self.vibe_manager.stop()
+        await self.outputs.stop_devices()
         logging.info("Stopped.")
 
         duration = time.time() - start_time
@@ -235,10 +311,37 @@ class Controller:
             f"Loops: {counter} | "
             f"Loops per second: {round(counter / max(duration, 1.0), 2)} | "
             f"Avg. time: {round(1000 * (duration / max(counter, 1)), 2)}ms")
-
-    def get_devices(self) -> list[Device]:
-        return [device for device in self.client.devices.values()
-                if device.name not in self.config.excluded_device_names]
+        logging.info(f"Frame pacing: {self.frame_stats.snapshot()}")
+        if self.profiler.enabled:
+            logging.info(f"Stage timings in ms:\n{self.profiler.format()}")
+
+    def emergency_stop(self, request_time: float | None = None) -> None:
+        # Can be called from any thread. All devices are stopped on the event loop as soon as it is free, without
+        # waiting for the current loop iteration to finish.
+        if request_time is None:
+            request_time = time.perf_counter()
+        self.stop_request = True
+        event_loop = self.event_loop
+        if event_loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.stop_devices_now(request_time), event_loop)
+        except RuntimeError:
+            # The event loop is already closed, and the devices were stopped when the controller finished
+            pass
+
+    async def stop_devices_now(self, request_time: float) -> None:
+        self.outputs.halt()
+        self.vibe_manager.stop()
+        await self.outputs.stop_devices()
+        latency = time.perf_counter() - request_time
+        self.metrics.set("overstim_emergency_stop_seconds", latency)
+        logging.warning(f"Emergency stop: Devices stopped {latency * 1000:.2f}ms after the request")
+
+    def update_config(self, config: Config) -> list[str]:
+        # Can be called from other threads. Returns the changed settings that only apply after starting again.
+        self.new_config = config
+        return [name for name in self.RESTART_FIELDS if getattr(config, name) != getattr(self.config, name)]
 
     def update_user_settings(
             self,
@@ -0,0 +1,304 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Accepts trigger events from other programs on the same computer, such as game log parsers, stream deck buttons or
+# music analysis, over a websocket on localhost. Events are vibed like detections from the screen.
+#
+# Every message is a JSON event or a list of events, which are applied together:
+#   {"trigger": "ELIMINATION"}                               One vibe with the response set for the trigger and hero
+#   {"trigger": "ELIMINATION", "response": {"intensity": 0.8, "duration": 2}}
+#                                                            One vibe with this response; missing fields are defaults
+#                                                            Intensities are from 0 to 1, durations up to 60 seconds
+#   {"trigger": "HEALING_SONG", "active": true}              Conditional triggers vibe until they are inactive again,
+#                                                            or every producer that made them active disconnected
+#   "id" is optional and returned in the reply
+#
+# Every message is answered once its events are applied, with the time from receiving them:
+#   {"ids": [...], "applied": 2, "errors": [{"index": 1, "error": "..."}], "latency_ms": 0.2}
+#
+# Messages are queued up to a limit. While the queue is full, no more messages are read from the producers, which
+# slows them down instead of delaying or dropping events.
+
+import asyncio
+import itertools
+import json
+import logging
+import math
+import time
+from collections.abc import Mapping
+from typing import Any, NamedTuple
+
+import websockets
+
+from .metrics import Metrics
+from .profiler import Profiler
+from .session import CONDITION_FIELDS, DetectionFrame
+from .triggers import Trigger, Response, ResponseType, Pattern, Vibration, is_conditional
+from .vibe import VibeManager
+
+
+# Limits of responses from other programs, the same as in the response editor
+MAX_DURATION = 60.0
+MAX_PATTERN_LOOP = 1000
+MAX_PATTERN_LENGTH = 100
+
+
+def parse_number(value: Any, name: str, minimum: float, maximum: float) -> float:
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number, not {value!r}.")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, not {value!r}.")
+    if not (math.isfinite(number) and minimum <= number <= maximum):
+        raise ValueError(f"{name} must be between {minimum:g} and {maximum:g}, not {value!r}.")
+    return number
+
+
+def parse_response(values: Any) -> Response:
+    # Every field is converted and checked here, so a response from another program can not fail later in the vibes.
+    # Missing fields are the defaults.
+    if not isinstance(values, dict):
+        raise ValueError("The response must be a JSON object.")
+    default = Response()
+    try:
+        response_type = ResponseType[str(values.get("type", default.type.name)).upper()]
+    except KeyError:
+        raise ValueError(f"Unknown response type {values.get('type')!r}.")
+    pattern_values = values.get("pattern", [])
+    if not isinstance(pattern_values, list) or len(pattern_values) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"pattern must be a list of at most {MAX_PATTERN_LENGTH} vibrations.")
+    pattern = Pattern()
+    for index, vibration_values in enumerate(pattern_values):
+        if not isinstance(vibration_values, dict):
+            raise ValueError(f"pattern[{index}] must be a JSON object.")
+        pattern.append(Vibration(
+            intensity=parse_number(vibration_values.get("intensity"), f"pattern[{index}].intensity", 0.0, 1.0),
+            duration=parse_number(vibration_values.get("duration"), f"pattern[{index}].duration", 0.0, MAX_DURATION)))
+    pattern_loop = parse_number(values.get("pattern_loop", default.pattern_loop), "pattern_loop", 1, MAX_PATTERN_LOOP)
+    if not pattern_loop.is_integer():
+        raise ValueError(f"pattern_loop must be a whole number, not {values['pattern_loop']!r}.")
+    response = Response(type=response_type,
+                        intensity=parse_number(values.get("intensity", default.intensity), "intensity", 0.0, 1.0),
+                        duration=parse_number(values.get("duration", default.duration), "duration", 0.0,
+                                              MAX_DURATION),
+                        pattern=pattern,
+                        pattern_loop=int(pattern_loop))
+    try:
+        response.validate()
+    except AssertionError as e:
+        raise ValueError(str(e))
+    return response
+
+
+class ApiEvent(NamedTuple):
+    trigger: Trigger
+    response: Response | None = None
+    active: bool | None = None
+    id: Any = None
+
+    @classmethod
+    def from_dict(cls, values: Any) -> "ApiEvent":
+        if not isinstance(values, dict):
+            raise ValueError("An event must be a JSON object.")
+        try:
+            trigger = Trigger[str(values["trigger"]).upper()]
+        except KeyError:
+            raise ValueError(f"Unknown trigger {values.get('trigger')!r}.")
+        response = None
+        if values.get("response") is not None:
+            try:
+                response = parse_response(values["response"])
+            except ValueError as e:
+                raise ValueError(f"Invalid response: {e}")
+        active = values.get("active")
+        if is_conditional(trigger):
+            if not isinstance(active, bool):
+                raise ValueError(f"{trigger.name} is conditional and needs \"active\": true or false.")
+        elif active is not None:
+            raise ValueError(f"{trigger.name} is not conditional.")
+        return cls(trigger, response, active, values.get("id"))
+
+
+class EventBatch:
+    # Events of one message, with the errors of the events that could not be parsed
+    def __init__(self, events: list[tuple[int, ApiEvent]], errors: list[dict], received_time: float,
+                 replies: asyncio.Queue, producer: int = 0, release: bool = False) -> None:
+        self.events = events
+        self.errors = errors
+        self.received_time = received_time
+        self.replies = replies
+        # Connection that sent the events, and whether it closed and its conditions are released
+        self.producer = producer
+        self.release = release
+        self.ids = []
+
+    def reply(self, latency: float) -> None:
+        self.replies.put_nowait(json.dumps({"ids": self.ids, "applied": len(self.ids), "errors": self.errors,
+                                            "latency_ms": round(1000 * latency, 3)}))
+
+
+class EventServer:
+    MAX_MESSAGE_SIZE = 1 << 16
+    # Limit of the events applied at once, so a flood of events does not hold up the detections
+    MAX_EVENTS_PER_UPDATE = 256
+
+    def __init__(self, port: int, host: str = "127.0.0.1", queue_size: int = 64, profiler: Profiler | None = None,
+                 metrics: Metrics | None = None) -> None:
+        self.host = host
+        self.port = port
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.queue: asyncio.Queue[EventBatch] = asyncio.Queue(queue_size)
+        self.server = None
+        self.producer_ids = itertools.count(1)
+        # Conditional triggers held active by producers, with the connections holding them. Detections from the screen
+        # can not end them.
+        self.conditions: dict[Trigger, set[int]] = {}
+
+    async def start(self) -> None:
+        self.server = await websockets.serve(self.handle_connection, self.host, self.port,
+                                             max_size=self.MAX_MESSAGE_SIZE)
+        if self.port == 0:
+            self.port = next(iter(self.server.sockets)).getsockname()[1]
+        logging.info(f"Accepting events at {self.address}")
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    @property
+    def address(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def handle_connection(self, connection, *args) -> None:
+        producer = next(self.producer_ids)
+        replies: asyncio.Queue[str] = asyncio.Queue()
+        sender_task = asyncio.create_task(self.send_replies(connection, replies))
+        sent_conditions = False
+        try:
+            async for data in connection:
+                batch = self.parse_message(data, time.perf_counter(), replies, producer)
+                if batch.events:
+                    sent_conditions = sent_conditions or any(event.active for _, event in batch.events)
+                    # Waits while the queue is full, which stops reading from this producer
+                    await self.queue.put(batch)
+                else:
+                    batch.reply(0.0)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender_task.cancel()
+            if sent_conditions:
+                # Queued after the events of this producer, so the conditions it started last are released as well
+                await self.queue.put(EventBatch([], [], time.perf_counter(), replies, producer, release=True))
+
+    @staticmethod
+    async def send_replies(connection, replies: asyncio.Queue[str]) -> None:
+        try:
+            while True:
+                await connection.send(await replies.get())
+        except websockets.ConnectionClosed:
+            pass
+
+    def parse_message(self, data: str | bytes, received_time: float, replies: asyncio.Queue,
+                      producer: int = 0) -> EventBatch:
+        events = []
+        errors = []
+        try:
+            values = json.loads(data)
+        except ValueError as e:
+            errors.append({"index": 0, "error": f"Invalid JSON: {e}"})
+            values = []
+        for index, event_values in enumerate(values if isinstance(values, list) else [values]):
+            try:
+                events.append((index, ApiEvent.from_dict(event_values)))
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+        if errors:
+            self.metrics.inc("overstim_api_events_rejected_total", len(errors))
+        return EventBatch(events, errors, received_time, replies, producer)
+
+    async def next_batches(self) -> list[EventBatch]:
+        # Waits for events, then takes everything that is queued up to the limit
+        batches = [await self.queue.get()]
+        event_count = len(batches[0].events)
+        while event_count < self.MAX_EVENTS_PER_UPDATE and not self.queue.empty():
+            batch = self.queue.get_nowait()
+            batches.append(batch)
+            event_count += len(batch.events)
+        return batches
+
+    def apply(self, batches: list[EventBatch], vibe_manager: VibeManager,
+              responses: Mapping[Trigger, Response]) -> None:
+        for batch in batches:
+            if batch.release:
+                self.release_conditions(batch.producer, vibe_manager)
+                continue
+            for index, event in batch.events:
+                response = event.response if event.response is not None else responses.get(event.trigger)
+                if response is None:
+                    batch.errors.append({"index": index, "error": f"{event.trigger.name} is disabled for this hero."})
+                    self.metrics.inc("overstim_api_events_rejected_total")
+                    continue
+                try:
+                    self.apply_event(event, response, vibe_manager, batch.received_time, batch.producer)
+                except Exception as e:
+                    # The other events and producers keep going
+                    logging.error(f"Failed to apply API event {event}.", exc_info=e)
+                    batch.errors.append({"index": index, "error": f"Failed to apply the event: {e!r}"})
+                    self.metrics.inc("overstim_api_events_rejected_total")
+                    continue
+                batch.ids.append(event.id)
+            latency = time.perf_counter() - batch.received_time
+            self.profiler.record("api events", latency)
+            self.metrics.inc("overstim_api_events_total", len(batch.ids))
+            if batch.errors:
+                logging.debug(f"Rejected API events: {batch.errors}")
+            batch.reply(latency)
+
+    def apply_event(self, event: ApiEvent, response: Response, vibe_manager: VibeManager,
+                    received_time: float, producer: int = 0) -> None:
+        if event.active is None:
+            vibe_manager.add_vibe(event.trigger, response, frame_time=received_time)
+        else:
+            vibe_manager.toggle_vibe_to_condition(event.trigger, response, event.active, frame_time=received_time)
+            if event.active:
+                self.conditions.setdefault(event.trigger, set()).add(producer)
+            else:
+                # Ends the condition for every producer, as the screen would
+                self.conditions.pop(event.trigger, None)
+
+    def release_conditions(self, producer: int, vibe_manager: VibeManager) -> None:
+        # A producer disconnected, so the conditions only it held end. The next frame starts them again if they are
+        # still on the screen.
+        for trigger, producers in list(self.conditions.items()):
+            producers.discard(producer)
+            if not producers:
+                del self.conditions[trigger]
+                logging.debug(f"Released {trigger.name}, its producer disconnected")
+                vibe_manager.clear_vibes(trigger)
+
+    def apply_conditions(self, frame: DetectionFrame) -> DetectionFrame:
+        # Conditions held by producers stay active in every frame until they are released
+        if not self.conditions:
+            return frame
+        return frame._replace(**{CONDITION_FIELDS[trigger]: True for trigger in self.conditions})
@@ -0,0 +1,261 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Frame recordings only keep the regions that are checked by the detections, in grayscale at the base resolution.
+# A recording is a directory with:
+#   index.json: Resolution, regions as [top, left, height, width], and the chunks with their frame counts
+#   chunk_00000.bin: Frames as f64 timestamp, u32 length, and the zlib-compressed regions one after another
+#   chunk_00000.idx: f64 timestamp, u64 offset, u32 length for every frame in the chunk
+
+import abc
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import NamedTuple
+
+import numpy
+
+
+class Region(NamedTuple):
+    top: int
+    left: int
+    height: int
+    width: int
+
+
+class FrameSource(abc.ABC):
+    @property
+    @abc.abstractmethod
+    def resolution(self) -> tuple[int, int]:
+        pass
+
+    def start(self, target_fps: int) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def release(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_latest_frame(self) -> numpy.ndarray:
+        pass
+
+
+class DxcamFrameSource(FrameSource):
+    def __init__(self, gpu_id: int, monitor_id: int) -> None:
+        # Only available on Windows
+        import dxcam_cpp
+        self.camera = dxcam_cpp.create(gpu_id, monitor_id, max_buffer_len=1)
+        test_frame_shape = self.camera.grab().shape
+        self._resolution = (test_frame_shape[1], test_frame_shape[0])
+        logging.info(f"Detected monitor resolution {(self.camera.width, self.camera.height)} "
+                     f"(test of new approach)")
+
+    @property
+    def resolution(self) -> tuple[int, int]:
+        return self._resolution
+
+    def start(self, target_fps: int) -> None:
+        self.camera.start(target_fps=target_fps, video_mode=True)
+
+    def stop(self) -> None:
+        self.camera.stop()
+
+    def release(self) -> None:
+        self.camera.release()
+
+    def get_latest_frame(self) -> numpy.ndarray:
+        return self.camera.get_latest_frame()
+
+
+class FrameRecorder:
+    VERSION = 1
+    FRAME = struct.Struct("<dI")
+    INDEX = struct.Struct("<dQI")
+    QUEUE_SIZE = 64
+    # Seconds to wait for the writer when closing
+    CLOSE_TIMEOUT = 5.0
+
+    def __init__(self, directory: str, resolution: tuple[int, int], regions: list[Region],
+                 chunk_frames: int = 1800) -> None:
+        self.directory = directory
+        self.resolution = resolution
+        self.regions = regions
+        self.chunk_frames = chunk_frames
+        self.chunks: list[dict] = []
+        self.frame_count = 0
+        self.dropped = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        # Compressing and writing happens in the background, frames are dropped if it falls behind
+        self.queue: queue.Queue[tuple[float, bytes] | None] = queue.Queue(self.QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.write_chunks, name="FrameRecorder", daemon=True)
+        self.thread.start()
+        logging.info(f"Recording {len(regions)} regions per frame to {directory}")
+
+    def add(self, timestamp: float, frame: numpy.ndarray) -> None:
+        data = b"".join(frame[region.top:region.top + region.height, region.left:region.left + region.width].tobytes()
+                        for region in self.regions)
+        try:
+            self.queue.put_nowait((timestamp, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                # The writer fell behind, so a frame makes room for the end of the recording
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+                self.queue.put_nowait(None)
+            self.thread.join(self.CLOSE_TIMEOUT)
+            if self.thread.is_alive():
+                logging.warning(f"Stopped waiting for the frame recording to {self.directory} to be written")
+                return
+        ratio = self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
+        logging.info(f"Recorded {self.frame_count} frames to {self.directory} | Dropped: {self.dropped} | "
+                     f"Compression ratio: {ratio:.1f}")
+
+    def write_chunks(self) -> None:
+        try:
+            # An empty recording can be played as well
+            self.write_index()
+            item = self.queue.get()
+            while item is not None:
+                # A chunk is only started with a frame to write
+                name = f"chunk_{len(self.chunks):05d}"
+                entries = []
+                with open(os.path.join(self.directory, f"{name}.bin"), "wb") as file:
+                    while True:
+                        timestamp, data = item
+                        compressed = zlib.compress(data, 1)
+                        entries.append((timestamp, file.tell(), len(compressed)))
+                        file.write(self.FRAME.pack(timestamp, len(compressed)) + compressed)
+                        self.raw_bytes += len(data)
+                        self.compressed_bytes += len(compressed)
+                        if len(entries) == self.chunk_frames:
+                            break
+                        item = self.queue.get()
+                        if item is None:
+                            break
+                with open(os.path.join(self.directory, f"{name}.idx"), "wb") as file:
+                    for entry in entries:
+                        file.write(self.INDEX.pack(*entry))
+                self.frame_count += len(entries)
+                self.chunks.append({"name": name, "frames": len(entries), "start": entries[0][0],
+                                    "end": entries[-1][0]})
+                self.write_index()
+                if item is not None:
+                    item = self.queue.get()
+        except Exception as e:
+            # Frames are dropped from now on, the detections keep going
+            logging.error(f"Failed to write the frame recording to {self.directory}.", exc_info=e)
+
+    def write_index(self) -> None:
+        index = {
+            "version": self.VERSION,
+            "resolution": list(self.resolution),
+            "regions": [list(region) for region in self.regions],
+            "chunks": self.chunks,
+        }
+        filename = os.path.join(self.directory, "index.json")
+        with open(filename + ".tmp", "w") as file:
+            json.dump(index, file)
+        os.replace(filename + ".tmp", filename)
+
+
+class RecordedFrameSource(FrameSource):
+    def __init__(self, directory: str, speed: float = 1.0, loop: bool = False) -> None:
+        # Plays back at the recorded pace times the speed, or as fast as possible at speed 0
+        self.directory = directory
+        self.speed = speed
+        self.loop = loop
+        with open(os.path.join(directory, "index.json")) as file:
+            index = json.load(file)
+        if index["version"] != FrameRecorder.VERSION:
+            raise ValueError(f"{directory} is not a supported OverStim frame recording")
+        self._resolution = tuple(index["resolution"])
+        self.regions = [Region(*region) for region in index["regions"]]
+        self.chunk_names = [chunk["name"] for chunk in index["chunks"]]
+        self.frame_count = sum(chunk["frames"] for chunk in index["chunks"])
+        # Frames are sparse: only the recorded regions change, everything else stays black
+        self.frame = numpy.zeros((self._resolution[1], self._resolution[0]), dtype=numpy.uint8)
+        self.frames = self.read_frames()
+        self.finished = False
+        self.timestamp = 0.0
+        self.first_timestamp: float | None = None
+        self.start_time = 0.0
+
+    @property
+    def resolution(self) -> tuple[int, int]:
+        return self._resolution
+
+    def start(self, target_fps: int) -> None:
+        self.first_timestamp = None
+
+    def read_frames(self):
+        for name in self.chunk_names:
+            with open(os.path.join(self.directory, f"{name}.idx"), "rb") as file:
+                entries = list(FrameRecorder.INDEX.iter_unpack(file.read()))
+            with open(os.path.join(self.directory, f"{name}.bin"), "rb") as file:
+                for timestamp, offset, length in entries:
+                    file.seek(offset + FrameRecorder.FRAME.size)
+                    yield timestamp, file.read(length)
+
+    def get_latest_frame(self) -> numpy.ndarray:
+        try:
+            self.timestamp, compressed = next(self.frames)
+        except StopIteration:
+            if not self.loop or not self.frame_count:
+                # Keep returning the last frame
+                self.finished = True
+                return self.frame
+            self.frames = self.read_frames()
+            self.first_timestamp = None
+            self.timestamp, compressed = next(self.frames)
+        data = zlib.decompress(compressed)
+        position = 0
+        for region in self.regions:
+            size = region.height * region.width
+            self.frame[region.top:region.top + region.height, region.left:region.left + region.width] = \
+                numpy.frombuffer(data, dtype=numpy.uint8, count=size, offset=position).reshape(
+                    region.height, region.width)
+            position += size
+        # Pace the frames like they were recorded
+        if self.first_timestamp is None:
+            self.first_timestamp = self.timestamp
+            self.start_time = time.perf_counter()
+        elif self.speed > 0.0:
+            delay = (self.timestamp - self.first_timestamp) / self.speed - (time.perf_counter() - self.start_time)
+            if delay > 0.0:
+                time.sleep(delay)
+        return self.frame
@@ -0,0 +1,144 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Runs the controller without the Qt user interface, configured by a profile file. Stops on Ctrl+C or SIGTERM.
+#
+# Usage: python -m overstim.headless --write-profile profile.json
+#        python -m overstim.headless --profile profile.json --stats-interval 5
+#        python -m overstim.headless --profile profile.json --frames log/OverStim_Frames_20250101_120000
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+from .computer_vision import ComputerVision
+from .controller import Controller
+from .frame_source import FrameSource, RecordedFrameSource
+from .metrics import Metrics, MetricsExporter
+from .profile import Profile, default_profile, load_profile, save_profile
+from .stats import ControllerInfo
+from .utils import set_log_level
+
+
+class HeadlessRunner:
+    def __init__(self, profile: Profile, path: str, path_log: str, frame_source: FrameSource | None = None,
+                 duration: float = 0.0, stats_interval: float = 5.0) -> None:
+        self.profile = profile
+        self.path_log = path_log
+        self.duration = duration
+        self.stats_interval = stats_interval
+        self.frame_source = frame_source
+        self.info = ControllerInfo()
+        self.metrics = Metrics()
+        computer_vision = ComputerVision(profile.config, os.path.join(path, "assets", "templates"), frame_source)
+        self.controller = Controller(profile.config, computer_vision, self.update_info, self.metrics, path_log)
+        self.controller.update_user_settings(
+            hero_auto_detect=False, hero=profile.playing_hero, responses=profile.responses())
+
+    def update_info(self, info: ControllerInfo) -> None:
+        self.info = info
+
+    def stop(self) -> None:
+        if not self.controller.stop_request:
+            logging.info("Stopping ...")
+        self.controller.stop_request = True
+
+    async def report(self) -> None:
+        start_time = time.time()
+        last_report = start_time
+        while True:
+            await asyncio.sleep(0.1)
+            now = time.time()
+            if self.duration > 0.0 and now - start_time >= self.duration:
+                self.stop()
+            if isinstance(self.frame_source, RecordedFrameSource) and self.frame_source.finished:
+                self.stop()
+            if self.stats_interval > 0.0 and now - last_report >= self.stats_interval:
+                last_report = now
+                print(f"[{now - start_time:7.1f}s] Hero: {self.info.current_hero.name} | "
+                      f"Intensity: {self.info.vibe_intensity * 100:.0f}% | Devices: {self.info.devices_connected} | "
+                      f"{self.info.frame_stats} | Processing: {1000 * self.info.calculation_time:.1f}ms",
+                      flush=True)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except NotImplementedError:
+                # Windows event loops do not support signal handlers
+                signal.signal(signal_number, lambda *args: loop.call_soon_threadsafe(self.stop))
+        report_task = asyncio.create_task(self.report())
+        try:
+            await self.controller.run()
+        finally:
+            report_task.cancel()
+            self.controller.player_state.computer_vision.release()
+        print(f"Frame pacing: {self.controller.frame_stats.snapshot()}")
+        if self.controller.profiler.enabled:
+            print(f"Stage timings in ms:\n{self.controller.profiler.format()}")
+
+
+def main() -> None:
+    path = os.path.dirname(os.path.dirname(__file__))
+    parser = argparse.ArgumentParser(description="Run OverStim without the user interface.")
+    parser.add_argument("--profile", help="Profile with the settings and trigger responses; defaults if not given.")
+    parser.add_argument("--write-profile", help="Write the default profile to this file and exit.")
+    parser.add_argument("--frames", help="Use a frame recording instead of capturing the screen.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Speed of the frame recording relative to real time, 0 for as fast as possible.")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="Stop after this many seconds, 0 to run until stopped.")
+    parser.add_argument("--stats-interval", type=float, default=5.0,
+                        help="Print stats every this many seconds, 0 to disable.")
+    parser.add_argument("--log-dir", default=os.path.join(path, "log"), help="Folder for recordings and metrics.")
+    args = parser.parse_args()
+
+    if args.write_profile:
+        save_profile(default_profile(), args.write_profile)
+        print(f"Wrote default profile to {args.write_profile}")
+        return
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout,
+                        format="%(asctime)s.%(msecs)d - %(levelname)s - %(module)s.%(funcName)s:%(lineno)d - "
+                               "%(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    profile = load_profile(args.profile) if args.profile else default_profile()
+    set_log_level(profile.config.log_level)
+    os.makedirs(args.log_dir, exist_ok=True)
+    frame_source = RecordedFrameSource(args.frames, args.speed) if args.frames else None
+
+    runner = HeadlessRunner(profile, path, args.log_dir, frame_source, args.duration, args.stats_interval)
+    metrics_exporter = None
+    if profile.config.metrics_export != "off":
+        metrics_exporter = MetricsExporter(
+            runner.metrics, profile.config.metrics_export, profile.config.metrics_port, args.log_dir)
+        metrics_exporter.start()
+    try:
+        asyncio.run(runner.run())
+    finally:
+        if metrics_exporter is not None:
+            metrics_exporter.stop()
+
+
+if __name__ == "__main__":
+    main()
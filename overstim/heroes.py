@@ -19,8 +19,10 @@
 
 import abc
 import enum
+from typing import TYPE_CHECKING
 
-from .computer_vision import ComputerVision
+if TYPE_CHECKING:
+    from .computer_vision import ComputerVision
 
 
 class Hero2(enum.Enum):
@@ -41,16 +43,16 @@ class Hero(abc.ABC):
             self.weapons = weapons
         self.reset_attributes()
 
-    def detect_hero(self, computer_vision: ComputerVision) -> bool:
+    def detect_hero(self, computer_vision: "ComputerVision") -> bool:
         for weapon in self.weapons:
-            if computer_vision.detect_single(weapon, threshold=0.97):
+            if computer_vision.detect_single(weapon):
                 return True
         return False
 
     def reset_attributes(self) -> None:
         pass
 
-    def detect_all(self, computer_vision: ComputerVision) -> None:
+    def detect_all(self, computer_vision: "ComputerVision") -> None:
         pass
 
 
@@ -58,7 +60,7 @@ class Other(Hero):
     def __init__(self) -> None:
         super().__init__(name=Hero2.OTHER, role="Other")
 
-    def detect_hero(self, computer_vision: ComputerVision) -> bool:
+    def detect_hero(self, computer_vision: "ComputerVision") -> bool:
         return False
 
 
@@ -75,17 +77,16 @@ class Juno(Hero):
         self.pulsar_torpedoes_lock = False
         self.pulsar_torpedoes_firing = False
 
-    def detect_glide_boost(self, computer_vision: ComputerVision) -> None:
-        self.glide_boost = computer_vision.detect_single("juno_glide_boost", threshold=0.85)
+    def detect_glide_boost(self, computer_vision: "ComputerVision") -> None:
+        self.glide_boost = computer_vision.detect_single("juno_glide_boost")
 
-    def detect_pulsar_torpedoes(self, computer_vision: ComputerVision) -> None:
+    def detect_pulsar_torpedoes(self, computer_vision: "ComputerVision") -> None:
         if computer_vision.detect_single("juno_pulsar_torpedoes"):
             self.pulsar_torpedoes_buffer = 11
         else:
             self.pulsar_torpedoes_buffer -= 1
         if self.pulsar_torpedoes_buffer >= 0:
-            coords_l = (464, 346)
-            coords_r = (1920 - coords_l[0], coords_l[1])
+            coords_l, coords_r = computer_vision.COLOR_POINTS
             self.pulsar_torpedoes_firing = (computer_vision.detect_color(coords_l, 1.0, 0.05) or
                                             computer_vision.detect_color(coords_r, 1.0, 0.05))
             self.pulsar_torpedoes_lock = not self.pulsar_torpedoes_firing
@@ -93,7 +94,7 @@ class Juno(Hero):
             self.pulsar_torpedoes_lock = False
             self.pulsar_torpedoes_firing = False
 
-    def detect_all(self, computer_vision: ComputerVision) -> None:
+    def detect_all(self, computer_vision: "ComputerVision") -> None:
         self.detect_glide_boost(computer_vision)
         self.detect_pulsar_torpedoes(computer_vision)
 
@@ -113,7 +114,7 @@ class Lucio(Hero):
         self.healing_song_buffer = 0
         self.speed_song_buffer = 0
 
-    def detect_song(self, computer_vision: ComputerVision) -> None:
+    def detect_song(self, computer_vision: "ComputerVision") -> None:
         if computer_vision.detect_single("lucio_heal"):
             self.healing_song = True
             self.speed_song = False
@@ -135,7 +136,7 @@ class Lucio(Hero):
             if self.speed_song_buffer >= self.crossfade_buffer_size:
                 self.speed_song = False
 
-    def detect_all(self, computer_vision: ComputerVision) -> None:
+    def detect_all(self, computer_vision: "ComputerVision") -> None:
         self.detect_song(computer_vision)
 
 
@@ -162,7 +163,7 @@ class Mercy(Hero):
         self.heal_beam_buffer = 0
         self.damage_beam_buffer = 0
 
-    def detect_beams(self, computer_vision: ComputerVision) -> None:
+    def detect_beams(self, computer_vision: "ComputerVision") -> None:
         if computer_vision.detect_single("mercy_heal_beam"):
             self.heal_beam = True
             self.damage_beam = False
@@ -184,10 +185,10 @@ class Mercy(Hero):
             if self.damage_beam_buffer >= self.beam_disconnect_buffer_size:
                 self.damage_beam = False
 
-    def detect_resurrect(self, computer_vision: ComputerVision) -> None:
+    def detect_resurrect(self, computer_vision: "ComputerVision") -> None:
         self.resurrecting = computer_vision.detect_single("mercy_resurrect_cd")
 
-    def detect_flash_heal(self, computer_vision: ComputerVision) -> None:
+    def detect_flash_heal(self, computer_vision: "ComputerVision") -> None:
         self.flash_heal = computer_vision.detect_single("mercy_flash_heal")
 
 
@@ -207,7 +208,7 @@ class Zenyatta(Hero):
         self.harmony_orb_buffer = 0
         self.discord_orb_buffer = 0
 
-    def detect_orbs(self, computer_vision: ComputerVision) -> None:
+    def detect_orbs(self, computer_vision: "ComputerVision") -> None:
         if computer_vision.detect_single("zenyatta_harmony"):
             self.harmony_orb = True
             self.harmony_orb_buffer = 0
@@ -224,5 +225,5 @@ class Zenyatta(Hero):
             if self.discord_orb_buffer >= self.orb_disconnect_buffer_size:
                 self.discord_orb = False
 
-    def detect_all(self, computer_vision: ComputerVision) -> None:
+    def detect_all(self, computer_vision: "ComputerVision") -> None:
         self.detect_orbs(computer_vision)
@@ -18,13 +18,14 @@
 #  SPDX-License-Identifier: AGPL-3.0-or-later
 
 import atexit
-import logging.handlers
+import logging
 import os
 import sys
 
-from PySide6.QtWidgets import QApplication, QMessageBox
+from .utils import StartupTimer, setup_logging
 
-from .main_window import MainWindow
+# Warn if the window takes longer than this to show up
+STARTUP_BUDGET = 2.0
 
 
 def create_lock_file(lock_file_path):
@@ -46,6 +47,13 @@ def remove_lock_file(lock_file_path):
 
 
 def main() -> None:
+    # Qt and the main window are imported here, so their import time is part of the startup time breakdown
+    startup_timer = StartupTimer()
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication, QMessageBox
+    from .main_window import MainWindow, preload_controller
+    startup_timer.mark("imports")
+
     # Prepare paths
     path = os.path.dirname(os.path.dirname(__file__))
     path_assets = os.path.join(path, "assets")
@@ -54,6 +62,7 @@ def main() -> None:
 
     # Create the application instance
     app = QApplication(sys.argv)
+    startup_timer.mark("application")
 
     # Create lock file
     if not create_lock_file(path_lock):
@@ -71,25 +80,9 @@ def main() -> None:
     atexit.register(remove_lock_file, path_lock)
 
     # Set up logging
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-    formatter = logging.Formatter(
-        "%(asctime)s.%(msecs)d - %(levelname)s - %(module)s.%(funcName)s:%(lineno)d - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S")
-
-    # Stream handler for logging to console
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
-
-    # File handler to create a log file
-    if not os.path.exists(path_log):
-        os.mkdir(path_log)
-    file_handler = logging.handlers.TimedRotatingFileHandler(
-        os.path.join(path_log, "OverStim_Log.txt"), when="d", interval=1, backupCount=3)
-    file_handler.setFormatter(formatter)
-    file_handler.namer = lambda default_name: default_name + ".txt"  # ensure that old log files keep the file extension
-    logger.addHandler(file_handler)
+    log_listener = setup_logging(path_log)
+    atexit.register(log_listener.stop)
+    startup_timer.mark("logging")
 
     # Read version file
     filename = os.path.join(os.path.dirname(__file__), "version.txt")
@@ -98,8 +91,19 @@ def main() -> None:
     logging.info(f"Starting version {version}")
 
     # Start application
-    main_window = MainWindow(version, path, path_assets, path_log)
+    main_window = MainWindow(version, path, path_assets, path_log, startup_timer)
     main_window.show()
+    startup_timer.mark("show")
+
+    # The first event is handled once the window is on screen
+    def log_startup_time() -> None:
+        startup_timer.mark("first event")
+        logging.info(f"Startup time: {startup_timer}")
+        if startup_timer.total > STARTUP_BUDGET:
+            logging.warning(f"Startup took longer than {STARTUP_BUDGET * 1000:.0f} ms")
+        preload_controller()
+
+    QTimer.singleShot(0, log_startup_time)
     sys.exit(app.exec())
 
 
@@ -20,28 +20,58 @@
 import asyncio
 import collections
 import functools
+import importlib
 import logging
 import os
+import threading
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING
 
 from PySide6.QtCore import QThread, Signal, QTimer, Qt, QSettings
 from PySide6.QtGui import QCloseEvent, QPixmap, QIcon, QAction, QColor, QPalette
 from PySide6.QtWidgets import (
     QMainWindow, QVBoxLayout, QWidget, QGridLayout, QComboBox, QLabel, QDialog, QMessageBox, QProgressBar, QTreeWidget,
     QTreeWidgetItem, QLineEdit, QSpinBox, QDoubleSpinBox, QAbstractItemView, QHeaderView, QFormLayout, QCheckBox,
-    QDialogButtonBox, QHBoxLayout, QSizePolicy)
+    QDialogButtonBox, QHBoxLayout, QSizePolicy, QFileDialog)
 from pynput import keyboard
 
-from .controller import Controller, ControllerInfo
+from .metrics import Metrics, MetricsExporter
+from .profile import Profile, ProfileStore, TriggerSetting, load_profile, save_profile
+from .profiler import Profiler
 from .heroes import Hero2
+from .stats import ControllerInfo
 from .triggers import Trigger, is_conditional, hero_triggers, Response, ResponseType, Pattern, default_response
-from .utils import Config, format_enum
+from .utils import Config, StartupTimer, format_enum, set_log_level
+
+# The controller pulls in OpenCV, NumPy, the screen capture and buttplug, which take most of the startup time. They are
+# imported when the controller is first started, or in the background once the window is shown.
+if TYPE_CHECKING:
+    from .computer_vision import CaptureService
+
+
+def preload_controller() -> threading.Thread:
+    # Import the controller in the background, so pressing Start does not wait for the imports
+    def run() -> None:
+        start_time = time.perf_counter()
+        try:
+            importlib.import_module(".controller", __package__)
+        except Exception as e:
+            logging.error("Failed to import the controller.", exc_info=e)
+            return
+        logging.info(f"Controller imported in the background in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    thread = threading.Thread(target=run, name="PreloadController", daemon=True)
+    thread.start()
+    return thread
 
 
 class MainWindow(QMainWindow):
     DATA_HERO = 0
     DATA_TRIGGER = 1
 
-    def __init__(self, version: str, path: str, path_assets: str, path_log: str) -> None:
+    def __init__(self, version: str, path: str, path_assets: str, path_log: str,
+                 startup_timer: StartupTimer | None = None) -> None:
         super().__init__()
         self.version = version
         self.path = path
@@ -53,8 +83,18 @@ class MainWindow(QMainWindow):
 
         # INITIALIZE SETTINGS ##########################################################################################
 
+        # All settings are kept in one file, which replaces the separate QSettings values of earlier versions
         self.settings = QSettings("OverStim", "OverStim")
-        self.config = self.get_settings_config()
+        self.profile_store = ProfileStore(os.path.join(self.path, "OverStim_Settings.json"))
+        if self.profile_store.exists:
+            profile = self.profile_store.load()
+        else:
+            profile = self.get_settings_profile()
+            self.profile_store.profile = profile
+            self.profile_store.save()
+            logging.info(f"Moved settings to {self.profile_store.filename}")
+        self.config = profile.config
+        set_log_level(self.config.log_level)
 
         # INITIALIZE USER INTERFACE ####################################################################################
 
@@ -65,13 +105,12 @@ class MainWindow(QMainWindow):
             item = QTreeWidgetItem([format_enum(hero)])
             item.setData(0, Qt.UserRole + self.DATA_HERO, hero)
             for trigger in hero_triggers(hero):
-                response = self.get_settings_response(hero, trigger)
-                enabled = self.get_settings_enabled(hero, trigger)
+                setting = profile.get_trigger(hero, trigger)
                 child = QTreeWidgetItem([format_enum(trigger)])
                 child.setData(0, Qt.UserRole + self.DATA_HERO, hero)
                 child.setData(0, Qt.UserRole + self.DATA_TRIGGER, trigger)
-                child.setData(1, Qt.UserRole, response)
-                child.setCheckState(1, Qt.Checked if enabled else Qt.Unchecked)
+                child.setData(1, Qt.UserRole, setting.response)
+                child.setCheckState(1, Qt.Checked if setting.enabled else Qt.Unchecked)
                 item.addChild(child)
             self.trigger_tree.addTopLevelItem(item)
         self.trigger_tree.expandAll()
@@ -79,6 +118,8 @@ class MainWindow(QMainWindow):
         self.trigger_tree.itemChanged.connect(self.slot_trigger_changed)
         self.trigger_tree.itemDoubleClicked.connect(self.slot_trigger_double_click)
         self.update_trigger_table()
+        if startup_timer is not None:
+            startup_timer.mark("settings")
 
         # Hero selection box
         # FIXME: Fix and re-enable auto-detect
@@ -87,7 +128,7 @@ class MainWindow(QMainWindow):
         self.hero_select_combo = QComboBox()
         self.hero_select_combo.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.hero_select_combo.addItems(hero_select_items)
-        self.hero_select_combo.setCurrentIndex(self.get_settings_playing_hero())
+        self.hero_select_combo.setCurrentIndex(profile.playing_hero.value - 1)
         self.hero_select_combo.currentIndexChanged.connect(self.update_controller)
         hero_select = QHBoxLayout()
         hero_select.addWidget(QLabel("Playing hero:"))
@@ -131,10 +172,24 @@ class MainWindow(QMainWindow):
         self.action_config.triggered.connect(self.slot_settings_dialog)
         tool_bar.addAction(self.action_config)
 
+        self.action_import = QAction("Import")
+        self.action_import.setToolTip("Import settings and trigger customization from a file")
+        self.action_import.triggered.connect(self.slot_import_button)
+        tool_bar.addAction(self.action_import)
+
+        self.action_export = QAction("Export")
+        self.action_export.setToolTip("Export settings and trigger customization to a file")
+        self.action_export.triggered.connect(self.slot_export_button)
+        tool_bar.addAction(self.action_export)
+
         self.action_about = QAction("About")
         self.action_about.triggered.connect(self.slot_about_dialog)
         tool_bar.addAction(self.action_about)
 
+        self.action_profiler = QAction("Profiler")
+        self.action_profiler.triggered.connect(self.slot_profiler_dialog)
+        tool_bar.addAction(self.action_profiler)
+
         self.action_log = QAction("Log")
         self.action_log.triggered.connect(functools.partial(os.startfile, self.path_log))
         tool_bar.addAction(self.action_log)
@@ -165,6 +220,14 @@ class MainWindow(QMainWindow):
         # Controller thread to perform main program functions
         self.controller_thread: ControllerThread | None = None
 
+        # Screen capture and templates are kept between runs, so starting again is quick
+        self.capture_service: "CaptureService | None" = None
+
+        # Metrics are collected across runs, and exported if enabled
+        self.metrics = Metrics()
+        self.metrics_exporter: MetricsExporter | None = None
+        self.restart_metrics_exporter()
+
         # Close the application after the controller thread is stopped
         self.stop_request = False
         self.stop_request_timer = QTimer()
@@ -187,12 +250,19 @@ class MainWindow(QMainWindow):
             on_press=self.pynput_for_canonical(self.pynput_hotkey.press),
             on_release=self.pynput_for_canonical(self.pynput_hotkey.release))
         self.pynput_listener.start()
+        if startup_timer is not None:
+            startup_timer.mark("window")
 
     def pynput_for_canonical(self, f):
         return lambda k: f(self.pynput_listener.canonical(k))
 
     def pynput_on_activate(self) -> None:
+        # Runs on the pynput thread. The devices are stopped right away, the window is closed by the timer later.
+        activate_time = time.perf_counter()
         logging.info("Global hotkey for emergency stop activated")
+        controller_thread = self.controller_thread
+        if controller_thread is not None:
+            controller_thread.controller.emergency_stop(activate_time)
         self.stop_request = True
 
     def check_stop_request(self) -> None:
@@ -206,6 +276,11 @@ class MainWindow(QMainWindow):
             event.ignore()
             return
         self.pynput_listener.stop()
+        if self.capture_service is not None:
+            self.capture_service.release()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        self.profile_store.flush()
         event.accept()
 
     def get_settings_response(self, hero: Hero2, trigger: Trigger) -> Response:
@@ -241,6 +316,17 @@ class MainWindow(QMainWindow):
             new_values[name] = value
         return Config(**new_values)
 
+    def get_settings_profile(self) -> Profile:
+        triggers = {hero: {trigger: TriggerSetting(self.get_settings_response(hero, trigger),
+                                                   self.get_settings_enabled(hero, trigger))
+                           for trigger in hero_triggers(hero)}
+                    for hero in Hero2}
+        try:
+            playing_hero = Hero2(self.get_settings_playing_hero() + 1)
+        except ValueError:
+            playing_hero = Hero2.MERCY
+        return Profile(config=self.get_settings_config(), playing_hero=playing_hero, triggers=triggers)
+
     def get_settings_playing_hero(self) -> int:
         key = "playing_hero"
         value = 0
@@ -252,27 +338,24 @@ class MainWindow(QMainWindow):
             logging.error("Failed to load setting; using default.", exc_info=e)
         return value
 
-    def set_settings_response(self, hero: Hero2, trigger: Trigger, response: Response) -> None:
-        key = f"{hero.name}/{trigger.name}/response"
-        value = str(response)
-        logging.info(f"Setting update: {key}={value}")
-        self.settings.setValue(key, value)
-
-    def set_settings_enabled(self, hero: Hero2, trigger: Trigger, value: bool) -> None:
-        key = f"{hero.name}/{trigger.name}/enabled"
-        logging.info(f"Setting update: {key}={value}")
-        self.settings.setValue(key, value)
+    def set_settings_trigger(self, hero: Hero2, trigger: Trigger, response: Response, enabled: bool) -> None:
+        setting = TriggerSetting(response, enabled)
+        if setting != self.profile_store.profile.get_trigger(hero, trigger):
+            logging.info(f"Setting update: {hero.name}/{trigger.name}: response={response}, enabled={enabled}")
+            self.profile_store.set_trigger(hero, trigger, setting)
 
     def set_settings_config(self, config: Config) -> None:
+        old_config = self.profile_store.profile.config
         for name, value in config._asdict().items():
-            key = f"config/{name}"
-            logging.info(f"Setting update: {key}={value}")
-            self.settings.setValue(key, value)
+            if value != getattr(old_config, name):
+                logging.info(f"Setting update: config/{name}={value}")
+        self.profile_store.set_config(config)
 
     def set_settings_playing_hero(self, value: int) -> None:
-        key = "playing_hero"
-        logging.info(f"Setting update: {key}={value}")
-        self.settings.setValue(key, value)
+        hero = Hero2(value + 1)
+        if hero is not self.profile_store.profile.playing_hero:
+            logging.info(f"Setting update: playing_hero={hero.name}")
+            self.profile_store.set_playing_hero(hero)
 
     def slot_trigger_changed(self, item: QTreeWidgetItem, column: int) -> None:
         if column != 1:
@@ -283,10 +366,8 @@ class MainWindow(QMainWindow):
         response = item.data(1, Qt.UserRole)
         if hero is None or trigger is None or response is None:
             return
-        self.set_settings_response(hero, trigger, response)
-        # Save enabled in settings
         enabled = item.checkState(1) != Qt.Unchecked
-        self.set_settings_enabled(hero, trigger, enabled)
+        self.set_settings_trigger(hero, trigger, response, enabled)
         # Update controller
         self.update_controller()
 
@@ -315,7 +396,10 @@ class MainWindow(QMainWindow):
         if self.controller_thread is not None:
             return
         try:
-            self.controller_thread = ControllerThread(self.config, self.path_assets)
+            if self.capture_service is None:
+                from .computer_vision import CaptureService
+                self.capture_service = CaptureService(os.path.join(self.path_assets, "templates"))
+            self.controller_thread = ControllerThread(self.config, self.capture_service, self.metrics, self.path_log)
         except Exception as e:
             self.slot_crash_dialog("Failed to start the controller thread.", e)
             return
@@ -335,6 +419,9 @@ class MainWindow(QMainWindow):
         self.action_stop.setEnabled(False)
         self.controller_thread.quit()
         self.controller_thread.wait()
+        # Start over with a fresh screen capture after an error
+        if self.controller_thread.crashed and self.capture_service is not None:
+            self.capture_service.release()
         self.controller_thread = None
         self.update_controller_info()
 
@@ -392,7 +479,8 @@ class MainWindow(QMainWindow):
         self.vibe_intensity_bar.setValue(round(controller_info.vibe_intensity * 1000))
         self.status_program.setText(program_status)
         self.status_devices.setText(f"{controller_info.devices_connected:d} Devices")
-        self.status_fps.setText(f"{controller_info.fps:d} FPS")
+        self.status_fps.setText(f"{controller_info.fps:d} FPS | p95 {controller_info.frame_stats.p95 * 1000:.0f} ms")
+        self.status_fps.setToolTip(f"Detection frames per second\n{controller_info.frame_stats}")
         self.status_calculation_time.setText(f"{controller_info.calculation_time * 1000:.0f} ms")
         # Update trigger tree
         for index in range(self.trigger_tree.topLevelItemCount()):
@@ -411,15 +499,16 @@ class MainWindow(QMainWindow):
                 child = item.child(index_)
                 if hero is self.current_hero:
                     trigger = child.data(0, Qt.UserRole + self.DATA_TRIGGER)
-                    intensities = controller_info.all_intensities.get(trigger, [])
+                    count = controller_info.trigger_counts.get(trigger, 0)
                 else:
-                    intensities = []
-                if intensities:
+                    count = 0
+                if count:
                     child.setForeground(0, self.color_highlight)
-                    if len(intensities) == 1:
-                        intensities_str = f"{sum(intensities) * 100:+.0f}%"
+                    intensity = controller_info.trigger_intensities.get(trigger, 0.0)
+                    if count == 1:
+                        intensities_str = f"{intensity * 100:+.0f}%"
                     else:
-                        intensities_str = f"{sum(intensities) * 100:+.0f}% ({len(intensities)}x)"
+                        intensities_str = f"{intensity * 100:+.0f}% ({count}x)"
                 else:
                     child.setForeground(0, self.color_default)
                     intensities_str = ""
@@ -442,6 +531,15 @@ class MainWindow(QMainWindow):
         about_dialog = AboutDialog(self, self.version, self.path_assets)
         about_dialog.exec()
 
+    def slot_profiler_dialog(self) -> None:
+        dialog = ProfilerDialog(self, self.get_profiler, self.path_log)
+        dialog.show()
+
+    def get_profiler(self) -> Profiler | None:
+        if self.controller_thread is None:
+            return None
+        return self.controller_thread.controller.profiler
+
     def slot_settings_dialog(self) -> None:
         # Open the settings dialog
         dialog = ConfigDialog(self, self.config)
@@ -453,6 +551,83 @@ class MainWindow(QMainWindow):
                 self.slot_crash_dialog("Invalid input.", e)
             else:
                 self.set_settings_config(self.config)
+                set_log_level(self.config.log_level)
+                self.restart_metrics_exporter()
+                self.update_controller_config()
+
+    def slot_import_button(self) -> None:
+        filename, _ = QFileDialog.getOpenFileName(self, "Import Settings", self.path, "OverStim settings (*.json)")
+        if not filename:
+            return
+        try:
+            profile = load_profile(filename)
+        except Exception as e:
+            self.slot_crash_dialog("Failed to import the settings.", e)
+            return
+        logging.info(f"Importing settings from {filename}")
+        self.apply_profile(profile)
+
+    def slot_export_button(self) -> None:
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Settings", os.path.join(self.path, "OverStim.json"),
+                                                  "OverStim settings (*.json)")
+        if not filename:
+            return
+        try:
+            save_profile(self.profile_store.profile, filename)
+        except Exception as e:
+            self.slot_crash_dialog("Failed to export the settings.", e)
+            return
+        logging.info(f"Exported settings to {filename}")
+
+    def apply_profile(self, profile: Profile) -> None:
+        self.set_settings_config(profile.config)
+        self.config = profile.config
+        set_log_level(self.config.log_level)
+        self.restart_metrics_exporter()
+        self.update_controller_config()
+        # Update trigger tree without saving every item on its own
+        self.trigger_tree.blockSignals(True)
+        for index in range(self.trigger_tree.topLevelItemCount()):
+            item = self.trigger_tree.topLevelItem(index)
+            for index_ in range(item.childCount()):
+                child = item.child(index_)
+                hero = child.data(0, Qt.UserRole + self.DATA_HERO)
+                trigger = child.data(0, Qt.UserRole + self.DATA_TRIGGER)
+                setting = profile.get_trigger(hero, trigger)
+                child.setData(1, Qt.UserRole, setting.response)
+                child.setCheckState(1, Qt.Checked if setting.enabled else Qt.Unchecked)
+        self.trigger_tree.blockSignals(False)
+        self.update_trigger_table()
+        self.profile_store.update(profile)
+        self.hero_select_combo.setCurrentIndex(profile.playing_hero.value - 1)
+        self.update_controller()
+
+    def update_controller_config(self) -> None:
+        # Apply the settings to the running controller
+        if self.controller_thread is None:
+            return
+        restart_fields = self.controller_thread.controller.update_config(self.config)
+        if restart_fields:
+            message_box = QMessageBox(self)
+            message_box.setIcon(QMessageBox.Information)
+            message_box.setWindowTitle("Settings")
+            message_box.setText("Some settings are applied the next time OverStim is started:\n" +
+                                "\n".join(restart_fields))
+            message_box.exec()
+
+    def restart_metrics_exporter(self) -> None:
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+        if self.config.metrics_export == "off":
+            return
+        try:
+            self.metrics_exporter = MetricsExporter(
+                self.metrics, self.config.metrics_export, self.config.metrics_port, self.path_log)
+            self.metrics_exporter.start()
+        except Exception as e:
+            self.metrics_exporter = None
+            logging.error("Failed to start the metrics export.", exc_info=e)
 
     def slot_reset_button(self) -> None:
         message_box = QMessageBox(self)
@@ -467,6 +642,7 @@ class MainWindow(QMainWindow):
         if result == QMessageBox.Yes:
             logging.info("All settings will be deleted.")
             self.settings.clear()
+            self.profile_store.delete()
             self.close()
 
     def slot_crash_dialog(self, message: str, exception: BaseException) -> None:
@@ -482,9 +658,12 @@ class ControllerThread(QThread):
     signal_crash = Signal(str, BaseException)
     signal_update_info = Signal(ControllerInfo)
 
-    def __init__(self, config: Config, path_assets: str) -> None:
+    def __init__(self, config: Config, capture_service: "CaptureService", metrics: Metrics, path_log: str) -> None:
         super().__init__()
-        self.controller = Controller(config, path_assets, self.signal_update_info.emit)
+        from .controller import Controller
+        self.controller = Controller(config, capture_service.acquire(config), self.signal_update_info.emit, metrics,
+                                     path_log)
+        self.crashed = False
 
     def stop(self) -> None:
         logging.info("Waiting for OverStim to stop ...")
@@ -497,6 +676,7 @@ class ControllerThread(QThread):
         try:
             loop.run_until_complete(self.controller.run())
         except Exception as e:
+            self.crashed = True
             self.signal_crash.emit("OverStim stopped with an error.", e)
         finally:
             loop.close()
@@ -641,6 +821,20 @@ class ConfigDialog(QDialog):
         self.websocket_address.setToolTip("Must match whatever is set in Intiface.")
         form_layout.addRow(QLabel("WebSocket Address:"), self.websocket_address)
 
+        # ADDITIONAL_WEBSOCKET_ADDRESSES
+        self.additional_websocket_addresses = QLineEdit("; ".join(config.additional_websocket_addresses))
+        self.additional_websocket_addresses.setToolTip(
+            "Addresses of more Intiface servers whose devices vibrate along. Separate entries with a semicolon (;).")
+        form_layout.addRow(QLabel("More WebSocket Addresses:"), self.additional_websocket_addresses)
+
+        # DEVICE_CURVES
+        self.device_curves = QLineEdit("; ".join(config.device_curves))
+        self.device_curves.setToolTip(
+            "Intensity curves of single devices, as \"device name=intensity:device intensity,...\" with intensities "
+            "from 0 to 1, e.g. \"Lovense Lush=0:0,0.5:0.2,1:1\" for a gentle start. Device intensities between the "
+            "points are interpolated. Separate entries with a semicolon (;).")
+        form_layout.addRow(QLabel("Device Curves:"), self.device_curves)
+
         # GPU_ID
         self.gpu_id = QSpinBox()
         self.gpu_id.setRange(0, 10)
@@ -708,6 +902,122 @@ class ConfigDialog(QDialog):
             "purposes and might increase the CPU load a little.")
         form_layout.addRow(QLabel("Preview window:"), self.preview_window)
 
+        # MAX_COMMAND_RATE
+        self.max_command_rate = QSpinBox()
+        self.max_command_rate.setRange(0, 100)
+        self.max_command_rate.setSuffix(" Hz")
+        self.max_command_rate.setValue(config.max_command_rate)
+        self.max_command_rate.setToolTip(
+            "How many times per second OverStim may send a new intensity to each device. Intensity changes within "
+            "this interval are combined, and only the latest one is sent. Bluetooth devices tend to drop or delay "
+            "commands above 10 to 20 Hz. 0, the default, means unlimited. Stopping a device is never delayed.")
+        form_layout.addRow(QLabel("Max Command Rate:"), self.max_command_rate)
+
+        # INTENSITY_SLEW_RATE
+        self.intensity_slew_rate = QSpinBox()
+        self.intensity_slew_rate.setRange(0, 1000)
+        self.intensity_slew_rate.setSingleStep(50)
+        self.intensity_slew_rate.setSuffix("%/s")
+        self.intensity_slew_rate.setValue(int(config.intensity_slew_rate * 100))
+        self.intensity_slew_rate.setToolTip(
+            "Smooths intensity changes by ramping the devices to the new intensity at this speed, e.g. 200%/s ramps "
+            "from 0% to 100% in half a second. 0 disables smoothing. Stopping a device is never smoothed.")
+        form_layout.addRow(QLabel("Intensity Slew Rate:"), self.intensity_slew_rate)
+
+        # STAGE_PROFILING
+        self.stage_profiling = QCheckBox()
+        self.stage_profiling.setChecked(config.stage_profiling)
+        self.stage_profiling.setToolTip(
+            "Measure how long each processing stage takes, e.g. waiting for frames, every single detection and "
+            "every device command. The timings are shown in the profiler window and written to the log when "
+            "OverStim stops.")
+        form_layout.addRow(QLabel("Stage Profiling:"), self.stage_profiling)
+
+        # METRICS_EXPORT
+        self.metrics_export = QComboBox()
+        self.metrics_export.addItems(MetricsExporter.MODES)
+        self.metrics_export.setCurrentText(config.metrics_export)
+        self.metrics_export.setToolTip(
+            "Export metrics such as FPS, detection times, intensity, device commands and reconnects for long "
+            "sessions. http serves them in the Prometheus format at http://127.0.0.1:<port>/metrics, jsonl writes "
+            "them to a file in the log folder every 5 seconds.")
+        form_layout.addRow(QLabel("Metrics Export:"), self.metrics_export)
+
+        # METRICS_PORT
+        self.metrics_port = QSpinBox()
+        self.metrics_port.setRange(1024, 65535)
+        self.metrics_port.setValue(config.metrics_port)
+        self.metrics_port.setToolTip("Port of the metrics HTTP endpoint on localhost.")
+        form_layout.addRow(QLabel("Metrics Port:"), self.metrics_port)
+
+        # LOG_LEVEL
+        self.log_level = QComboBox()
+        self.log_level.addItems(["DEBUG", "INFO", "WARNING", "ERROR"])
+        self.log_level.setCurrentText(config.log_level)
+        self.log_level.setToolTip(
+            "Minimum level of messages written to the log. DEBUG includes every message sent to Intiface and is "
+            "only recommended for troubleshooting.")
+        form_layout.addRow(QLabel("Log Level:"), self.log_level)
+
+        # RECORD_SESSION
+        self.record_session = QCheckBox()
+        self.record_session.setChecked(config.record_session)
+        self.record_session.setToolTip(
+            "Record what is detected in every frame to a session file in the log folder. Sessions can be replayed "
+            "with \"python -m overstim.session\" to reproduce problems without the game.")
+        form_layout.addRow(QLabel("Record session:"), self.record_session)
+
+        # RECORD_FRAMES
+        self.record_frames = QCheckBox()
+        self.record_frames.setChecked(config.record_frames)
+        self.record_frames.setToolTip(
+            "Record the screen regions checked by the detections to a folder in the log folder, in grayscale and "
+            "losslessly compressed. Used to build datasets for testing detections; needs a few GB per hour.")
+        form_layout.addRow(QLabel("Record frames:"), self.record_frames)
+
+        # CALIBRATION_PROFILE
+        self.calibration_profile = QLineEdit(config.calibration_profile)
+        self.calibration_profile.setToolTip(
+            "Path of a calibration profile with detection thresholds and search areas, created with "
+            "\"python -m overstim.calibration\". Leave empty to use the defaults.")
+        form_layout.addRow(QLabel("Calibration profile:"), self.calibration_profile)
+
+        # STATE_STREAM_NAME
+        self.state_stream_name = QLineEdit(config.state_stream_name)
+        self.state_stream_name.setToolTip(
+            "Publish the intensity, hero, FPS and the intensity of every trigger to shared memory with this name, "
+            "for overlays and stream tools on this computer. See \"python -m overstim.state_stream\". Leave empty "
+            "to disable.")
+        form_layout.addRow(QLabel("State stream name:"), self.state_stream_name)
+
+        # EVENT_API_PORT
+        self.event_api_port = QSpinBox()
+        self.event_api_port.setRange(0, 65535)
+        self.event_api_port.setValue(config.event_api_port)
+        self.event_api_port.setToolTip(
+            "Accept trigger events from other programs on this computer with a websocket on this port, e.g. from "
+            "stream deck buttons. See overstim/event_api.py for the format of the events. 0 to disable.")
+        form_layout.addRow(QLabel("Event API port:"), self.event_api_port)
+
+        # MUSIC_SOURCE
+        self.music_source = QLineEdit(config.music_source)
+        self.music_source.setToolTip(
+            "Lets Lucio's songs vibe along with music: the healing song follows the bass, the speed song pulses on "
+            "the beats. Path of a WAV file that is played in a loop, or \"loopback\" for what this computer plays, "
+            "which needs the soundcard package. Leave empty to disable.")
+        form_layout.addRow(QLabel("Music source:"), self.music_source)
+
+        # MUSIC_DEPTH
+        self.music_depth = QSpinBox()
+        self.music_depth.setRange(0, 100)
+        self.music_depth.setSingleStep(10)
+        self.music_depth.setSuffix("%")
+        self.music_depth.setValue(int(config.music_depth * 100))
+        self.music_depth.setToolTip(
+            "Part of the song intensity that follows the music. At 100% the songs stop vibrating when the music is "
+            "silent, at 0% the music has no effect.")
+        form_layout.addRow(QLabel("Music depth:"), self.music_depth)
+
         # Add OK and Cancel buttons
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
@@ -742,7 +1052,91 @@ class ConfigDialog(QDialog):
             lucio_crossfade_buffer=self.lucio_crossfade_buffer.value(),
             mercy_beam_disconnect_buffer=self.mercy_beam_disconnect_buffer.value(),
             zen_orb_disconnect_buffer=self.zen_orb_disconnect_buffer.value(),
-            preview_window=self.preview_window.isChecked())
+            preview_window=self.preview_window.isChecked(),
+            max_command_rate=self.max_command_rate.value(),
+            intensity_slew_rate=self.intensity_slew_rate.value() / 100.0,
+            stage_profiling=self.stage_profiling.isChecked(),
+            metrics_export=self.metrics_export.currentText(),
+            metrics_port=self.metrics_port.value(),
+            log_level=self.log_level.currentText(),
+            record_session=self.record_session.isChecked(),
+            record_frames=self.record_frames.isChecked(),
+            calibration_profile=self.calibration_profile.text().strip(),
+            additional_websocket_addresses=[address.strip() for address in
+                                            self.additional_websocket_addresses.text().split(';') if address.strip()],
+            device_curves=[curve.strip() for curve in self.device_curves.text().split(';') if curve.strip()],
+            state_stream_name=self.state_stream_name.text().strip(),
+            event_api_port=self.event_api_port.value(),
+            music_source=self.music_source.text().strip(),
+            music_depth=self.music_depth.value() / 100.0)
+
+
+class ProfilerDialog(QDialog):
+    def __init__(self, parent: QWidget, get_profiler: Callable[[], Profiler | None], path_log: str) -> None:
+        super().__init__(parent)
+        self.get_profiler = get_profiler
+        self.path_log = path_log
+        self.setWindowTitle("Profiler")
+        self.setAttribute(Qt.WA_DeleteOnClose)
+
+        # Stage table
+        self.stage_tree = QTreeWidget()
+        self.stage_tree.setHeaderLabels(["Stage", "Count", "Mean", "p50", "p95", "p99", "Max"])
+        self.stage_tree.setRootIsDecorated(False)
+        self.stage_tree.header().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.status_label = QLabel()
+
+        # Buttons
+        button_box = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Reset | QDialogButtonBox.Close)
+        button_box.button(QDialogButtonBox.Save).clicked.connect(self.slot_save)
+        button_box.button(QDialogButtonBox.Reset).clicked.connect(self.slot_reset)
+        button_box.rejected.connect(self.reject)
+
+        # Set the main layout
+        layout = QVBoxLayout()
+        layout.addWidget(self.stage_tree)
+        layout.addWidget(self.status_label)
+        layout.addWidget(button_box)
+        self.setLayout(layout)
+        self.resize(640, 480)
+
+        # Refresh the timings once per second
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000)
+        self.refresh()
+
+    def refresh(self) -> None:
+        profiler = self.get_profiler()
+        self.stage_tree.clear()
+        if profiler is None:
+            self.status_label.setText("Not started")
+            return
+        if not profiler.enabled:
+            self.status_label.setText("Stage profiling is disabled in the settings")
+            return
+        self.status_label.setText("All times in ms")
+        for stats in profiler.snapshot():
+            item = QTreeWidgetItem([stats.stage, f"{stats.count:d}"] + [
+                f"{1000 * value:.2f}" for value in stats[2:]])
+            for column in range(1, item.columnCount()):
+                item.setTextAlignment(column, Qt.AlignRight)
+            self.stage_tree.addTopLevelItem(item)
+
+    def slot_save(self) -> None:
+        profiler = self.get_profiler()
+        if profiler is None:
+            return
+        filename = os.path.join(self.path_log, f"OverStim_Profile_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+        profiler.dump(filename)
+        logging.info(f"Saved stage timings to {filename}")
+        self.status_label.setText(f"Saved to {filename}")
+
+    def slot_reset(self) -> None:
+        profiler = self.get_profiler()
+        if profiler is not None:
+            profiler.clear()
+        self.refresh()
 
 
 class AboutDialog(QDialog):
@@ -0,0 +1,134 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def metric_name(name: str, **labels: str) -> str:
+    if not labels:
+        return name
+    label_values = []
+    for key, value in labels.items():
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        label_values.append(f'{key}="{value}"')
+    return f"{name}{{{','.join(label_values)}}}"
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False) -> None:
+        # Only collected while exported, so the hot paths can skip measuring them
+        self.enabled = enabled
+        # Updated from the control loop; names may carry Prometheus labels, e.g. 'name{device="x"}'
+        self.counters: dict[str, float] = defaultdict(float)
+        self.gauges: dict[str, float] = {}
+
+    def inc(self, name: str, value: float = 1.0) -> None:
+        if self.enabled:
+            self.counters[name] += value
+
+    def set(self, name: str, value: float) -> None:
+        if self.enabled:
+            self.gauges[name] = value
+
+    def snapshot(self) -> tuple[dict[str, float], dict[str, float]]:
+        # Copying a dict does not release the GIL, so this is safe while the control loop updates it
+        return self.counters.copy(), self.gauges.copy()
+
+    def to_prometheus(self) -> str:
+        counters, gauges = self.snapshot()
+        lines = []
+        for metric_type, values in [("counter", counters), ("gauge", gauges)]:
+            declared = set()
+            for name in sorted(values):
+                base_name = name.split("{", 1)[0]
+                if base_name not in declared:
+                    lines.append(f"# TYPE {base_name} {metric_type}")
+                    declared.add(base_name)
+                lines.append(f"{name} {values[name]!r}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> str:
+        counters, gauges = self.snapshot()
+        return json.dumps({"time": time.time(), "counters": counters, "gauges": gauges})
+
+
+class MetricsExporter:
+    MODES = ["off", "http", "jsonl"]
+    JSONL_INTERVAL = 5.0
+
+    def __init__(self, metrics: Metrics, mode: str, port: int, path_log: str) -> None:
+        self.metrics = metrics
+        self.mode = mode
+        self.port = port
+        self.path_log = path_log
+        self.http_server: ThreadingHTTPServer | None = None
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.metrics.enabled = self.mode != "off"
+        if self.mode == "http":
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    body = metrics.to_prometheus().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args) -> None:
+                    pass
+
+            self.http_server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            self.thread = threading.Thread(target=self.http_server.serve_forever, name="MetricsExporter", daemon=True)
+            self.thread.start()
+            logging.info(f"Serving metrics at http://127.0.0.1:{self.port}/metrics")
+        elif self.mode == "jsonl":
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.write_jsonl, name="MetricsExporter", daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.metrics.enabled = False
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def write_jsonl(self) -> None:
+        filename = os.path.join(self.path_log, f"OverStim_Metrics_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+        logging.info(f"Writing metrics to {filename}")
+        with open(filename, "a") as file:
+            while not self.stop_event.wait(self.JSONL_INTERVAL):
+                file.write(self.metrics.to_json() + "\n")
+                file.flush()
+            file.write(self.metrics.to_json() + "\n")
@@ -0,0 +1,237 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Mixes the active vibes in one vectorised step. Vibes are rows of columnar arrays (start time, waveform, trigger,
+# flags), and every distinct response is compiled once into a waveform: a run of segment end times and intensities.
+# The intensities are the same as Response.get_intensity gives for every vibe on its own.
+
+from typing import NamedTuple
+
+import numpy
+
+from .triggers import Response, ResponseType, Trigger
+
+
+class MixResult(NamedTuple):
+    total: float
+    silenced: bool
+    # Summed intensity and number of vibes per trigger value; silences count as -1 each
+    trigger_intensities: numpy.ndarray
+    trigger_counts: numpy.ndarray
+
+
+class VibeMixer:
+    # Flags of a vibe
+    UNLIMITED = 1
+    PATTERN = 2
+    SILENCE = 4
+    TRIGGER_COUNT = max(trigger.value for trigger in Trigger) + 1
+    COLUMNS = ["start_times", "waveforms", "triggers", "flags", "periods", "limits", "segment_offsets",
+               "segment_counts"]
+    # Size of the waveform cache at which the waveforms that no vibe plays any more are dropped
+    MAX_WAVEFORMS = 256
+    MAX_SEGMENTS = 1 << 14
+    # Longest waveform whose segments are all compared when mixing, longer ones are searched
+    MAX_GATHER_WIDTH = 32
+
+    def __init__(self, capacity: int = 64) -> None:
+        # Compiled waveforms. The segments of all waveforms are stored one after the other, every waveform has the
+        # offset and number of its segments.
+        self.waveform_ids: dict[tuple, int] = {}
+        self.waveform_keys: list[tuple] = []
+        self.waveform_rows: list[tuple[int, float, float, int, int]] = []  # Flags, period, limit, offset, count
+        self.segment_ends = numpy.zeros(capacity)
+        self.segment_intensities = numpy.zeros(capacity)
+        self.segment_size = 0
+        # Raised while more waveforms are playing than the cache holds, so it is not cleaned up for every new one
+        self.waveform_limit = self.MAX_WAVEFORMS
+        self.segment_limit = self.MAX_SEGMENTS
+
+        # Active vibes, the first count rows of each column. The waveform properties are copied into the columns of
+        # every vibe, so mixing needs no lookups besides the segments.
+        self.count = 0
+        self.start_times = numpy.zeros(capacity)
+        self.waveforms = numpy.zeros(capacity, dtype=numpy.intp)
+        self.triggers = numpy.zeros(capacity, dtype=numpy.intp)
+        self.flags = numpy.zeros(capacity, dtype=numpy.uint8)
+        # Pattern length and number of loops for patterns, 1 and the duration for constants and silences
+        self.periods = numpy.ones(capacity)
+        self.limits = numpy.zeros(capacity)
+        self.segment_offsets = numpy.zeros(capacity, dtype=numpy.intp)
+        self.segment_counts = numpy.ones(capacity, dtype=numpy.intp)
+        self.trigger_counts = numpy.zeros(self.TRIGGER_COUNT, dtype=numpy.intp)
+
+    def compile(self, response: Response) -> int:
+        key = (response.type, response.intensity, response.duration, tuple(response.pattern), response.pattern_loop)
+        waveform = self.waveform_ids.get(key)
+        if waveform is not None:
+            return waveform
+        if response.type is ResponseType.PATTERN:
+            ends = numpy.cumsum([vibration.duration for vibration in response.pattern])
+            intensities = [vibration.intensity for vibration in response.pattern]
+            flags, period, limit = self.PATTERN, response.pattern.duration, response.pattern_loop
+        else:
+            # A single segment that never ends while the vibe is active
+            ends = [numpy.inf]
+            intensities = [response.intensity if response.type is ResponseType.CONSTANT else 0.0]
+            flags = self.SILENCE if response.type is ResponseType.SILENCE else 0
+            period, limit = 1.0, response.duration
+        if len(self.waveform_rows) >= self.waveform_limit or self.segment_size + len(ends) > self.segment_limit:
+            self.evict()
+        if self.segment_size + len(ends) > len(self.segment_ends):
+            capacity = max(2 * len(self.segment_ends), self.segment_size + len(ends))
+            self.segment_ends = self.resize(self.segment_ends, capacity)
+            self.segment_intensities = self.resize(self.segment_intensities, capacity)
+        offset = self.segment_size
+        self.segment_ends[offset:offset + len(ends)] = ends
+        self.segment_intensities[offset:offset + len(ends)] = intensities
+        self.segment_size += len(ends)
+        waveform = len(self.waveform_rows)
+        self.waveform_ids[key] = waveform
+        self.waveform_keys.append(key)
+        self.waveform_rows.append((flags, period, limit, offset, len(ends)))
+        return waveform
+
+    def evict(self) -> None:
+        # Drops the waveforms that no vibe plays, and moves the segments of the others together
+        used = numpy.unique(self.waveforms[:self.count])
+        new_ids = numpy.zeros(len(self.waveform_rows), dtype=numpy.intp)
+        new_offsets = numpy.zeros(len(self.waveform_rows), dtype=numpy.intp)
+        keys, rows = [], []
+        segment_ends, segment_intensities = [], []
+        size = 0
+        for waveform in used:
+            flags, period, limit, offset, segment_count = self.waveform_rows[waveform]
+            segment_ends.append(self.segment_ends[offset:offset + segment_count])
+            segment_intensities.append(self.segment_intensities[offset:offset + segment_count])
+            new_ids[waveform] = len(rows)
+            new_offsets[waveform] = size
+            keys.append(self.waveform_keys[waveform])
+            rows.append((flags, period, limit, size, segment_count))
+            size += segment_count
+        capacity = max(2 * size, len(self.start_times))
+        self.segment_ends = self.resize(numpy.concatenate([[], *segment_ends]), capacity)
+        self.segment_intensities = self.resize(numpy.concatenate([[], *segment_intensities]), capacity)
+        self.segment_size = size
+        self.waveform_keys = keys
+        self.waveform_rows = rows
+        self.waveform_ids = {key: waveform for waveform, key in enumerate(keys)}
+        self.waveform_limit = max(self.MAX_WAVEFORMS, 2 * len(rows))
+        self.segment_limit = max(self.MAX_SEGMENTS, 2 * size)
+        waveforms = self.waveforms[:self.count]
+        self.segment_offsets[:self.count] = new_offsets[waveforms]
+        waveforms[:] = new_ids[waveforms]
+
+    @staticmethod
+    def resize(array: numpy.ndarray, capacity: int) -> numpy.ndarray:
+        resized = numpy.zeros(capacity, dtype=array.dtype)
+        resized[:len(array)] = array
+        return resized
+
+    def add(self, trigger: Trigger, response: Response, start_time: float, unlimited: bool) -> None:
+        waveform = self.compile(response)
+        if self.count == len(self.start_times):
+            for name in self.COLUMNS:
+                column = getattr(self, name)
+                setattr(self, name, self.resize(column, 2 * len(column)))
+        flags, period, limit, offset, segment_count = self.waveform_rows[waveform]
+        index = self.count
+        self.start_times[index] = start_time
+        self.waveforms[index] = waveform
+        self.triggers[index] = trigger.value
+        self.flags[index] = flags | (self.UNLIMITED if unlimited else 0)
+        self.periods[index] = period
+        self.limits[index] = limit
+        self.segment_offsets[index] = offset
+        self.segment_counts[index] = segment_count
+        self.count += 1
+        self.trigger_counts[trigger.value] += 1
+
+    def keep(self, mask: numpy.ndarray) -> None:
+        # Drops the vibes that are not in the mask
+        count = int(numpy.count_nonzero(mask))
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column[:count] = column[:self.count][mask]
+        self.count = count
+        self.trigger_counts = numpy.bincount(self.triggers[:count], minlength=self.TRIGGER_COUNT)
+
+    def clear(self, trigger: Trigger | None = None) -> None:
+        if trigger is None:
+            self.count = 0
+            self.trigger_counts[:] = 0
+        elif self.trigger_counts[trigger.value]:
+            self.keep(self.triggers[:self.count] != trigger.value)
+
+    def exists(self, trigger: Trigger) -> bool:
+        return bool(self.trigger_counts[trigger.value])
+
+    def created_after(self, trigger: Trigger, time: float) -> bool:
+        if not self.trigger_counts[trigger.value]:
+            return False
+        return bool(((self.triggers[:self.count] == trigger.value) & (self.start_times[:self.count] > time)).any())
+
+    def find_segments(self, offsets: numpy.ndarray, segment_counts: numpy.ndarray,
+                      positions: numpy.ndarray) -> numpy.ndarray:
+        # Segment of each vibe that is playing, the number of its segment ends up to the position
+        width = int(segment_counts.max())
+        if width <= self.MAX_GATHER_WIDTH:
+            # The segments of every vibe are compared up to the longest waveform, the ones past its own are masked
+            columns = numpy.arange(width)
+            ends = self.segment_ends.take(offsets[:, None] + columns, mode="clip")
+            return numpy.count_nonzero((ends <= positions[:, None]) & (columns < segment_counts[:, None]), axis=1)
+        # Long patterns are bisected, the segment ends of a waveform are sorted
+        low = numpy.zeros_like(segment_counts)
+        high = segment_counts.copy()
+        for _ in range(width.bit_length()):
+            middle = (low + high) // 2
+            before = (self.segment_ends.take(offsets + middle, mode="clip") <= positions) & (low < high)
+            low = numpy.where(before, middle + 1, low)
+            high = numpy.where(before, high, middle)
+        return low
+
+    def mix(self, current_time: float, gains: numpy.ndarray | None = None) -> MixResult:
+        # Evaluates every vibe at the current time and drops the ones that ended
+        count = self.count
+        if count == 0:
+            return MixResult(0.0, False, numpy.zeros(self.TRIGGER_COUNT), self.trigger_counts)
+        triggers = self.triggers[:count]
+        flags = self.flags[:count]
+        elapsed = current_time - self.start_times[:count]
+        repetitions, positions = numpy.divmod(elapsed, self.periods[:count])
+        # Patterns end after their loops, constants and silences after their duration, conditional vibes never
+        active = numpy.where(flags & self.PATTERN, repetitions, elapsed) < self.limits[:count]
+        active |= (flags & self.UNLIMITED).astype(bool)
+        offsets = self.segment_offsets[:count]
+        segment_counts = self.segment_counts[:count]
+        segments = self.find_segments(offsets, segment_counts, positions)
+        active &= segments < segment_counts
+        intensities = self.segment_intensities.take(offsets + numpy.minimum(segments, segment_counts - 1))
+        if gains is not None:
+            intensities *= numpy.where(intensities > 0.0, gains[triggers], 1.0)
+        intensities *= active
+        silences = (flags & self.SILENCE).astype(bool) & active
+        silenced = bool(silences.any())
+        if silenced:
+            intensities[silences] = -1.0
+        trigger_intensities = numpy.bincount(triggers, weights=intensities, minlength=self.TRIGGER_COUNT)
+        if not active.all():
+            self.keep(active)
+        total = 0.0 if silenced else float(intensities.sum())
+        return MixResult(total, silenced, trigger_intensities, self.trigger_counts)
@@ -0,0 +1,270 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Stand-in for Intiface Central that speaks the Buttplug v3 protocol over a websocket and simulates devices without
+# any hardware. Every device command is recorded with a timestamp, to benchmark command rates and latencies.
+#
+# Usage: python -m overstim.mock_intiface --device "Mock Vibe:20,20" --latency 0.02 --record commands.jsonl
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+import websockets
+
+
+class MockDevice(NamedTuple):
+    name: str
+    step_counts: list[int] = [20]
+    latency: float = 0.0  # Seconds until a command is acknowledged
+    failure_rate: float = 0.0  # Probability that a command is answered with an error
+
+    @classmethod
+    def from_str(cls, value: str) -> "MockDevice":
+        # Format: name[:step_count,step_count,...]
+        name, _, step_counts = value.partition(":")
+        if not step_counts:
+            return cls(name=name)
+        return cls(name=name, step_counts=[int(step_count) for step_count in step_counts.split(",")])
+
+
+class ReceivedCommand(NamedTuple):
+    timestamp: float
+    message: str
+    device_index: int
+    actuator_index: int = -1
+    scalar: float = 0.0
+
+
+class MockIntifaceServer:
+    ERROR_UNKNOWN = 0
+    ERROR_MSG = 3
+    ERROR_DEVICE = 4
+
+    def __init__(self, devices: list[MockDevice], host: str = "127.0.0.1", port: int = 12345,
+                 max_ping_time: int = 0) -> None:
+        self.devices = devices
+        self.host = host
+        self.port = port
+        self.max_ping_time = max_ping_time
+        self.commands: list[ReceivedCommand] = []
+        self.connection_count = 0
+        self.server = None
+        self.connections = set()
+        self.device_locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def start(self) -> None:
+        self.server = await websockets.serve(self.handle_connection, self.host, self.port)
+        if self.port == 0:
+            self.port = next(iter(self.server.sockets)).getsockname()[1]
+        logging.info(f"Mock Intiface listening on {self.address}")
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __aenter__(self) -> "MockIntifaceServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()
+
+    @property
+    def address(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def drop_connections(self) -> None:
+        # Simulate a connection loss, the server keeps accepting new connections
+        connections = list(self.connections)
+        for connection in connections:
+            await connection.close(code=1011, reason="Simulated connection loss")
+        logging.info(f"Dropped {len(connections)} connections")
+
+    def device_info(self, index: int) -> dict:
+        device = self.devices[index]
+        return {
+            "DeviceName": device.name,
+            "DeviceIndex": index,
+            "DeviceMessages": {
+                "ScalarCmd": [{"FeatureDescriptor": f"Motor {actuator_index}",
+                               "StepCount": step_count,
+                               "ActuatorType": "Vibrate"}
+                              for actuator_index, step_count in enumerate(device.step_counts)],
+                "StopDeviceCmd": {},
+            },
+        }
+
+    async def handle_connection(self, connection, *args) -> None:
+        self.connection_count += 1
+        self.connections.add(connection)
+        tasks = set()
+        try:
+            async for data in connection:
+                for message in json.loads(data):
+                    # Handle messages concurrently, so a slow device does not delay pings or other devices
+                    (message_type, body), = message.items()
+                    task = asyncio.create_task(self.handle_message(connection, message_type, body))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(connection)
+            for task in tasks:
+                task.cancel()
+
+    async def handle_message(self, connection, message_type: str, body: dict) -> None:
+        message_id = body.get("Id", 0)
+        try:
+            reply = await self.reply(message_type, body)
+        except Exception as e:
+            error_code = getattr(e, "error_code", self.ERROR_UNKNOWN)
+            reply = [{"Error": {"ErrorMessage": str(e), "ErrorCode": error_code}}]
+        for message in reply:
+            (reply_type, reply_body), = message.items()
+            reply_body.setdefault("Id", message_id)
+        try:
+            await connection.send(json.dumps(reply))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def reply(self, message_type: str, body: dict) -> list[dict]:
+        if message_type == "RequestServerInfo":
+            return [{"ServerInfo": {"ServerName": "OverStim Mock Intiface", "MessageVersion": 3,
+                                    "MaxPingTime": self.max_ping_time}}]
+        if message_type == "RequestDeviceList":
+            return [{"DeviceList": {"Devices": [self.device_info(index) for index in range(len(self.devices))]}}]
+        if message_type in ["Ping", "StartScanning"]:
+            return [{"Ok": {}}]
+        if message_type == "StopScanning":
+            return [{"Ok": {}}, {"ScanningFinished": {"Id": 0}}]
+        if message_type == "StopAllDevices":
+            for index in range(len(self.devices)):
+                self.commands.append(ReceivedCommand(time.time(), message_type, index))
+            return [{"Ok": {}}]
+        if message_type == "StopDeviceCmd":
+            device_index = body["DeviceIndex"]
+            await self.run_device_command(device_index)
+            self.commands.append(ReceivedCommand(time.time(), message_type, device_index))
+            return [{"Ok": {}}]
+        if message_type == "ScalarCmd":
+            device_index = body["DeviceIndex"]
+            await self.run_device_command(device_index)
+            for scalar in body["Scalars"]:
+                if not 0 <= scalar["Index"] < len(self.devices[device_index].step_counts):
+                    raise MockError(f"Invalid actuator index {scalar['Index']}", self.ERROR_DEVICE)
+                self.commands.append(ReceivedCommand(
+                    time.time(), message_type, device_index, scalar["Index"], scalar["Scalar"]))
+            return [{"Ok": {}}]
+        raise MockError(f"Unsupported message {message_type}", self.ERROR_MSG)
+
+    async def run_device_command(self, device_index: int) -> None:
+        if not 0 <= device_index < len(self.devices):
+            raise MockError(f"Invalid device index {device_index}", self.ERROR_DEVICE)
+        device = self.devices[device_index]
+        # Devices handle one command at a time, like a Bluetooth connection
+        async with self.device_locks[device_index]:
+            if device.latency > 0.0:
+                await asyncio.sleep(device.latency)
+        if random.random() < device.failure_rate:
+            raise MockError(f"Simulated failure of {device.name}", self.ERROR_DEVICE)
+
+    def command_rate(self, device_index: int, window: float = 1.0) -> float:
+        # Commands per second received for a device within the last window
+        now = time.time()
+        timestamps = {command.timestamp for command in self.commands
+                      if command.device_index == device_index and command.timestamp >= now - window}
+        return len(timestamps) / window
+
+    def summary(self) -> str:
+        lines = [f"Connections: {self.connection_count}"]
+        for index, device in enumerate(self.devices):
+            commands = [command for command in self.commands if command.device_index == index]
+            # Commands sent in one message share a timestamp
+            timestamps = sorted({command.timestamp for command in commands})
+            if len(timestamps) > 1:
+                intervals = [b - a for a, b in zip(timestamps, timestamps[1:])]
+                rate = (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
+                lines.append(f"[{device.name}] Messages: {len(timestamps)} | Rate: {rate:.1f}/s | "
+                             f"Min. interval: {1000 * min(intervals):.1f}ms")
+            else:
+                lines.append(f"[{device.name}] Messages: {len(timestamps)}")
+        return "\n".join(lines)
+
+    def save_commands(self, filename: str) -> None:
+        with open(filename, "w") as file:
+            for command in self.commands:
+                file.write(json.dumps(command._asdict()) + "\n")
+
+
+class MockError(Exception):
+    def __init__(self, message: str, error_code: int) -> None:
+        super().__init__(message)
+        self.error_code = error_code
+
+
+async def serve(server: MockIntifaceServer, drop_every: float) -> None:
+    async with server:
+        while True:
+            if drop_every > 0.0:
+                await asyncio.sleep(drop_every)
+                await server.drop_connections()
+            else:
+                await asyncio.sleep(10.0)
+            logging.info(server.summary())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock Intiface server with simulated devices.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--device", action="append", default=[],
+                        help='Simulated device as "name:step_count,..." with one step count per actuator; repeatable.')
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds until each command is acknowledged.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a command fails.")
+    parser.add_argument("--max-ping-time", type=int, default=0, help="Ping timeout in milliseconds, 0 to disable.")
+    parser.add_argument("--drop-every", type=float, default=0.0,
+                        help="Drop all connections every this many seconds, to test reconnecting.")
+    parser.add_argument("--record", help="Write received commands as JSON lines to this file on exit.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    devices = [MockDevice.from_str(device) for device in args.device or ["Mock Vibe:20"]]
+    devices = [device._replace(latency=args.latency, failure_rate=args.failure_rate) for device in devices]
+    server = MockIntifaceServer(devices, args.host, args.port, args.max_ping_time)
+    try:
+        asyncio.run(serve(server, args.drop_every))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info(server.summary())
+        if args.record:
+            server.save_commands(args.record)
+
+
+if __name__ == "__main__":
+    main()
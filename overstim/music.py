@@ -0,0 +1,322 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Analyses music in fixed-size blocks on its own thread and lets Lucio's songs vibe along with it: the healing song
+# follows the bass, the speed song pulses on the beats. Music comes from a WAV file, or from what the computer plays
+# with the optional soundcard package.
+#
+# Usage: python -m overstim.music song.wav
+#        python -m overstim.music song.wav --realtime --block-size 512
+
+import abc
+import argparse
+import logging
+import math
+import threading
+import time
+import wave
+from collections import deque
+from typing import NamedTuple
+
+import numpy
+
+from .metrics import Metrics
+from .profiler import Profiler
+from .triggers import Trigger
+from .vibe import VibeManager
+
+
+class AudioSource(abc.ABC):
+    sample_rate: int
+
+    @abc.abstractmethod
+    def read(self, frames: int) -> numpy.ndarray | None:
+        # Next block as mono float32 samples between -1 and 1, None at the end
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class WavAudioSource(AudioSource):
+    # Falling further behind real time skips ahead, which keeps the latency bounded
+    MAX_LAG = 0.2
+
+    def __init__(self, filename: str, realtime: bool = True, loop: bool = False) -> None:
+        self.filename = filename
+        self.realtime = realtime
+        self.loop = loop
+        try:
+            self.file = wave.open(filename, "rb")
+        except (wave.Error, EOFError) as e:
+            raise ValueError(f"{filename} is not a supported WAV file: {e}")
+        if self.file.getcomptype() != "NONE":
+            raise ValueError(f"{filename} is compressed, only PCM WAV files are supported")
+        self.sample_rate = self.file.getframerate()
+        self.channels = self.file.getnchannels()
+        self.sample_width = self.file.getsampwidth()
+        self.start_time: float | None = None
+        self.position = 0
+        self.skipped_frames = 0
+
+    def read(self, frames: int) -> numpy.ndarray | None:
+        if self.realtime:
+            now = time.perf_counter()
+            if self.start_time is None:
+                self.start_time = now
+            due_time = self.start_time + self.position / self.sample_rate
+            if due_time > now:
+                time.sleep(due_time - now)
+            elif now - due_time > self.MAX_LAG:
+                skip_frames = int((now - due_time) * self.sample_rate)
+                self.skip(skip_frames)
+        data = self.file.readframes(frames)
+        if len(data) < frames * self.channels * self.sample_width and self.loop:
+            self.file.rewind()
+            data += self.file.readframes(frames - len(data) // (self.channels * self.sample_width))
+        if not data:
+            return None
+        self.position += frames
+        return self.to_samples(data)
+
+    def skip(self, frames: int) -> None:
+        self.position += frames
+        self.skipped_frames += frames
+        position = self.file.tell() + frames
+        if position >= self.file.getnframes():
+            if not self.loop:
+                position = self.file.getnframes()
+            else:
+                position %= self.file.getnframes()
+        self.file.setpos(position)
+
+    def to_samples(self, data: bytes) -> numpy.ndarray:
+        if self.sample_width == 1:
+            samples = (numpy.frombuffer(data, numpy.uint8).astype(numpy.float32) - 128) / 128
+        elif self.sample_width == 2:
+            samples = numpy.frombuffer(data, "<i2").astype(numpy.float32) / (1 << 15)
+        elif self.sample_width == 3:
+            raw = numpy.frombuffer(data, numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+            samples = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 8).astype(numpy.float32) / (1 << 23)
+        else:
+            samples = numpy.frombuffer(data, "<i4").astype(numpy.float32) / (1 << 31)
+        return samples.reshape(-1, self.channels).mean(axis=1, dtype=numpy.float32)
+
+    def close(self) -> None:
+        self.file.close()
+        if self.skipped_frames:
+            logging.warning(f"Skipped {self.skipped_frames / self.sample_rate:.1f}s of {self.filename} "
+                            f"to keep up with real time")
+
+
+class LoopbackAudioSource(AudioSource):
+    # Records what the default output device plays
+    def __init__(self, sample_rate: int = 44100) -> None:
+        try:
+            import soundcard
+        except ImportError:
+            raise ValueError("Playing music from the computer needs the soundcard package: pip install soundcard")
+        self.sample_rate = sample_rate
+        speaker = soundcard.default_speaker()
+        microphone = soundcard.get_microphone(str(speaker.name), include_loopback=True)
+        self.recorder = microphone.recorder(samplerate=sample_rate, channels=1)
+        self.recorder.__enter__()
+
+    def read(self, frames: int) -> numpy.ndarray | None:
+        return self.recorder.record(numframes=frames)[:, 0].astype(numpy.float32)
+
+    def close(self) -> None:
+        self.recorder.__exit__(None, None, None)
+
+
+def create_audio_source(music_source: str) -> AudioSource:
+    if music_source == "loopback":
+        return LoopbackAudioSource()
+    return WavAudioSource(music_source, realtime=True, loop=True)
+
+
+class AudioFeatures(NamedTuple):
+    time: float = 0.0  # Seconds of audio up to the end of the block
+    # Loudness and energy of the bands, relative to their recent peaks
+    level: float = 0.0
+    bass: float = 0.0
+    mid: float = 0.0
+    treble: float = 0.0
+    onset: bool = False
+    beat: float = 0.0  # 1 on an onset, then decaying
+    tempo: float = 0.0  # Beats per minute, 0 until known
+
+
+class AudioAnalyzer:
+    BANDS = {"bass": (20.0, 250.0), "mid": (250.0, 2000.0), "treble": (2000.0, 8000.0)}
+    # Peaks fall to half within this many seconds, so quiet songs still use the whole range
+    PEAK_HALF_LIFE = 5.0
+    BEAT_DECAY = 0.15
+    ONSET_HISTORY = 1.5
+    # No onsets until there is some history to compare with
+    ONSET_WARMUP = 0.2
+    ONSET_SENSITIVITY = 1.5
+    MIN_ONSET_INTERVAL = 0.1
+    MIN_BEAT_INTERVAL = 0.3
+    MAX_BEAT_INTERVAL = 1.5
+
+    def __init__(self, sample_rate: int, block_size: int = 1024) -> None:
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.block_duration = block_size / sample_rate
+        self.window = numpy.hanning(block_size).astype(numpy.float32)
+        frequencies = numpy.fft.rfftfreq(block_size, 1 / sample_rate)
+        self.band_bins = {name: (frequencies >= low) & (frequencies < high)
+                          for name, (low, high) in self.BANDS.items()}
+        self.previous_magnitudes = numpy.zeros(len(frequencies), dtype=numpy.float32)
+        self.flux_history = numpy.zeros(max(int(self.ONSET_HISTORY / self.block_duration), 2), dtype=numpy.float32)
+        self.flux_index = 0
+        self.flux_count = 0
+        self.peak_decay = 0.5 ** (self.block_duration / self.PEAK_HALF_LIFE)
+        self.peaks = {name: 1e-6 for name in ["level", *self.BANDS]}
+        self.beat_decay = math.exp(-self.block_duration / self.BEAT_DECAY)
+        self.onset_times: deque[float] = deque(maxlen=16)
+        self.features = AudioFeatures()
+
+    def normalize(self, name: str, value: float) -> float:
+        peak = max(value, self.peaks[name] * self.peak_decay, 1e-6)
+        self.peaks[name] = peak
+        return value / peak
+
+    def analyze(self, samples: numpy.ndarray) -> AudioFeatures:
+        if len(samples) < self.block_size:
+            samples = numpy.pad(samples, (0, self.block_size - len(samples)))
+        block_time = self.features.time + self.block_duration
+        magnitudes = numpy.abs(numpy.fft.rfft(samples[:self.block_size] * self.window)).astype(numpy.float32)
+        power = magnitudes * magnitudes
+
+        # Onsets are blocks whose spectrum grew much more than in the blocks before
+        flux = float(numpy.maximum(magnitudes - self.previous_magnitudes, 0.0).sum())
+        self.previous_magnitudes = magnitudes
+        history = self.flux_history[:self.flux_count]
+        threshold = float(history.mean() + self.ONSET_SENSITIVITY * history.std()) if self.flux_count else 0.0
+        self.flux_history[self.flux_index] = flux
+        self.flux_index = (self.flux_index + 1) % len(self.flux_history)
+        self.flux_count = min(self.flux_count + 1, len(self.flux_history))
+        onset = flux > threshold > 0.0 and block_time >= self.ONSET_WARMUP and \
+            (not self.onset_times or block_time - self.onset_times[-1] >= self.MIN_ONSET_INTERVAL)
+
+        tempo = self.features.tempo
+        if onset:
+            self.onset_times.append(block_time)
+            intervals = numpy.diff(numpy.array(self.onset_times))
+            intervals = intervals[(intervals >= self.MIN_BEAT_INTERVAL) & (intervals <= self.MAX_BEAT_INTERVAL)]
+            if len(intervals) >= 3:
+                tempo = 60.0 / float(intervals.mean())
+
+        self.features = AudioFeatures(
+            time=block_time,
+            level=self.normalize("level", float(numpy.sqrt(numpy.mean(samples * samples)))),
+            bass=self.normalize("bass", float(power[self.band_bins["bass"]].sum())),
+            mid=self.normalize("mid", float(power[self.band_bins["mid"]].sum())),
+            treble=self.normalize("treble", float(power[self.band_bins["treble"]].sum())),
+            onset=onset,
+            beat=1.0 if onset else self.features.beat * self.beat_decay,
+            tempo=tempo)
+        return self.features
+
+
+def song_gains(features: AudioFeatures, depth: float) -> dict[Trigger, float]:
+    # Depth is the part of the song intensity that follows the music, the rest always stays
+    return {Trigger.HEALING_SONG: 1.0 - depth + depth * features.bass,
+            Trigger.SPEED_SONG: 1.0 - depth + depth * features.beat}
+
+
+class MusicAnalysis:
+    BLOCK_SIZE = 1024
+
+    def __init__(self, source: AudioSource, vibe_manager: VibeManager, depth: float,
+                 profiler: Profiler | None = None, metrics: Metrics | None = None) -> None:
+        self.source = source
+        self.vibe_manager = vibe_manager
+        self.depth = depth
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.analyzer = AudioAnalyzer(source.sample_rate, self.BLOCK_SIZE)
+        self.stop_request = False
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="MusicAnalysis", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        try:
+            while not self.stop_request:
+                samples = self.source.read(self.BLOCK_SIZE)
+                if samples is None:
+                    break
+                analysis_start = time.perf_counter()
+                features = self.analyzer.analyze(samples)
+                # Replaced in one step, the control loop always sees a complete set of gains
+                self.vibe_manager.gains = song_gains(features, self.depth)
+                self.profiler.record("music block", time.perf_counter() - analysis_start)
+                self.metrics.set("overstim_music_tempo", features.tempo)
+        except Exception as e:
+            logging.error("Music analysis failed.", exc_info=e)
+        finally:
+            self.vibe_manager.gains = {}
+
+    def stop(self) -> None:
+        self.stop_request = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.source.close()
+        self.vibe_manager.gains = {}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Analyse a WAV file like the music mode does and print the beats.")
+    parser.add_argument("wav", help="PCM WAV file.")
+    parser.add_argument("--block-size", type=int, default=MusicAnalysis.BLOCK_SIZE)
+    parser.add_argument("--realtime", action="store_true", help="Read the file at the speed it plays.")
+    parser.add_argument("--depth", type=float, default=0.8, help="Part of the song intensity that follows the music.")
+    args = parser.parse_args()
+
+    source = WavAudioSource(args.wav, realtime=args.realtime)
+    analyzer = AudioAnalyzer(source.sample_rate, args.block_size)
+    blocks = 0
+    onsets = 0
+    analysis_time = 0.0
+    while (samples := source.read(args.block_size)) is not None:
+        analysis_start = time.perf_counter()
+        features = analyzer.analyze(samples)
+        analysis_time += time.perf_counter() - analysis_start
+        blocks += 1
+        if features.onset:
+            onsets += 1
+            gains = song_gains(features, args.depth)
+            print(f"{features.time:8.3f}s Beat | Tempo: {features.tempo:5.1f} BPM | Bass: {features.bass:.2f} | "
+                  f"Mid: {features.mid:.2f} | Treble: {features.treble:.2f} | "
+                  f"Healing Song: {gains[Trigger.HEALING_SONG] * 100:.0f}% | "
+                  f"Speed Song: {gains[Trigger.SPEED_SONG] * 100:.0f}%")
+    source.close()
+    print(f"Blocks: {blocks} ({1000 * args.block_size / source.sample_rate:.1f}ms each) | Beats: {onsets} | "
+          f"Tempo: {analyzer.features.tempo:.1f} BPM | "
+          f"Analysis: {1000 * analysis_time / max(blocks, 1):.3f}ms per block")
+
+
+if __name__ == "__main__":
+    main()
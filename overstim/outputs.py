@@ -0,0 +1,617 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Outputs receive the mixed intensity from the controller and pass it on, e.g. to the devices of an Intiface server.
+# Every output runs on its own task and keeps up at its own pace, so a slow output never holds up the detections or
+# the other outputs.
+
+import abc
+import asyncio
+import logging
+import time
+from collections.abc import Mapping, Sequence
+from typing import NamedTuple
+
+import buttplug
+from buttplug import Client, WebsocketConnector, ProtocolSpec
+from buttplug.messages import v3
+
+from .heroes import Hero2
+from .metrics import Metrics, metric_name
+from .profiler import Profiler
+from .state_stream import StateStreamWriter
+from .triggers import Trigger
+from .utils import clamp_value, round_value_to_nearest_step, Config, format_enum, RateLimitedLogger
+from .vibe import PendingLatency
+
+
+class IntensityCurve:
+    # Maps the mixed intensity to the intensity of a device, linearly between the points
+    def __init__(self, points: Sequence[tuple[float, float]]) -> None:
+        self.points = sorted(points)
+        assert self.points, "The curve has no points."
+
+    def apply(self, intensity: float) -> float:
+        if intensity == 0.0:
+            # Stopping is never changed by a curve
+            return 0.0
+        previous_x, previous_y = self.points[0]
+        if intensity <= previous_x:
+            return previous_y
+        for x, y in self.points[1:]:
+            if intensity <= x:
+                return previous_y + (y - previous_y) * (intensity - previous_x) / (x - previous_x)
+            previous_x, previous_y = x, y
+        return previous_y
+
+    def __str__(self) -> str:
+        return ",".join(f"{x:g}:{y:g}" for x, y in self.points)
+
+    @classmethod
+    def from_str(cls, value: str) -> "IntensityCurve":
+        # Format: input:output,input:output,...
+        points = []
+        for point in value.split(","):
+            x, y = point.split(":")
+            points.append((float(x), float(y)))
+        return cls(points)
+
+
+def parse_device_curves(entries: Sequence[str]) -> dict[str, IntensityCurve]:
+    # Format of each entry: device name=input:output,input:output,...
+    curves = {}
+    for entry in entries:
+        name, _, curve = entry.rpartition("=")
+        try:
+            curves[name.strip()] = IntensityCurve.from_str(curve)
+        except (AssertionError, ValueError) as e:
+            logging.error(f'Invalid device curve "{entry}"; ignoring it: {e!r}')
+    return curves
+
+
+class ActuatorProfile:
+    def __init__(self, step_count: int, max_intensity: float) -> None:
+        # Smallest intensity change supported by the actuator
+        self.step = 1 / step_count
+        self.digits = len(str(float(self.step)).split(".")[1])
+        # Highest step that does not exceed the user-defined max intensity
+        self.max_intensity = round_value_to_nearest_step(max_intensity, self.step)
+        while self.max_intensity > max_intensity:
+            self.max_intensity -= self.step
+        # Last intensity sent to the actuator, None if unknown
+        self.last_intensity: float | None = None
+
+    def quantize(self, intensity: float) -> float:
+        # Set intensity to the closest step supported by the actuator, and limit it to the max intensity
+        return clamp_value(round(self.step * round(intensity / self.step, 0), self.digits),
+                           self.max_intensity, value_name="actuator intensity")
+
+
+class DeviceOutput:
+    def __init__(self, device: buttplug.Device, max_intensity: float, curve: IntensityCurve | None = None) -> None:
+        self.profiles = [ActuatorProfile(actuator.step_count, max_intensity) for actuator in device.actuators]
+        self.curve = curve
+        # Output level of the device, which follows the intensity at the configured slew rate
+        self.level = 0.0
+        self.level_time: float | None = None
+        # Intensity the device is fully up to date with, None if unknown
+        self.synced_intensity: float | None = None
+        self.last_command_time = float("-inf")
+        # Names of the timings and metrics of the device, built once instead of for every command
+        self.stage_name = f"device {device.name}"
+        self.commands_metric = metric_name("overstim_device_commands_total", device=device.name)
+        self.errors_metric = metric_name("overstim_device_errors_total", device=device.name)
+
+    def follow(self, intensity: float, current_time: float, slew_rate: float,
+               change_time: float = float("-inf")) -> float:
+        if self.level_time is None:
+            self.level_time = current_time
+        if slew_rate <= 0.0 or intensity == 0.0:
+            # Jump straight to the intensity, always when stopping
+            self.level = intensity
+        else:
+            # The level does not move towards the intensity before it was published
+            max_change = slew_rate * (current_time - max(self.level_time, change_time))
+            self.level = min(max(intensity, self.level - max_change), self.level + max_change)
+        self.level_time = current_time
+        return self.level
+
+    def hold(self, current_time: float) -> None:
+        # The device is in sync and keeps its level, so the next change ramps from now instead of the last change
+        self.level_time = current_time
+
+    def actuator_intensities(self, level: float) -> list[float]:
+        if self.curve is not None:
+            level = self.curve.apply(level)
+        return [profile.quantize(level) for profile in self.profiles]
+
+    def reset(self) -> None:
+        for profile in self.profiles:
+            profile.last_intensity = 0.0
+        self.level = 0.0
+        self.synced_intensity = 0.0
+
+
+class OutputIntensity:
+    # Intensity published to the outputs, with the frames whose vibes led to it. The latency from those frames to the
+    # first device command is recorded by whichever output sends it first.
+    def __init__(self, intensity: float, pending_latencies: list[PendingLatency]) -> None:
+        self.intensity = intensity
+        self.pending_latencies = pending_latencies
+        self.publish_time = time.time()
+
+    def take_pending_latencies(self) -> list[PendingLatency]:
+        pending_latencies, self.pending_latencies = self.pending_latencies, []
+        return pending_latencies
+
+
+class OutputState(NamedTuple):
+    # State of the controller after a frame, for outputs that show more than the intensity
+    timestamp: float
+    intensity: float
+    fps: float
+    hero: Hero2
+    trigger_intensities: Mapping[Trigger, float]
+
+
+class Output(abc.ABC):
+    def __init__(self, name: str, config: Config, profiler: Profiler | None = None,
+                 metrics: Metrics | None = None) -> None:
+        self.name = name
+        self.config = config
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.target = OutputIntensity(0.0, [])
+        self.wake = asyncio.Event()
+        # Set by an emergency stop, no more commands are sent afterwards
+        self.halted = False
+
+    @property
+    def devices(self) -> list[buttplug.Device]:
+        return []
+
+    def publish(self, target: OutputIntensity) -> None:
+        self.target = target
+        self.wake.set()
+
+    def publish_state(self, state: OutputState) -> None:
+        pass
+
+    async def set_config(self, config: Config) -> None:
+        self.config = config
+
+    async def start(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def run(self) -> None:
+        pass
+
+    async def stop_devices(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class IntifaceOutput(Output):
+    CONNECT_TIMEOUT = 5.0
+    COMMAND_TIMEOUT = 1.0
+    SUPERVISION_INTERVAL = 0.1
+    PING_INTERVAL = 1.0
+    PING_TIMEOUT = 1.0
+    RECONNECT_DELAY_MIN = 0.1
+    RECONNECT_DELAY_MAX = 8.0
+    # Devices that are behind the intensity are updated this often, the others are checked less often for new devices
+    CATCH_UP_INTERVAL = 0.01
+    IDLE_INTERVAL = 0.25
+
+    def __init__(self, address: str, config: Config, profiler: Profiler | None = None,
+                 metrics: Metrics | None = None) -> None:
+        super().__init__(address, config, profiler, metrics)
+        self.address = address
+        self.log = RateLimitedLogger()
+        self.client = Client("OverStim", ProtocolSpec.v3)
+        self.connector: WebsocketConnector | None = None
+        self.connected = False
+        self.scanning = False
+        self.reconnects = 0
+        self.device_outputs: dict[buttplug.Device, DeviceOutput] = {}
+        self.curves = parse_device_curves(config.device_curves)
+        # Update of the devices in progress, which stops wait for so no command follows them
+        self.update_task: asyncio.Task | None = None
+
+    @property
+    def devices(self) -> list[buttplug.Device]:
+        if not self.connected:
+            return []
+        return [device for device in self.client.devices.values()
+                if device.name not in self.config.excluded_device_names]
+
+    async def set_config(self, config: Config) -> None:
+        old_config, old_devices = self.config, self.devices
+        self.config = config
+        if config.max_vibe_intensity != old_config.max_vibe_intensity or \
+                config.device_curves != old_config.device_curves:
+            # Actuator profiles depend on the max intensity, so devices are set up again and get the current intensity
+            self.curves = parse_device_curves(config.device_curves)
+            self.device_outputs.clear()
+        if config.excluded_device_names != old_config.excluded_device_names:
+            devices = self.devices
+            excluded_devices = [device for device in old_devices if device not in devices]
+            await asyncio.gather(*(self._stop_device(device) for device in excluded_devices))
+        if config.continuous_scanning != old_config.continuous_scanning and self.connected and self.client.connected:
+            if config.continuous_scanning and not self.scanning:
+                await self.client.start_scanning()
+                self.scanning = True
+            elif not config.continuous_scanning and self.scanning:
+                await self.client.stop_scanning()
+                self.scanning = False
+        self.wake.set()
+
+    async def start(self) -> None:
+        # An unreachable server is retried by the supervision, like a lost connection
+        try:
+            await self.connect()
+        except Exception as e:
+            logging.error(f"Failed to connect to Intiface at {self.address}, retrying in the background: {e!r}")
+
+    async def connect(self) -> None:
+        connector = WebsocketConnector(self.address, logger=self.client.logger)
+        try:
+            await asyncio.wait_for(self.client.connect(connector), self.CONNECT_TIMEOUT)
+        finally:
+            # A client whose connection was opened must be disconnected before it is replaced
+            if connector.connected:
+                self.connector = connector
+        logging.info(f"Connected to Intiface at {self.address}")
+
+        self.scanning = False
+        if self.client.connected:
+            await self.client.start_scanning()
+            self.scanning = True
+            if not self.config.continuous_scanning:
+                await asyncio.sleep(0.2)
+                await self.client.stop_scanning()
+                self.scanning = False
+            logging.info("Started scanning")
+            self.connected = True
+
+    async def supervise(self) -> None:
+        # Check the connection in the background, so the other outputs and the detections keep running during outages
+        last_ping = time.time()
+        while True:
+            await asyncio.sleep(self.SUPERVISION_INTERVAL)
+            if self.connected and self.client.connected:
+                if time.time() - last_ping < self.PING_INTERVAL:
+                    continue
+                try:
+                    await asyncio.wait_for(self.client.send(v3.Ping()), self.PING_TIMEOUT)
+                except Exception as e:
+                    logging.warning(f"Intiface at {self.address} did not respond to ping: {e!r}")
+                else:
+                    last_ping = time.time()
+                    continue
+            self.connected = False
+            await self.reconnect()
+            last_ping = time.time()
+
+    async def reconnect(self) -> None:
+        logging.warning(f"Lost connection to Intiface at {self.address}, reconnecting ...")
+        reconnect_start_time = time.time()
+        delay = self.RECONNECT_DELAY_MIN
+        while True:
+            # Devices are enumerated again by the new client, and get the current intensity once they are found
+            await self.discard_client()
+            self.client = Client("OverStim", ProtocolSpec.v3)
+            try:
+                await self.connect()
+            except Exception as e:
+                logging.warning(f"Reconnecting to Intiface failed, retrying in {delay:.1f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+            else:
+                self.reconnects += 1
+                self.metrics.inc("overstim_reconnects_total")
+                logging.info(f"Reconnected to Intiface after {time.time() - reconnect_start_time:.2f}s")
+                return
+
+    async def discard_client(self) -> None:
+        # The client may still hold its connection and ping task, e.g. when only a ping timed out. Once the
+        # connection is gone, disconnecting fails, which is not an error here.
+        if self.connector is None:
+            return
+        self.connector = None
+        result, = await asyncio.gather(asyncio.wait_for(self.client.disconnect(), self.COMMAND_TIMEOUT),
+                                       return_exceptions=True)
+        if isinstance(result, BaseException):
+            logging.debug(f"Disconnecting the old client of {self.address} failed: {result!r}")
+
+    async def run(self) -> None:
+        supervision_task = asyncio.create_task(self.supervise())
+        try:
+            while True:
+                timeout = self.IDLE_INTERVAL if self.synced() else self.CATCH_UP_INTERVAL
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wake.clear()
+                if not self.halted:
+                    update_task = self.update_task = asyncio.create_task(self.update_devices(time.time()))
+                    try:
+                        await asyncio.wait([update_task])
+                    finally:
+                        update_task.cancel()
+                        self.update_task = None
+                    if not update_task.cancelled():
+                        update_task.result()
+        finally:
+            supervision_task.cancel()
+            await asyncio.gather(supervision_task, return_exceptions=True)
+
+    def synced(self) -> bool:
+        for device in self.devices:
+            device_output = self.device_outputs.get(device)
+            if device_output is None or device_output.synced_intensity != self.target.intensity:
+                return False
+        return True
+
+    def _get_device_output(self, device: buttplug.Device) -> DeviceOutput:
+        device_output = self.device_outputs.get(device)
+        if device_output is None:
+            device_output = DeviceOutput(device, self.config.max_vibe_intensity, self.curves.get(device.name))
+            self.device_outputs[device] = device_output
+            steps = ", ".join(str(profile.step) for profile in device_output.profiles)
+            logging.info(f"[{device.name}] Actuator steps: {steps}")
+        return device_output
+
+    async def update_devices(self, current_time: float) -> None:
+        target = self.target
+        devices = self.devices
+        # Forget devices that are gone
+        if len(self.device_outputs) > len(devices):
+            for device in set(self.device_outputs) - set(devices):
+                del self.device_outputs[device]
+
+        first_command_time = None
+        for device in devices:
+            if self.halted:
+                return
+            device_output = self._get_device_output(device)
+            if device_output.synced_intensity == target.intensity:
+                device_output.hold(current_time)
+                continue
+            level = device_output.follow(target.intensity, current_time, self.config.intensity_slew_rate,
+                                         target.publish_time)
+            try:
+                # Quantize the new intensity for every actuator within the device
+                actuator_intensities = device_output.actuator_intensities(level)
+                changed = [actuator_intensity != profile.last_intensity
+                           for actuator_intensity, profile in zip(actuator_intensities, device_output.profiles)]
+
+                if any(changed):
+                    # Limit the command rate; intermediate intensities within the interval are coalesced and the
+                    # latest one is sent once the interval has passed. Stopping is never delayed.
+                    if self.config.max_command_rate > 0 and level > 0.0 and \
+                            current_time - device_output.last_command_time < 1 / self.config.max_command_rate:
+                        continue
+                    device_output.last_command_time = current_time
+
+                    # Send new intensity to every actuator, unless it already has that intensity
+                    command_start = time.perf_counter()
+                    for actuator, profile, actuator_intensity, actuator_changed in zip(
+                            device.actuators, device_output.profiles, actuator_intensities, changed):
+                        if self.halted:
+                            return
+                        if actuator_changed:
+                            await asyncio.wait_for(actuator.command(actuator_intensity), self.COMMAND_TIMEOUT)
+                            profile.last_intensity = actuator_intensity
+                    command_end = time.perf_counter()
+                    self.profiler.record(device_output.stage_name, command_end - command_start)
+                    self.metrics.inc(device_output.commands_metric)
+                    if first_command_time is None:
+                        first_command_time = command_end
+
+                    # Print new intensities of device actuators
+                    self.log.info(device.name, "[%s] Vibes: %s", device.name, actuator_intensities)
+
+                if level == target.intensity:
+                    device_output.synced_intensity = level
+
+            except Exception as device_intensity_update_error:
+                logging.warning("Stopping %s due to an error while altering its vibration: %r",
+                                device.name, device_intensity_update_error)
+                self.metrics.inc(device_output.errors_metric)
+                for profile in device_output.profiles:
+                    profile.last_intensity = None
+                device_output.synced_intensity = None
+                await self._stop_device(device)
+
+        if first_command_time is not None:
+            for pending in target.take_pending_latencies():
+                self.profiler.record(f"latency {format_enum(pending.trigger)} command",
+                                     first_command_time - pending.frame_time)
+
+    async def _stop_device(self, device: buttplug.Device) -> None:
+        try:
+            await asyncio.wait_for(device.stop(), self.COMMAND_TIMEOUT)
+        except Exception as device_stop_error:
+            logging.error("Failed to stop %s: %r", device.name, device_stop_error)
+
+    async def stop_devices(self) -> None:
+        # A command of an update in progress could otherwise arrive after the stops. The update is not cancelled, the
+        # buttplug client fails on the reply to a cancelled command; once halted, it ends after the current command.
+        update_task = self.update_task
+        if update_task is not None:
+            await asyncio.wait([update_task])
+        # Stop the devices at the same time, so a slow device does not delay the others
+        devices = self.devices
+        await asyncio.gather(*(self._stop_device(device) for device in devices))
+        for device in devices:
+            device_output = self.device_outputs.get(device)
+            if device_output is not None:
+                device_output.reset()
+
+    async def close(self) -> None:
+        if self.connected and self.client.connected:
+            if self.scanning:
+                await self.client.stop_scanning()
+            await self.client.disconnect()
+            logging.info(f"Disconnected from Intiface at {self.address}")
+        else:
+            # Left behind by a reconnect in progress
+            await self.discard_client()
+        self.connected = False
+
+
+class StateStreamOutput(Output):
+    # Writes the state of every frame to shared memory for overlays, see state_stream.py. The stream is opened and
+    # closed with the "state_stream_name" setting, also while running.
+    def __init__(self, config: Config, profiler: Profiler | None = None, metrics: Metrics | None = None) -> None:
+        super().__init__("state stream", config, profiler, metrics)
+        self.writer: StateStreamWriter | None = None
+        self.state: OutputState | None = None
+
+    def publish_state(self, state: OutputState) -> None:
+        if self.writer is not None:
+            self.state = state
+            self.wake.set()
+
+    async def set_config(self, config: Config) -> None:
+        old_config = self.config
+        self.config = config
+        if config.state_stream_name != old_config.state_stream_name:
+            self.close_writer()
+            self.open_writer()
+
+    async def start(self) -> None:
+        self.open_writer()
+
+    def open_writer(self) -> None:
+        if not self.config.state_stream_name or self.writer is not None:
+            return
+        try:
+            self.writer = StateStreamWriter(self.config.state_stream_name)
+            logging.info(f"Publishing state to shared memory {self.config.state_stream_name}")
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to create state stream {self.config.state_stream_name}.", exc_info=e)
+
+    def close_writer(self) -> None:
+        if self.writer is not None:
+            self.write_stopped()
+            self.writer.close()
+            self.writer = None
+            self.state = None
+
+    def write_stopped(self) -> None:
+        # Readers see that the devices were stopped
+        hero = self.state.hero if self.state is not None else Hero2.OTHER
+        self.writer.write(time.time(), 0.0, 0.0, hero, {})
+
+    async def run(self) -> None:
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            # Only the latest state is written, states published while writing are skipped
+            state = self.state
+            if self.writer is not None and state is not None and not self.halted:
+                self.writer.write(*state)
+
+    async def stop_devices(self) -> None:
+        if self.writer is not None:
+            self.write_stopped()
+
+    async def close(self) -> None:
+        self.close_writer()
+
+
+class OutputManager:
+    def __init__(self, outputs: Sequence[Output]) -> None:
+        self.outputs = list(outputs)
+        self.tasks: list[asyncio.Task] = []
+        self.intensity = 0.0
+
+    @property
+    def devices(self) -> list[buttplug.Device]:
+        return [device for output in self.outputs for device in output.devices]
+
+    async def start(self) -> None:
+        # Outputs start independently; one that fails to start is logged and still run, the others are not affected
+        results = await asyncio.gather(*(output.start() for output in self.outputs), return_exceptions=True)
+        for output, result in zip(self.outputs, results):
+            if isinstance(result, Exception):
+                logging.error(f"Output {output.name} failed to start.", exc_info=result)
+        self.tasks = [asyncio.create_task(self.run_output(output), name=f"Output {output.name}")
+                      for output in self.outputs]
+
+    @staticmethod
+    async def run_output(output: Output) -> None:
+        # An output that fails is logged and left behind, the others keep going
+        try:
+            await output.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Output {output.name} failed.", exc_info=e)
+
+    def publish(self, intensity: float, pending_latencies: list[PendingLatency]) -> None:
+        # Only changes are published; vibes that did not change the intensity are not felt, so their latency is dropped
+        if intensity == self.intensity:
+            return
+        self.intensity = intensity
+        target = OutputIntensity(intensity, pending_latencies)
+        for output in self.outputs:
+            output.publish(target)
+
+    def publish_state(self, state: OutputState) -> None:
+        for output in self.outputs:
+            output.publish_state(state)
+
+    async def set_config(self, config: Config) -> None:
+        await asyncio.gather(*(output.set_config(config) for output in self.outputs))
+
+    def halt(self) -> None:
+        for output in self.outputs:
+            output.halted = True
+
+    async def stop_devices(self) -> None:
+        self.intensity = 0.0
+        target = OutputIntensity(0.0, [])
+        for output in self.outputs:
+            output.target = target
+        await asyncio.gather(*(output.stop_devices() for output in self.outputs))
+        logging.info("Stopped all devices.")
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await asyncio.gather(*(output.close() for output in self.outputs))
+
+
+def create_outputs(config: Config, profiler: Profiler | None = None, metrics: Metrics | None = None) -> OutputManager:
+    outputs: list[Output] = []
+    if config.using_intiface:
+        for address in [config.websocket_address, *config.additional_websocket_addresses]:
+            outputs.append(IntifaceOutput(address, config, profiler, metrics))
+    # Created without a stream name as well, so it can be turned on while running
+    outputs.append(StateStreamOutput(config, profiler, metrics))
+    return OutputManager(outputs)
@@ -17,7 +17,6 @@
 #
 #  SPDX-License-Identifier: AGPL-3.0-or-later
 
-import os
 import time
 from typing import NamedTuple
 
@@ -32,10 +31,11 @@ class Notif(NamedTuple):
 
 
 class PlayerState:
-    def __init__(self, config: Config, asset_path: str) -> None:
+    def __init__(self, config: Config, computer_vision: ComputerVision) -> None:
         self.config = config
-        self.computer_vision = ComputerVision(self.config, os.path.join(asset_path, "templates"))
+        self.computer_vision = computer_vision
         self.current_time = 0
+        self.frame_time = 0.0
         self.supported_heroes: dict[Hero2, Hero] = {
             Hero2.JUNO: Juno(),
             Hero2.LUCIO: Lucio(),
@@ -62,6 +62,7 @@ class PlayerState:
 
     def refresh(self) -> None:
         self.computer_vision.capture_frame()
+        self.frame_time = self.computer_vision.frame_time
 
         # TODO: Shouldn't check for things that aren't enabled in the config
         self.current_time = time.time()
@@ -159,14 +160,14 @@ class PlayerState:
 
     def detect_new_notifs(self) -> None:
         # Coords are for the first row
-        notif_types = ["elimination", "assist", "save"]
+        notif_types = self.computer_vision.NOTIF_NAMES
 
         notifs = {}
-        for row in range(0, 2):
-            pixel_offset = row * 35  # Pixels between rows @ 1080p
+        for row in range(0, self.computer_vision.NOTIF_ROWS):
+            pixel_offset = row * self.computer_vision.NOTIF_ROW_OFFSET  # Pixels between rows @ 1080p
             no_notif_detected = True
             for notif_type in notif_types:
-                notif_coord = self.computer_vision.COORDS[notif_type]
+                notif_coord = self.computer_vision.coords[notif_type]
                 notif_coord = notif_coord._replace(top=notif_coord.top + row * pixel_offset)
                 if self.computer_vision.detect_single(notif_type, coord_override=notif_coord):
                     no_notif_detected = False
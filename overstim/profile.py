@@ -0,0 +1,233 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import logging
+import os
+import threading
+from typing import NamedTuple
+
+from .heroes import Hero2
+from .triggers import Trigger, Response, default_response, hero_triggers
+from .utils import Config
+
+PROFILE_VERSION = 1
+
+
+class TriggerSetting(NamedTuple):
+    response: Response
+    enabled: bool = True
+
+
+class Profile(NamedTuple):
+    config: Config = Config()
+    playing_hero: Hero2 = Hero2.MERCY
+    triggers: dict[Hero2, dict[Trigger, TriggerSetting]] = {}
+
+    def get_trigger(self, hero: Hero2, trigger: Trigger) -> TriggerSetting:
+        try:
+            return self.triggers[hero][trigger]
+        except KeyError:
+            return TriggerSetting(default_response(hero, trigger))
+
+    def responses(self) -> dict[Hero2, dict[Trigger, Response]]:
+        # Responses of the enabled triggers, as used by the controller
+        responses = {}
+        for hero in Hero2:
+            responses[hero] = {}
+            for trigger in hero_triggers(hero):
+                setting = self.get_trigger(hero, trigger)
+                if setting.enabled:
+                    responses[hero][trigger] = setting.response
+        return responses
+
+
+def default_profile() -> Profile:
+    return Profile(triggers={hero: {trigger: TriggerSetting(default_response(hero, trigger))
+                                    for trigger in hero_triggers(hero)}
+                             for hero in Hero2})
+
+
+def has_type_of(value: object, default_value: object) -> bool:
+    # Values are not converted, so "false" is not taken for true and "Lush" not for a list of letters
+    if isinstance(default_value, bool) or isinstance(value, bool):
+        return isinstance(value, bool) and isinstance(default_value, bool)
+    if isinstance(default_value, float):
+        return isinstance(value, (int, float))
+    if isinstance(default_value, list):
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+    return isinstance(value, type(default_value))
+
+
+def config_from_dict(values: dict) -> Config:
+    default_config = Config()
+    new_values = {}
+    for name, default_value in default_config._asdict().items():
+        if name not in values:
+            continue
+        value = values[name]
+        if has_type_of(value, default_value):
+            new_values[name] = float(value) if isinstance(default_value, float) else value
+        else:
+            logging.error(f"Invalid profile value {name}={value!r}, expected {type(default_value).__name__}; "
+                          f"using default.")
+    return default_config._replace(**new_values)
+
+
+def profile_to_dict(profile: Profile) -> dict:
+    return {
+        "version": PROFILE_VERSION,
+        "config": profile.config._asdict(),
+        "playing_hero": profile.playing_hero.name,
+        "triggers": {hero.name: {trigger.name: {"enabled": setting.enabled,
+                                                "response": json.loads(str(setting.response))}
+                                 for trigger, setting in hero_settings.items()}
+                     for hero, hero_settings in profile.triggers.items()},
+    }
+
+
+def profile_from_dict(values: dict) -> Profile:
+    # Missing or invalid entries fall back to the defaults, documents that are not profiles at all are rejected
+    if not isinstance(values, dict) or not isinstance(values.get("triggers", {}), dict) or \
+            not isinstance(values.get("config", {}), dict):
+        raise ValueError("Not an OverStim profile.")
+    version = values.get("version", PROFILE_VERSION)
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise ValueError(f"Invalid profile version {version!r}.")
+    if version > PROFILE_VERSION:
+        raise ValueError(f"Profile version {version} is newer than this version of OverStim supports.")
+    profile = default_profile()
+    triggers = {hero: dict(hero_settings) for hero, hero_settings in profile.triggers.items()}
+    for hero_name, hero_settings in values.get("triggers", {}).items():
+        if not isinstance(hero_settings, dict):
+            logging.error(f"Invalid profile triggers of {hero_name}; using defaults.")
+            continue
+        for trigger_name, setting in hero_settings.items():
+            try:
+                hero, trigger = Hero2[hero_name], Trigger[trigger_name]
+                response = Response.from_str(json.dumps(setting["response"])) if "response" in setting else \
+                    default_response(hero, trigger)
+                response.validate()
+                enabled = setting.get("enabled", True)
+                if not isinstance(enabled, bool):
+                    raise ValueError(f"enabled must be true or false, not {enabled!r}.")
+                triggers[hero][trigger] = TriggerSetting(response, enabled)
+            except Exception as e:
+                logging.error(f"Invalid profile trigger {hero_name}/{trigger_name}; using default.", exc_info=e)
+    playing_hero = profile.playing_hero
+    try:
+        playing_hero = Hero2[values.get("playing_hero", playing_hero.name)]
+    except KeyError:
+        logging.error(f"Invalid profile hero {values['playing_hero']!r}; using default.")
+    return Profile(config=config_from_dict(values.get("config", {})), playing_hero=playing_hero, triggers=triggers)
+
+
+def load_profile(filename: str) -> Profile:
+    with open(filename) as file:
+        return profile_from_dict(json.load(file))
+
+
+def save_profile(profile: Profile, filename: str) -> None:
+    write_profile_dict(profile_to_dict(profile), filename)
+
+
+def write_profile_dict(values: dict, filename: str) -> None:
+    # Replace the file in one step, so a crash while writing does not lose the profile
+    with open(filename + ".tmp", "w") as file:
+        json.dump(values, file, indent=2)
+    os.replace(filename + ".tmp", filename)
+
+
+class ProfileStore:
+    # Keeps the profile in memory and writes the whole document in the background when it changes. Changes made while
+    # a write is in progress are combined into the next write.
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.profile = default_profile()
+        self.lock = threading.Lock()
+        self.pending: dict | None = None
+        self.thread: threading.Thread | None = None
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.filename)
+
+    def load(self) -> Profile:
+        try:
+            self.profile = load_profile(self.filename)
+            logging.info(f"Loaded settings from {self.filename}")
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to load settings from {self.filename}; using defaults.", exc_info=e)
+            self.profile = default_profile()
+        return self.profile
+
+    def update(self, profile: Profile) -> None:
+        if profile == self.profile:
+            return
+        self.profile = profile
+        self.save()
+
+    def set_trigger(self, hero: Hero2, trigger: Trigger, setting: TriggerSetting) -> None:
+        if self.profile.get_trigger(hero, trigger) == setting:
+            return
+        triggers = dict(self.profile.triggers)
+        triggers[hero] = {**triggers.get(hero, {}), trigger: setting}
+        self.update(self.profile._replace(triggers=triggers))
+
+    def set_config(self, config: Config) -> None:
+        self.update(self.profile._replace(config=config))
+
+    def set_playing_hero(self, hero: Hero2) -> None:
+        self.update(self.profile._replace(playing_hero=hero))
+
+    def save(self) -> None:
+        values = profile_to_dict(self.profile)
+        with self.lock:
+            self.pending = values
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.write_pending, name="ProfileStore", daemon=True)
+                self.thread.start()
+
+    def write_pending(self) -> None:
+        while True:
+            with self.lock:
+                values, self.pending = self.pending, None
+                if values is None:
+                    self.thread = None
+                    return
+            try:
+                write_profile_dict(values, self.filename)
+            except OSError as e:
+                logging.error(f"Failed to save settings to {self.filename}.", exc_info=e)
+
+    def flush(self) -> None:
+        # Wait until every change is written
+        while True:
+            with self.lock:
+                thread = self.thread
+            if thread is None:
+                return
+            thread.join()
+
+    def delete(self) -> None:
+        self.flush()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
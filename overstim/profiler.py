@@ -0,0 +1,79 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import time
+from typing import NamedTuple
+
+from .stats import RingBuffer, percentile
+
+
+class StageStats(NamedTuple):
+    stage: str
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+
+class Profiler:
+    def __init__(self, enabled: bool = True, window: int = 1000) -> None:
+        self.enabled = enabled
+        self.window = window
+        self.histograms: dict[str, RingBuffer] = {}
+
+    def record(self, stage: str, duration: float) -> None:
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = RingBuffer(self.window)
+        histogram.add(duration)
+
+    def clear(self) -> None:
+        self.histograms.clear()
+
+    def snapshot(self) -> list[StageStats]:
+        stats = []
+        for stage, histogram in list(self.histograms.items()):
+            values = sorted(histogram.values())
+            if not values:
+                continue
+            stats.append(StageStats(
+                stage=stage,
+                count=histogram.total_count,
+                mean=sum(values) / len(values),
+                p50=percentile(values, 0.50),
+                p95=percentile(values, 0.95),
+                p99=percentile(values, 0.99),
+                max=values[-1]))
+        return stats
+
+    def format(self) -> str:
+        lines = [f"{'Stage':<40} {'Count':>8} {'Mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'Max':>8}"]
+        for stats in self.snapshot():
+            lines.append(f"{stats.stage:<40} {stats.count:>8d}" + "".join(
+                f" {1000 * value:>8.2f}" for value in stats[2:]))
+        return "\n".join(lines)
+
+    def dump(self, filename: str) -> None:
+        with open(filename, "w") as file:
+            file.write(f"OverStim stage timings in ms, {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+            file.write(self.format() + "\n")
@@ -0,0 +1,399 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Records the detection outcome of every frame to a compact binary log, and replays it into the trigger dispatch and
+# the VibeManager without capturing the screen, to reproduce a match deterministically and faster than real time.
+#
+# Usage: python -m overstim.session OverStim_Session_20250101_120000.ostm --speed 0 --intiface ws://127.0.0.1:12345
+#
+# File format (little-endian):
+#   Header: b"OSSN", u16 version, u32 length, JSON with the template names used as score indices
+#   Frame record: b"F", f64 timestamp, u8 hero, u8 detected hero, u8 new eliminations, u8 new assists,
+#                 u8 new saves, u32 flags (one bit per FLAG_FIELDS entry), u8 score count,
+#                 score count * (u8 template index, f16 score)
+#   Responses record: b"R", u32 length, JSON with the responses per hero and trigger, written whenever they change
+
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import time
+from collections import defaultdict
+from collections.abc import Iterator, Mapping, Sequence
+from typing import TYPE_CHECKING, NamedTuple
+
+from .heroes import Hero2
+from .outputs import IntifaceOutput, OutputManager
+from .profiler import Profiler
+from .triggers import Trigger, Response, is_conditional, default_response, hero_triggers
+from .utils import Config
+from .vibe import VibeManager
+
+if TYPE_CHECKING:
+    from .player_state import PlayerState
+
+
+class DetectionFrame(NamedTuple):
+    timestamp: float
+    hero: Hero2 = Hero2.OTHER
+    detected_hero: Hero2 = Hero2.OTHER
+    eliminations: int = 0
+    assists: int = 0
+    saves: int = 0
+    hero_auto_detect: bool = False
+    is_dead: bool = False
+    endorsed: bool = False
+    being_beamed: bool = False
+    being_orbed: bool = False
+    hacked: bool = False
+    resurrecting: bool = False
+    flash_heal: bool = False
+    glide_boost: bool = False
+    pulsar_torpedoes_firing: bool = False
+    pulsar_torpedoes_lock: bool = False
+    healing_song: bool = False
+    speed_song: bool = False
+    heal_beam: bool = False
+    damage_beam: bool = False
+    harmony_orb: bool = False
+    discord_orb: bool = False
+    scores: dict[str, float] = {}
+
+    @classmethod
+    def from_player_state(cls, player_state: "PlayerState", timestamp: float) -> "DetectionFrame":
+        hero = player_state.hero
+        return cls(
+            timestamp=timestamp,
+            hero=hero.name,
+            detected_hero=player_state.detected_hero,
+            eliminations=player_state.new_notifs.get("elimination", 0),
+            assists=player_state.new_notifs.get("assist", 0),
+            saves=player_state.new_notifs.get("save", 0),
+            hero_auto_detect=player_state.hero_auto_detect,
+            is_dead=player_state.is_dead,
+            endorsed=player_state.endorsed,
+            being_beamed=player_state.being_beamed,
+            being_orbed=player_state.being_orbed,
+            hacked=player_state.hacked,
+            # Hero attributes only exist for the hero being played
+            resurrecting=getattr(hero, "resurrecting", False),
+            flash_heal=getattr(hero, "flash_heal", False),
+            glide_boost=getattr(hero, "glide_boost", False),
+            pulsar_torpedoes_firing=getattr(hero, "pulsar_torpedoes_firing", False),
+            pulsar_torpedoes_lock=getattr(hero, "pulsar_torpedoes_lock", False),
+            healing_song=getattr(hero, "healing_song", False),
+            speed_song=getattr(hero, "speed_song", False),
+            heal_beam=getattr(hero, "heal_beam", False),
+            damage_beam=getattr(hero, "damage_beam", False),
+            harmony_orb=getattr(hero, "harmony_orb", False),
+            discord_orb=getattr(hero, "discord_orb", False),
+            scores=player_state.computer_vision.scores)
+
+
+FLAG_FIELDS = [name for name, default in DetectionFrame._field_defaults.items() if type(default) is bool]
+
+# Frame fields the conditional triggers follow
+CONDITION_FIELDS = {
+    Trigger.HACKED_BY_SOMBRA: "hacked",
+    Trigger.BEAMED_BY_MERCY: "being_beamed",
+    Trigger.ORBED_BY_ZENYATTA: "being_orbed",
+    Trigger.PULSAR_TORPEDOES_LOCK: "pulsar_torpedoes_lock",
+    Trigger.HEALING_SONG: "healing_song",
+    Trigger.SPEED_SONG: "speed_song",
+    Trigger.HEAL_BEAM: "heal_beam",
+    Trigger.DAMAGE_BEAM: "damage_beam",
+    Trigger.HARMONY_ORB: "harmony_orb",
+    Trigger.DISCORD_ORB: "discord_orb",
+}
+
+
+def dispatch_triggers(vibe_manager: VibeManager, responses: Mapping[Trigger, Response], frame: DetectionFrame) -> None:
+    for trigger, response in responses.items():
+        if not is_conditional(trigger):
+
+            if trigger is Trigger.ELIMINATION:
+                if frame.eliminations > 0:
+                    vibe_manager.add_vibe(trigger, response)
+
+            elif trigger is Trigger.ASSIST:
+                if frame.assists > 0:
+                    vibe_manager.add_vibe(trigger, response)
+
+            elif trigger is Trigger.SAVE:
+                if frame.saves > 0 and (frame.hero is not Hero2.MERCY or not frame.resurrecting):
+                    vibe_manager.add_vibe(trigger, response)
+
+            elif trigger is Trigger.RESURRECT:
+                if frame.resurrecting and not vibe_manager.vibe_for_trigger_created_within_seconds(trigger, 3):
+                    vibe_manager.add_vibe(trigger, response)
+
+            elif trigger is Trigger.FLASH_HEAL:
+                if frame.flash_heal:
+                    vibe_manager.add_vibe(trigger, response, suppression_secs=3.0)
+
+            elif trigger is Trigger.GLIDE_BOOST:
+                if frame.glide_boost and not vibe_manager.vibe_exists_for_trigger(trigger):
+                    vibe_manager.add_vibe(trigger, response)
+
+            elif trigger is Trigger.PULSAR_TORPEDOES_FIRE:
+                if frame.pulsar_torpedoes_firing and not vibe_manager.vibe_exists_for_trigger(trigger):
+                    vibe_manager.add_vibe(trigger, response)
+
+            elif trigger is Trigger.ENDORSEMENT_RECEIVED:
+                if frame.endorsed:
+                    vibe_manager.add_vibe(trigger, response, suppression_secs=4.8)
+
+        else:
+
+            if trigger is Trigger.HACKED_BY_SOMBRA:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.hacked)
+
+            elif trigger is Trigger.BEAMED_BY_MERCY:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.being_beamed)
+
+            elif trigger is Trigger.ORBED_BY_ZENYATTA:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.being_orbed)
+
+            elif trigger is Trigger.PULSAR_TORPEDOES_LOCK:
+                vibe_manager.toggle_vibe_to_condition(
+                    trigger, response,
+                    frame.pulsar_torpedoes_lock and
+                    not vibe_manager.vibe_exists_for_trigger(Trigger.PULSAR_TORPEDOES_FIRE))
+
+            elif trigger is Trigger.HEALING_SONG:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.healing_song)
+
+            elif trigger is Trigger.SPEED_SONG:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.speed_song)
+
+            elif trigger is Trigger.HEAL_BEAM:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.heal_beam)
+
+            elif trigger is Trigger.DAMAGE_BEAM:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.damage_beam)
+
+            elif trigger is Trigger.HARMONY_ORB:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.harmony_orb)
+
+            elif trigger is Trigger.DISCORD_ORB:
+                vibe_manager.toggle_vibe_to_condition(trigger, response, frame.discord_orb)
+
+
+def responses_to_json(responses: Mapping[Hero2, Mapping[Trigger, Response]]) -> str:
+    return json.dumps({hero.name: {trigger.name: str(response) for trigger, response in hero_responses.items()}
+                       for hero, hero_responses in responses.items()})
+
+
+def responses_from_json(value: str) -> dict[Hero2, dict[Trigger, Response]]:
+    responses = defaultdict(dict)
+    for hero_name, hero_responses in json.loads(value).items():
+        for trigger_name, response in hero_responses.items():
+            responses[Hero2[hero_name]][Trigger[trigger_name]] = Response.from_str(response)
+    return responses
+
+
+class SessionRecorder:
+    MAGIC = b"OSSN"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHI")
+    FRAME = struct.Struct("<cdBBBBBIB")
+    SCORE = struct.Struct("<Be")
+    RESPONSES = struct.Struct("<cI")
+
+    def __init__(self, filename: str, template_names: Sequence[str]) -> None:
+        self.filename = filename
+        self.template_indices = {name: index for index, name in enumerate(template_names)}
+        self.responses: Mapping[Hero2, Mapping[Trigger, Response]] | None = None
+        self.frame_count = 0
+        # Frames are small, a large buffer keeps disk writes out of most loop iterations
+        self.file = open(filename, "wb", buffering=1 << 16)
+        header = json.dumps({"templates": list(template_names), "created": time.time()}).encode()
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(header)) + header)
+        logging.info(f"Recording session to {filename}")
+
+    def write_frame(self, frame: DetectionFrame, responses: Mapping[Hero2, Mapping[Trigger, Response]]) -> None:
+        if responses is not self.responses:
+            self.responses = responses
+            data = responses_to_json(responses).encode()
+            self.file.write(self.RESPONSES.pack(b"R", len(data)) + data)
+        flags = 0
+        for bit, name in enumerate(FLAG_FIELDS):
+            if getattr(frame, name):
+                flags |= 1 << bit
+        scores = [(self.template_indices[name], score) for name, score in frame.scores.items()
+                  if name in self.template_indices]
+        self.file.write(self.FRAME.pack(
+            b"F", frame.timestamp, frame.hero.value, frame.detected_hero.value,
+            min(frame.eliminations, 255), min(frame.assists, 255), min(frame.saves, 255), flags, len(scores)))
+        for index, score in scores:
+            self.file.write(self.SCORE.pack(index, score))
+        self.frame_count += 1
+
+    def close(self) -> None:
+        self.file.close()
+        logging.info(f"Recorded {self.frame_count} frames to {self.filename}")
+
+
+class SessionEvent(NamedTuple):
+    frame: DetectionFrame | None = None
+    responses: dict[Hero2, dict[Trigger, Response]] | None = None
+
+
+def read_session(filename: str) -> Iterator[SessionEvent]:
+    with open(filename, "rb") as file:
+        magic, version, header_length = SessionRecorder.HEADER.unpack(file.read(SessionRecorder.HEADER.size))
+        if magic != SessionRecorder.MAGIC or version != SessionRecorder.VERSION:
+            raise ValueError(f"{filename} is not a supported OverStim session recording")
+        template_names = json.loads(file.read(header_length))["templates"]
+        while True:
+            tag = file.read(1)
+            if tag == b"F":
+                data = file.read(SessionRecorder.FRAME.size - 1)
+                if len(data) < SessionRecorder.FRAME.size - 1:
+                    break
+                _, timestamp, hero, detected_hero, eliminations, assists, saves, flags, score_count = \
+                    SessionRecorder.FRAME.unpack(tag + data)
+                data = file.read(score_count * SessionRecorder.SCORE.size)
+                if len(data) < score_count * SessionRecorder.SCORE.size:
+                    break
+                scores = {template_names[index]: score
+                          for index, score in SessionRecorder.SCORE.iter_unpack(data)}
+                yield SessionEvent(frame=DetectionFrame(
+                    timestamp, Hero2(hero), Hero2(detected_hero), eliminations, assists, saves,
+                    *(bool(flags & (1 << bit)) for bit in range(len(FLAG_FIELDS))), scores=scores))
+            elif tag == b"R":
+                data = file.read(SessionRecorder.RESPONSES.size - 1)
+                if len(data) < SessionRecorder.RESPONSES.size - 1:
+                    break
+                _, length = SessionRecorder.RESPONSES.unpack(tag + data)
+                data = file.read(length)
+                if len(data) < length:
+                    break
+                yield SessionEvent(responses=responses_from_json(data.decode()))
+            else:
+                # End of file, or a record cut off when the recording was interrupted
+                break
+
+
+class ReplayStats(NamedTuple):
+    frames: int = 0
+    session_duration: float = 0.0
+    replay_duration: float = 0.0
+    intensity_changes: int = 0
+    max_intensity: float = 0.0
+
+    def __str__(self) -> str:
+        speedup = self.session_duration / self.replay_duration if self.replay_duration > 0.0 else 0.0
+        return (f"Frames: {self.frames} | Session: {self.session_duration:.1f}s | "
+                f"Replay: {self.replay_duration:.2f}s ({speedup:.1f}x) | "
+                f"Intensity changes: {self.intensity_changes} | Max. intensity: {self.max_intensity * 100:.0f}%")
+
+
+async def replay_session(filename: str, vibe_manager: VibeManager, outputs: OutputManager, speed: float = 0.0,
+                         responses: Mapping[Hero2, Mapping[Trigger, Response]] | None = None) -> ReplayStats:
+    # Replays as fast as possible at speed 0, otherwise scaled to the recorded timestamps.
+    # Responses stored in the recording are used, unless responses are given.
+    recorded_responses: Mapping[Hero2, Mapping[Trigger, Response]] = defaultdict(dict)
+    first_timestamp: float | None = None
+    last_timestamp = 0.0
+    frames = 0
+    intensity_changes = 0
+    max_intensity = 0.0
+    replay_start = time.perf_counter()
+    for event in read_session(filename):
+        if event.responses is not None:
+            recorded_responses = event.responses
+            continue
+        frame = event.frame
+        if first_timestamp is None:
+            first_timestamp = frame.timestamp
+        if speed > 0.0:
+            delay = (frame.timestamp - first_timestamp) / speed - (time.perf_counter() - replay_start)
+            if delay > 0.0:
+                await asyncio.sleep(delay)
+        else:
+            # Let the outputs and the connection to Intiface breathe
+            await asyncio.sleep(0)
+
+        intensity = vibe_manager.real_intensity
+        vibe_manager.update(frame.timestamp)
+        outputs.publish(vibe_manager.real_intensity, vibe_manager.take_pending_latencies())
+        vibe_manager.frame_time = None
+        dispatch_triggers(vibe_manager, (responses or recorded_responses).get(frame.hero, {}), frame)
+        # Vibes end when another hero is detected, like in the controller. Heroes switched by hand keep them.
+        if frame.hero_auto_detect and frame.detected_hero is not frame.hero:
+            vibe_manager.clear_vibes()
+        if vibe_manager.real_intensity != intensity:
+            intensity_changes += 1
+        max_intensity = max(max_intensity, vibe_manager.real_intensity)
+        last_timestamp = frame.timestamp
+        frames += 1
+
+    vibe_manager.stop()
+    await outputs.stop_devices()
+    return ReplayStats(
+        frames=frames,
+        session_duration=last_timestamp - first_timestamp if first_timestamp is not None else 0.0,
+        replay_duration=time.perf_counter() - replay_start,
+        intensity_changes=intensity_changes,
+        max_intensity=max_intensity)
+
+
+async def replay(args: argparse.Namespace) -> None:
+    config = Config()._replace(max_vibe_intensity=args.max_intensity, max_command_rate=args.max_command_rate)
+    profiler = Profiler()
+    vibe_manager = VibeManager(config, profiler)
+    responses = None
+    if args.default_responses:
+        responses = {hero: {trigger: default_response(hero, trigger) for trigger in hero_triggers(hero)}
+                     for hero in Hero2}
+
+    outputs = OutputManager([IntifaceOutput(args.intiface, config._replace(continuous_scanning=False), profiler)]
+                            if args.intiface else [])
+    await outputs.start()
+    if args.intiface:
+        logging.info(f"Connected to {args.intiface} with {len(outputs.devices)} devices")
+
+    try:
+        stats = await replay_session(args.filename, vibe_manager, outputs, args.speed, responses)
+    finally:
+        await outputs.close()
+    logging.info(str(stats))
+    logging.info(f"Stage timings in ms:\n{profiler.format()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded OverStim session without capturing the screen.")
+    parser.add_argument("filename", help="Session recording (.ostm).")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Replay speed relative to real time, 0 to replay as fast as possible.")
+    parser.add_argument("--intiface", help="Websocket address of Intiface to send device commands to.")
+    parser.add_argument("--default-responses", action="store_true",
+                        help="Use the default responses instead of the ones stored in the recording.")
+    parser.add_argument("--max-intensity", type=float, default=Config().max_vibe_intensity)
+    parser.add_argument("--max-command-rate", type=int, default=Config().max_command_rate)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
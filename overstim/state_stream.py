@@ -0,0 +1,253 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Publishes the live state of the controller in a ring of fixed-size records in shared memory, for overlays, stream
+# tools and dashboards on the same computer. There is a single writer and any number of readers, and neither side ever
+# waits for the other: every record carries a sequence number that is odd while the record is written, and readers
+# retry or skip a record whose sequence number changed while they copied it.
+#
+# Usage: python -m overstim.state_stream --name overstim_state
+#        python -m overstim.state_stream --name overstim_state --all
+#
+# Memory layout (little-endian):
+#   Header: b"OSST", u16 version, u16 trigger count, u32 record size, u32 capacity, u32 records offset,
+#           u32 metadata length, u64 records written
+#   Metadata: JSON with the trigger names in record order and the hero names by number
+#   Records from the records offset, capacity * record size bytes. Record n is stored at index n % capacity as
+#           u64 sequence (2 * n + 1 while written, 2 * n + 2 once complete), f64 timestamp, f32 intensity, f32 FPS,
+#           u8 hero, 3 bytes padding, trigger count * f32 summed intensity of the vibes of each trigger
+
+import argparse
+import json
+import struct
+import time
+from collections.abc import Mapping
+from multiprocessing import resource_tracker, shared_memory
+from typing import NamedTuple
+
+from .heroes import Hero2
+from .triggers import Trigger
+from .utils import format_enum
+
+MAGIC = b"OSST"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIIIQ")
+WRITE_COUNT = struct.Struct("<Q")
+WRITE_COUNT_OFFSET = HEADER.size - WRITE_COUNT.size
+SEQUENCE = struct.Struct("<Q")
+DEFAULT_CAPACITY = 256
+
+# Streams written by this process
+written_names: set[str] = set()
+
+
+def record_struct(trigger_count: int) -> struct.Struct:
+    return struct.Struct(f"<QdffB3x{trigger_count}f")
+
+
+def align(value: int, alignment: int = 8) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # Readers must not remove the memory when they exit, which the resource tracker would do otherwise
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        if name in written_names:
+            # Tracked once for the writer of this process, which removes it
+            return memory
+        try:
+            resource_tracker.unregister(memory._name, "shared_memory")  # noqa
+        except (AttributeError, KeyError):
+            pass
+        return memory
+
+
+class StateRecord(NamedTuple):
+    index: int
+    timestamp: float
+    intensity: float
+    fps: float
+    hero: Hero2 | None
+    trigger_intensities: dict[Trigger, float]
+
+
+class StateStreamWriter:
+    def __init__(self, name: str, capacity: int = DEFAULT_CAPACITY) -> None:
+        self.name = name
+        self.capacity = capacity
+        self.triggers = list(Trigger)
+        self.trigger_indices = {trigger: index for index, trigger in enumerate(self.triggers)}
+        self.record = record_struct(len(self.triggers))
+        self.record_size = align(self.record.size)
+        metadata = json.dumps({"triggers": [trigger.name for trigger in self.triggers],
+                               "heroes": {hero.value: hero.name for hero in Hero2}}).encode()
+        self.records_offset = align(HEADER.size + len(metadata))
+        size = self.records_offset + capacity * self.record_size
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a run that did not exit cleanly
+            stale_memory = shared_memory.SharedMemory(name)
+            stale_memory.close()
+            stale_memory.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        written_names.add(name)
+        self.buffer = self.memory.buf
+        self.buffer[HEADER.size:HEADER.size + len(metadata)] = metadata
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, len(self.triggers), self.record_size, capacity,
+                         self.records_offset, len(metadata), 0)
+        self.write_count = 0
+        # Reused for every record, so writing does not allocate
+        self.trigger_values = [0.0] * len(self.triggers)
+
+    def write(self, timestamp: float, intensity: float, fps: float, hero: Hero2,
+              trigger_intensities: Mapping[Trigger, float]) -> None:
+        trigger_values = self.trigger_values
+        for index in range(len(trigger_values)):
+            trigger_values[index] = 0.0
+        for trigger, trigger_intensity in trigger_intensities.items():
+            trigger_values[self.trigger_indices[trigger]] = trigger_intensity
+        count = self.write_count
+        offset = self.records_offset + (count % self.capacity) * self.record_size
+        # Stores are not reordered on the platforms OverStim runs on, so readers see the odd sequence number before
+        # the new values, and the count in the header only after the record is complete
+        SEQUENCE.pack_into(self.buffer, offset, 2 * count + 1)
+        self.record.pack_into(self.buffer, offset, 2 * count + 1, timestamp, intensity, fps, hero.value,
+                              *trigger_values)
+        SEQUENCE.pack_into(self.buffer, offset, 2 * count + 2)
+        self.write_count = count + 1
+        WRITE_COUNT.pack_into(self.buffer, WRITE_COUNT_OFFSET, self.write_count)
+
+    def close(self) -> None:
+        del self.buffer
+        self.memory.close()
+        try:
+            self.memory.unlink()
+        except FileNotFoundError:
+            pass
+        written_names.discard(self.name)
+
+
+class StateStreamReader:
+    def __init__(self, name: str) -> None:
+        self.memory = attach_shared_memory(name)
+        self.buffer = self.memory.buf
+        magic, version, trigger_count, self.record_size, self.capacity, self.records_offset, metadata_length, _ = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{name} is not a supported OverStim state stream")
+        metadata = json.loads(bytes(self.buffer[HEADER.size:HEADER.size + metadata_length]))
+        # Triggers and heroes unknown to this version are left out
+        self.triggers = [Trigger.__members__.get(trigger_name) for trigger_name in metadata["triggers"]]
+        self.heroes = {int(value): Hero2.__members__.get(hero_name) for value, hero_name in metadata["heroes"].items()}
+        self.record = record_struct(trigger_count)
+        # Index of the next record read by read_new, and records overwritten before they were read
+        self.next_index = self.write_count
+        self.dropped = 0
+
+    @property
+    def write_count(self) -> int:
+        return WRITE_COUNT.unpack_from(self.buffer, WRITE_COUNT_OFFSET)[0]
+
+    def read(self, index: int) -> StateRecord | None:
+        # None if the record was not written yet, or was overwritten by a newer record
+        offset = self.records_offset + (index % self.capacity) * self.record_size
+        values = self.record.unpack_from(self.buffer, offset)
+        if values[0] != 2 * index + 2 or SEQUENCE.unpack_from(self.buffer, offset)[0] != values[0]:
+            return None
+        _, timestamp, intensity, fps, hero, *trigger_values = values
+        return StateRecord(index, timestamp, intensity, fps, self.heroes.get(hero),
+                           {trigger: value for trigger, value in zip(self.triggers, trigger_values)
+                            if trigger is not None})
+
+    def latest(self) -> StateRecord | None:
+        for _ in range(3):
+            write_count = self.write_count
+            if write_count == 0:
+                return None
+            record = self.read(write_count - 1)
+            if record is not None:
+                return record
+        return None
+
+    def read_new(self) -> list[StateRecord]:
+        # Records written since the last call, oldest first
+        write_count = self.write_count
+        if write_count - self.next_index > self.capacity:
+            self.dropped += write_count - self.capacity - self.next_index
+            self.next_index = write_count - self.capacity
+        records = []
+        for index in range(self.next_index, write_count):
+            record = self.read(index)
+            if record is None:
+                self.dropped += 1
+            else:
+                records.append(record)
+        self.next_index = write_count
+        return records
+
+    def close(self) -> None:
+        del self.buffer
+        self.memory.close()
+
+    def __enter__(self) -> "StateStreamReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def format_record(record: StateRecord) -> str:
+    hero = record.hero.name if record.hero is not None else "?"
+    triggers = ", ".join(f"{format_enum(trigger)} {value * 100:.0f}%"
+                         for trigger, value in record.trigger_intensities.items() if value != 0.0)
+    return (f"#{record.index} {time.strftime('%H:%M:%S', time.localtime(record.timestamp))} | Hero: {hero} | "
+            f"Intensity: {record.intensity * 100:.0f}% | FPS: {record.fps:.0f} | Triggers: {triggers or '-'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Print the live state published by OverStim.")
+    parser.add_argument("--name", required=True, help="Name of the state stream, as set in the settings.")
+    parser.add_argument("--all", action="store_true", help="Print every record instead of the latest one.")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between reads.")
+    args = parser.parse_args()
+
+    with StateStreamReader(args.name) as reader:
+        try:
+            while True:
+                if args.all:
+                    for record in reader.read_new():
+                        print(format_record(record), flush=True)
+                else:
+                    record = reader.latest()
+                    if record is not None:
+                        print(format_record(record), flush=True)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
+        if reader.dropped:
+            print(f"Missed {reader.dropped} records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import math
+from typing import NamedTuple
+
+from .heroes import Hero2
+from .triggers import Trigger
+
+
+class RingBuffer:
+    def __init__(self, size: int) -> None:
+        self.samples = [0.0] * size
+        self.index = 0
+        self.count = 0
+        self.total_count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, value: float) -> float | None:
+        # Overwrite the oldest sample, and return it if the buffer was full
+        evicted = self.samples[self.index] if self.count == len(self.samples) else None
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+        self.total_count += 1
+        return evicted
+
+    def values(self) -> list[float]:
+        return self.samples[:self.count]
+
+    def clear(self) -> None:
+        self.index = 0
+        self.count = 0
+        self.total_count = 0
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class FrameStatsSnapshot(NamedTuple):
+    fps: float = 0.0
+    mean: float = 0.0
+    min: float = 0.0
+    max: float = 0.0
+    p50: float = 0.0
+    p95: float = 0.0
+    p99: float = 0.0
+    jitter: float = 0.0
+    late: int = 0
+    dropped: int = 0
+
+    def __str__(self) -> str:
+        return (f"{self.fps:.1f} FPS | "
+                f"Frame time: mean {1000 * self.mean:.1f}ms, min {1000 * self.min:.1f}ms, "
+                f"max {1000 * self.max:.1f}ms, p50 {1000 * self.p50:.1f}ms, p95 {1000 * self.p95:.1f}ms, "
+                f"p99 {1000 * self.p99:.1f}ms | Jitter: {1000 * self.jitter:.1f}ms | "
+                f"Late: {self.late} | Dropped: {self.dropped}")
+
+
+class FrameStats:
+    # Frames taking longer than this many target intervals count as late
+    LATE_FACTOR = 1.5
+
+    def __init__(self, target_rate: float = 0.0, window: int = 120) -> None:
+        self.frame_times = RingBuffer(window)
+        self.target_interval = 0.0
+        self.last_time: float | None = None
+        # Running sums over the window, updated as samples enter and leave
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.late = 0
+        self.dropped = 0
+        self.set_target_rate(target_rate)
+
+    def set_target_rate(self, target_rate: float) -> None:
+        self.target_interval = 1 / target_rate if target_rate > 0 else 0.0
+        self.clear()
+
+    def clear(self) -> None:
+        self.frame_times.clear()
+        self.last_time = None
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.late = 0
+        self.dropped = 0
+
+    def _count_late(self, frame_time: float) -> tuple[int, int]:
+        if self.target_interval <= 0.0 or frame_time <= self.LATE_FACTOR * self.target_interval:
+            return 0, 0
+        return 1, max(0, round(frame_time / self.target_interval) - 1)
+
+    def update(self, current_time: float) -> None:
+        if self.last_time is not None:
+            frame_time = current_time - self.last_time
+            late, dropped = self._count_late(frame_time)
+            self.sum += frame_time
+            self.sum_squares += frame_time * frame_time
+            self.late += late
+            self.dropped += dropped
+            evicted = self.frame_times.add(frame_time)
+            if evicted is not None:
+                late, dropped = self._count_late(evicted)
+                self.sum -= evicted
+                self.sum_squares -= evicted * evicted
+                self.late -= late
+                self.dropped -= dropped
+            # Avoid drifting sums by recalculating them once per round through the buffer
+            if self.frame_times.index == 0:
+                values = self.frame_times.values()
+                self.sum = sum(values)
+                self.sum_squares = sum(value * value for value in values)
+        self.last_time = current_time
+
+    @property
+    def mean(self) -> float:
+        return self.sum / len(self.frame_times) if self.frame_times else 0.0
+
+    @property
+    def fps(self) -> float:
+        mean = self.mean
+        return 1 / mean if mean > 0.0 else 0.0
+
+    @property
+    def jitter(self) -> float:
+        if not self.frame_times:
+            return 0.0
+        mean = self.mean
+        return math.sqrt(max(0.0, self.sum_squares / len(self.frame_times) - mean * mean))
+
+    def snapshot(self) -> FrameStatsSnapshot:
+        values = sorted(self.frame_times.values())
+        if not values:
+            return FrameStatsSnapshot()
+        return FrameStatsSnapshot(
+            fps=self.fps,
+            mean=self.mean,
+            min=values[0],
+            max=values[-1],
+            p50=percentile(values, 0.50),
+            p95=percentile(values, 0.95),
+            p99=percentile(values, 0.99),
+            jitter=self.jitter,
+            late=self.late,
+            dropped=self.dropped)
+
+
+class ControllerInfo(NamedTuple):
+    vibe_intensity: float = 0.0
+    current_hero: Hero2 = Hero2.OTHER
+    devices_connected: int = 0
+    fps: int = 0
+    frame_stats: FrameStatsSnapshot = FrameStatsSnapshot()
+    calculation_time: float = 0.0
+    # Summed intensity and number of the active vibes of each trigger
+    trigger_intensities: dict[Trigger, float] = {}
+    trigger_counts: dict[Trigger, int] = {}
@@ -0,0 +1,250 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Composites HUD elements from the templates onto background frames, to benchmark and test the detections without the
+# game. Frames can be rendered at any resolution and aspect ratio, with noise and scaling artefacts.
+#
+# Usage: python -m overstim.synthetic --resolution 3440x1440 --random 20 --output synthetic
+#        python -m overstim.synthetic --element mercy_heal_beam --element elimination:1 --output synthetic
+
+import argparse
+import json
+import logging
+import os
+import time
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import cv2
+import numpy
+
+from .computer_vision import ComputerVision
+from .frame_source import FrameSource
+
+
+class HudElement(NamedTuple):
+    name: str
+    row: int = 0  # Notif row, 0 is the top row
+    position: int = 0  # 0 for the main position, then the alternatives from Coord.more and Coord.offsets
+    shift: tuple[int, int] | None = None  # (down, right) within the search area, picked at random by resolve if None
+
+    def __str__(self) -> str:
+        if self.shift is None:
+            return f"{self.name}:{self.row}:{self.position}"
+        return f"{self.name}:{self.row}:{self.position}:{self.shift[0]},{self.shift[1]}"
+
+    @classmethod
+    def from_str(cls, value: str) -> "HudElement":
+        # Format: name[:row[:position[:down,right]]]
+        parts = value.split(":")
+        shift = None
+        if len(parts) > 3:
+            down, right = parts[3].split(",")
+            shift = (int(down), int(right))
+        return cls(name=parts[0],
+                   row=int(parts[1]) if len(parts) > 1 else 0,
+                   position=int(parts[2]) if len(parts) > 2 else 0,
+                   shift=shift)
+
+
+class SyntheticHud:
+    BASE_RESOLUTION = (1920, 1080)
+    NOTIF_ROWS = 3
+
+    def __init__(self, template_path: str, seed: int = 0) -> None:
+        self.rng = numpy.random.default_rng(seed)
+        self.templates = {}
+        for key in ComputerVision.COORDS:
+            filename = os.path.join(template_path, f"t_{key}.png")
+            template = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+            assert template is not None, f"Failed to read template {filename}"
+            self.templates[key] = template
+
+    def positions(self, name: str) -> list[tuple[int, int]]:
+        coord = ComputerVision.COORDS[name]
+        positions = [(coord.top, coord.left)]
+        if coord.more is not None:
+            positions.extend((top, left) for left, top in coord.more)
+        if coord.offsets is not None:
+            positions.extend((coord.top + top, coord.left + left) for top, left in coord.offsets)
+        return positions
+
+    def resolve(self, element: HudElement) -> HudElement:
+        # Pick a random shift within the search area, like HUD elements that move around
+        if element.shift is not None:
+            return element
+        coord = ComputerVision.COORDS[element.name]
+        return element._replace(shift=(int(self.rng.integers(0, coord.add_height + 1)),
+                                       int(self.rng.integers(0, coord.add_width + 1))))
+
+    def resolve_scene(self, elements: Sequence[HudElement]) -> list[HudElement]:
+        # Shifts are picked once per scene, so it looks the same at every resolution and the labels have them
+        return [self.resolve(element) for element in elements]
+
+    def place(self, element: HudElement) -> tuple[int, int, int, int]:
+        # Returns top, left, height and width of the element within the base frame
+        assert element.shift is not None, f"The shift of {element} is not resolved."
+        top, left = self.positions(element.name)[element.position]
+        if element.name in ComputerVision.NOTIF_NAMES:
+            top += element.row * ComputerVision.NOTIF_ROW_OFFSET
+        shift = element.shift
+        height, width = self.templates[element.name].shape
+        return top + shift[0], left + shift[1], height, width
+
+    def background(self) -> numpy.ndarray:
+        # Smooth noise resembles blurry game scenery better than white noise
+        width, height = self.BASE_RESOLUTION
+        small = self.rng.integers(0, 256, (height // 40, width // 40, 3), dtype=numpy.uint8)
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    def compose(self, elements: Sequence[HudElement], background: numpy.ndarray | None = None) -> numpy.ndarray:
+        if background is None:
+            frame = self.background()
+        else:
+            frame = cv2.resize(background, self.BASE_RESOLUTION, interpolation=cv2.INTER_AREA)
+        for element in elements:
+            top, left, height, width = self.place(element)
+            frame[top:top + height, left:left + width] = self.templates[element.name][:, :, None]
+        return frame
+
+    def render(self, elements: Sequence[HudElement], resolution: tuple[int, int] = BASE_RESOLUTION,
+               noise: float = 2.0, jpeg_quality: int = 0, background: numpy.ndarray | None = None) -> numpy.ndarray:
+        # Renders a BGR frame like the screen capture, with the 16:9 HUD centered and black bars for other aspect ratios
+        frame = self.compose(elements, background)
+        width, height = resolution
+        base_width, base_height = self.BASE_RESOLUTION
+        scale = min(width / base_width, height / base_height)
+        content_width, content_height = round(base_width * scale), round(base_height * scale)
+        if (content_width, content_height) != self.BASE_RESOLUTION:
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            frame = cv2.resize(frame, (content_width, content_height), interpolation=interpolation)
+        if (content_width, content_height) != (width, height):
+            output = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+            top, left = (height - content_height) // 2, (width - content_width) // 2
+            output[top:top + content_height, left:left + content_width] = frame
+            frame = output
+        if noise > 0.0:
+            frame = numpy.clip(frame + self.rng.normal(0.0, noise, frame.shape), 0, 255).astype(numpy.uint8)
+        if jpeg_quality > 0:
+            _, data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+            frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        return frame
+
+    def random_scene(self, max_elements: int = 6) -> list[HudElement]:
+        # Picks elements that do not overlap, with at most one notif per row
+        names = [name for name in ComputerVision.COORDS if name not in ComputerVision.NOTIF_NAMES]
+        elements = []
+        for row in range(int(self.rng.integers(0, self.NOTIF_ROWS + 1))):
+            name = str(self.rng.choice(ComputerVision.NOTIF_NAMES))
+            elements.append(self.resolve(HudElement(name=name, row=row)))
+        areas = [self.place(element) for element in elements]
+        for name in self.rng.permutation(names)[:int(self.rng.integers(0, max_elements + 1))]:
+            name = str(name)
+            position = int(self.rng.integers(0, len(self.positions(name))))
+            element = self.resolve(HudElement(name=name, position=position))
+            area = self.place(element)
+            if any(overlaps(area, other) for other in areas):
+                continue
+            elements.append(element)
+            areas.append(area)
+        return elements
+
+
+def overlaps(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> bool:
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+class SyntheticFrameSource(FrameSource):
+    def __init__(self, hud: SyntheticHud, scenes: Sequence[Sequence[HudElement]],
+                 resolution: tuple[int, int] = SyntheticHud.BASE_RESOLUTION, paced: bool = True,
+                 noise: float = 2.0, jpeg_quality: int = 0) -> None:
+        # Frames are rendered up front, so the detections are measured and not the rendering
+        self._resolution = resolution
+        self.scenes = [hud.resolve_scene(scene) for scene in scenes]
+        self.frames = [hud.render(scene, resolution, noise, jpeg_quality) for scene in self.scenes]
+        self.paced = paced
+        self.target_interval = 0.0
+        self.next_time = 0.0
+        self.index = -1
+
+    @property
+    def resolution(self) -> tuple[int, int]:
+        return self._resolution
+
+    @property
+    def labels(self) -> list[HudElement]:
+        # Elements shown in the latest frame
+        return self.scenes[self.index]
+
+    def start(self, target_fps: int) -> None:
+        self.target_interval = 1 / target_fps if target_fps > 0 else 0.0
+        self.next_time = time.perf_counter()
+
+    def get_latest_frame(self) -> numpy.ndarray:
+        if self.paced and self.target_interval > 0.0:
+            self.next_time += self.target_interval
+            delay = self.next_time - time.perf_counter()
+            if delay > 0.0:
+                time.sleep(delay)
+        self.index = (self.index + 1) % len(self.frames)
+        return self.frames[self.index]
+
+
+def parse_resolution(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Render synthetic HUD frames with a labels.json for benchmarks.")
+    parser.add_argument("--templates", default=os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                            "assets", "templates"))
+    parser.add_argument("--output", required=True, help="Directory for the frames and labels.json.")
+    parser.add_argument("--resolution", type=parse_resolution, action="append", default=[],
+                        help='Frame resolution as "WIDTHxHEIGHT"; repeatable. Default 1920x1080.')
+    parser.add_argument("--element", type=HudElement.from_str, action="append", default=[],
+                        help='HUD element as "template[:notif row[:position]]"; repeatable.')
+    parser.add_argument("--random", type=int, default=0, help="Number of random scenes to render.")
+    parser.add_argument("--background", help="Image used as background instead of random noise.")
+    parser.add_argument("--noise", type=float, default=2.0, help="Standard deviation of the added pixel noise.")
+    parser.add_argument("--jpeg-quality", type=int, default=0, help="Add JPEG artefacts at this quality, 0 for none.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    hud = SyntheticHud(args.templates, args.seed)
+    background = cv2.imread(args.background, cv2.IMREAD_COLOR) if args.background else None
+    scenes = [hud.random_scene() for _ in range(args.random)]
+    if args.element or not scenes:
+        scenes.insert(0, hud.resolve_scene(args.element))
+    os.makedirs(args.output, exist_ok=True)
+    labels = {}
+    for resolution in args.resolution or [SyntheticHud.BASE_RESOLUTION]:
+        for index, scene in enumerate(scenes):
+            filename = f"frame_{resolution[0]}x{resolution[1]}_{index:04d}.png"
+            frame = hud.render(scene, resolution, args.noise, args.jpeg_quality, background)
+            cv2.imwrite(os.path.join(args.output, filename), frame)
+            labels[filename] = [str(element) for element in scene]
+    with open(os.path.join(args.output, "labels.json"), "w") as file:
+        json.dump(labels, file, indent=2)
+    logging.info(f"Rendered {len(labels)} frames to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
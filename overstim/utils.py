@@ -17,8 +17,14 @@
 #
 #  SPDX-License-Identifier: AGPL-3.0-or-later
 
+import copy
 import enum
 import logging
+import logging.handlers
+import os
+import queue
+import time
+from collections import defaultdict
 from typing import NamedTuple
 
 
@@ -38,6 +44,21 @@ class Config(NamedTuple):
     mercy_beam_disconnect_buffer: int = 11
     zen_orb_disconnect_buffer: int = 27
     preview_window: bool = False
+    max_command_rate: int = 0
+    intensity_slew_rate: float = 0.0
+    stage_profiling: bool = True
+    metrics_export: str = "off"
+    metrics_port: int = 9464
+    log_level: str = "INFO"
+    record_session: bool = False
+    record_frames: bool = False
+    calibration_profile: str = ""
+    additional_websocket_addresses: list[str] = []
+    device_curves: list[str] = []
+    state_stream_name: str = ""
+    event_api_port: int = 0
+    music_source: str = ""
+    music_depth: float = 0.8
 
 
 def clamp_value(value: float, max_value: float, min_value: float = 0, value_name: str = "value") -> float:
@@ -65,15 +86,102 @@ def format_float(number: float) -> str:
     return num_str
 
 
-class FPSCalculator:
-    def __init__(self) -> None:
-        self.frame_times = []
+class RateLimitedLogger:
+    def __init__(self, max_per_second: float = 10.0, logger: logging.Logger | None = None) -> None:
+        self.interval = 1 / max_per_second
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.last: dict[str, float] = {}
+        self.suppressed: dict[str, int] = defaultdict(int)
 
-    def update(self, current_time: float) -> int:
-        # Add the current frame time
-        self.frame_times.append(current_time)
-        # Remove frame times that are older than the window duration
-        while self.frame_times and self.frame_times[0] < current_time - 1.0:
-            del self.frame_times[0]
-        # FPS is the number of frames divided by the duration
-        return len(self.frame_times)
+    def info(self, key: str, msg: str, *args) -> None:
+        self._log(key, logging.INFO, msg, *args)
+
+    def warning(self, key: str, msg: str, *args) -> None:
+        self._log(key, logging.WARNING, msg, *args)
+
+    def _log(self, key: str, level: int, msg: str, *args) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        # Drop messages of the same kind that follow each other too quickly, but count them
+        now = time.monotonic()
+        if now - self.last.get(key, float("-inf")) < self.interval:
+            self.suppressed[key] += 1
+            return
+        self.last[key] = now
+        suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            msg += " (%d similar messages suppressed)"
+            args += (suppressed,)
+        self.logger.log(level, msg, *args, stacklevel=3)
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments and the exception are merged right away, as they can change before the listener thread gets to
+        # them. Formatting the rest of the record is left to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(path_log: str) -> logging.handlers.QueueListener:
+    formatter = logging.Formatter(
+        "%(asctime)s.%(msecs)d - %(levelname)s - %(module)s.%(funcName)s:%(lineno)d - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S")
+
+    # Stream handler for logging to console
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    # File handler to create a log file
+    if not os.path.exists(path_log):
+        os.mkdir(path_log)
+    file_handler = logging.handlers.TimedRotatingFileHandler(
+        os.path.join(path_log, "OverStim_Log.txt"), when="d", interval=1, backupCount=3)
+    file_handler.setFormatter(formatter)
+    file_handler.namer = lambda default_name: default_name + ".txt"  # ensure that old log files keep the file extension
+
+    # Records are only queued by the logging threads, a background thread formats and writes them
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(BackgroundQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def set_log_level(level: str) -> None:
+    try:
+        logging.getLogger().setLevel(level.upper())
+    except ValueError:
+        logging.error(f'Invalid log level "{level}"; using INFO.')
+        logging.getLogger().setLevel(logging.INFO)
+
+
+class StartupTimer:
+    def __init__(self, start_time: float | None = None) -> None:
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.last_time = self.start_time
+        self.stages: list[tuple[str, float]] = []
+
+    def mark(self, stage: str) -> None:
+        # Time since the previous mark is attributed to this stage
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last_time))
+        self.last_time = now
+
+    @property
+    def total(self) -> float:
+        return self.last_time - self.start_time
+
+    def __str__(self) -> str:
+        stages = ", ".join(f"{stage} {duration * 1000:.0f} ms" for stage, duration in self.stages)
+        return f"{self.total * 1000:.0f} ms ({stages})"
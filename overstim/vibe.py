@@ -20,141 +20,129 @@
 import logging
 import time
 from collections import defaultdict
-from collections.abc import Sequence
 from typing import NamedTuple
 
-import buttplug
+import numpy
 
+from .metrics import Metrics
+from .mixer import VibeMixer
+from .profiler import Profiler
 from .triggers import Response, Trigger, is_conditional
-from .utils import clamp_value, round_value_to_nearest_step, Config, format_enum
+from .utils import clamp_value, Config, format_enum, RateLimitedLogger
 
 
-class BuiltVibration(NamedTuple):
-    intensity: float
-    expiry: float
-
-
-class Vibe:
-    def __init__(self, response: Response, trigger: Trigger, creation_time: float) -> None:
-        self.response = response
-        self.trigger = trigger
-        self.creation_time = creation_time
-
-    def get_intensity(self, current_time: float) -> float | None:
-        timestamp = current_time - self.creation_time
-        unlimited = is_conditional(self.trigger)
-        return self.response.get_intensity(timestamp, unlimited)
+class PendingLatency(NamedTuple):
+    trigger: Trigger
+    frame_time: float
 
 
 class VibeManager:
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, profiler: Profiler | None = None, metrics: Metrics | None = None) -> None:
         self.config = config
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.log = RateLimitedLogger()
         self.current_time = 0.0
         self.last: dict[Trigger, float] = defaultdict(float)
-        self.vibes: dict[Trigger, list[Vibe]] = defaultdict(list)
+        self.mixer = VibeMixer()
         self.current_intensity = 0.0
         self.real_intensity = 0.0
-        self.all_intensities: dict[Trigger, list[float]] = defaultdict(list)
-
-    def add_vibe(self, trigger: Trigger, response: Response, suppression_secs: float = 0.0) -> None:
-        now = time.time()
-        if now - self.last[trigger] < suppression_secs:
+        # Summed intensity and number of the active vibes of each trigger, silences count as -100% each
+        self.trigger_intensities: dict[Trigger, float] = {}
+        self.trigger_counts: dict[Trigger, int] = {}
+        # Scales the vibes of triggers, e.g. Lucio's songs following the music. Replaced as a whole by other threads.
+        self.gains: dict[Trigger, float] = {}
+        self.gain_values: numpy.ndarray | None = None
+        self.gain_values_source: dict[Trigger, float] = self.gains
+        # Capture time of the frame being processed, and of frames with new vibes that no device has felt yet
+        self.frame_time: float | None = None
+        self.pending_latencies: list[PendingLatency] = []
+
+    def add_vibe(self, trigger: Trigger, response: Response, suppression_secs: float = 0.0,
+                 frame_time: float | None = None) -> None:
+        # Uses the time of the last update instead of the clock, so replayed sessions behave the same
+        if self.current_time - self.last[trigger] < suppression_secs:
             return
-        vibe = Vibe(response, trigger, self.current_time)
-        self.vibes[trigger].append(vibe)
-        self.last[trigger] = now
-
-    def toggle_vibe_to_condition(self, trigger: Trigger, response: Response, condition: bool) -> None:
+        self.mixer.add(trigger, response, self.current_time, is_conditional(trigger))
+        self.last[trigger] = self.current_time
+
+        # Track the latency from capturing the frame to the detection, and later to the device command
+        if frame_time is None:
+            frame_time = self.frame_time
+        if frame_time is not None:
+            self.profiler.record(f"latency {format_enum(trigger)} detect", time.perf_counter() - frame_time)
+            self.pending_latencies.append(PendingLatency(trigger, frame_time))
+
+    def toggle_vibe_to_condition(self, trigger: Trigger, response: Response, condition: bool,
+                                 frame_time: float | None = None) -> None:
         vibe_exists_for_trigger = self.vibe_exists_for_trigger(trigger)
         if condition and not vibe_exists_for_trigger:
-            self.add_vibe(trigger, response)
+            self.add_vibe(trigger, response, frame_time=frame_time)
         elif not condition and vibe_exists_for_trigger:
             self.clear_vibes(trigger)
 
     def clear_vibes(self, trigger: Trigger | None = None) -> None:
+        self.mixer.clear(trigger)
         if trigger is None:
-            self.vibes.clear()
-        else:
-            self.vibes[trigger].clear()
+            self.pending_latencies.clear()
 
-    async def stop_all_devices(self, devices: Sequence[buttplug.Device]) -> None:
+    def set_config(self, config: Config) -> None:
+        self.config = config
+
+    def take_pending_latencies(self) -> list[PendingLatency]:
+        pending_latencies, self.pending_latencies = self.pending_latencies, []
+        return pending_latencies
+
+    def stop(self) -> None:
         self.clear_vibes()
-        for device in devices:
-            await device.stop()
         self.current_intensity = 0
         self.real_intensity = 0
-        logging.info("Stopped all devices.")
+
+    @property
+    def vibe_count(self) -> int:
+        return self.mixer.count
 
     def vibe_exists_for_trigger(self, trigger: Trigger) -> bool:
-        return bool(self.vibes[trigger])
+        return self.mixer.exists(trigger)
 
     def vibe_for_trigger_created_within_seconds(self, trigger: Trigger, seconds: float) -> bool:
-        for vibe in self.vibes[trigger]:
-            if vibe.creation_time > self.current_time - seconds:
-                return True
-        return False
+        return self.mixer.created_after(trigger, self.current_time - seconds)
+
+    def _get_gain_values(self) -> numpy.ndarray | None:
+        gains = self.gains
+        if gains is not self.gain_values_source:
+            self.gain_values_source = gains
+            self.gain_values = None
+            if gains:
+                self.gain_values = numpy.ones(VibeMixer.TRIGGER_COUNT)
+                for trigger, gain in gains.items():
+                    self.gain_values[trigger.value] = gain
+        return self.gain_values
 
     def _get_total_intensity(self) -> float:
-        total_intensity = 0.0
-        response_type_silence = False
-        self.all_intensities.clear()
-        for trigger, vibes in self.vibes.items():
-            for vibe in vibes:
-                intensity = vibe.get_intensity(self.current_time)
-                if intensity is None:
-                    self.vibes[vibe.trigger].remove(vibe)
-                    continue
-                total_intensity += intensity
-                self.all_intensities[trigger].append(intensity)
-                if intensity == -1.0:
-                    response_type_silence = True
-        if response_type_silence:
-            return 0.0
-        return total_intensity
-
-    async def _update_intensity_for_devices(self, devices: Sequence[buttplug.Device]) -> None:
-        for device in devices:
-            try:
-                # Send new intensity to every actuator within the device
-                actuator_intensities = []
-                for actuator in device.actuators:
-
-                    # Set actuator intensity to the closest step supported by that actuator, and limit it to the
-                    # user-defined max intensity
-                    actuator_min_intensity_step = 1 / actuator.step_count
-                    actuator_max_intensity = round_value_to_nearest_step(self.config.max_vibe_intensity,
-                                                                         actuator_min_intensity_step)
-                    while actuator_max_intensity > self.config.max_vibe_intensity:
-                        actuator_max_intensity -= actuator_min_intensity_step
-                    actuator_intensity = clamp_value(
-                        round_value_to_nearest_step(self.real_intensity, actuator_min_intensity_step),
-                        actuator_max_intensity, value_name="actuator intensity")
-                    actuator_intensities.append(actuator_intensity)
-
-                    await actuator.command(actuator_intensity)
-
-                # Print new intensities of device actuators
-                intensity_string = f"[{device.name}] Vibe 1: {actuator_intensities[0]}"
-                for index in range(len(actuator_intensities) - 1):
-                    intensity_string = f"{intensity_string}, Vibe {index + 2}: {actuator_intensities[index + 1]}"
-                logging.info(intensity_string)
-
-            except Exception as device_intensity_update_error:
-                logging.warning(f"Stopping {device.name} due to an error while altering its vibration.")
-                logging.error(device_intensity_update_error)
-                await device.stop()
+        result = self.mixer.mix(self.current_time, self._get_gain_values())
+        self.trigger_intensities = {}
+        self.trigger_counts = {}
+        for value in numpy.flatnonzero(result.trigger_counts):
+            trigger = Trigger(int(value))
+            self.trigger_intensities[trigger] = float(result.trigger_intensities[value])
+            self.trigger_counts[trigger] = int(result.trigger_counts[value])
+        return result.total
 
     def print_active_triggers(self) -> None:
+        if not self.log.logger.isEnabledFor(logging.INFO):
+            return
         active_triggers = []
-        for trigger, vibes in self.vibes.items():
-            if vibes:
-                active_triggers.append(f"{format_enum(trigger)} (x{len(vibes)})")
+        for trigger, count in self.trigger_counts.items():
+            active_triggers.append(f"{format_enum(trigger)} (x{count})")
         if active_triggers:
-            logging.info(", ".join(active_triggers))
+            self.log.info("active triggers", "%s", ", ".join(active_triggers))
 
-    async def update(self, devices: Sequence[buttplug.Device], current_time: float) -> None:
+    def update(self, current_time: float) -> None:
         self.current_time = current_time
+        aggregation_start = time.perf_counter()
         latest_intensity = self._get_total_intensity()
+        self.profiler.record("vibe aggregation", time.perf_counter() - aggregation_start)
         if self.config.scale_all_intensities_by_max_intensity:
             latest_intensity *= self.config.max_vibe_intensity
         latest_intensity = abs(round(latest_intensity, 4))
@@ -162,9 +150,11 @@ class VibeManager:
             self.current_intensity = latest_intensity
             latest_clamped_intensity = clamp_value(self.current_intensity, self.config.max_vibe_intensity,
                                                    value_name="intensity")
-            logging.info(f"Updated intensity: {self.current_intensity * 100:.0f}%" + (
-                "" if self.current_intensity == latest_clamped_intensity else f" ({latest_clamped_intensity})"))
+            if self.current_intensity == latest_clamped_intensity:
+                self.log.info("intensity", "Updated intensity: %.0f%%", self.current_intensity * 100)
+            else:
+                self.log.info("intensity", "Updated intensity: %.0f%% (%s)", self.current_intensity * 100,
+                              latest_clamped_intensity)
             if self.real_intensity != latest_clamped_intensity:
                 self.real_intensity = latest_clamped_intensity
                 self.print_active_triggers()
-                await self._update_intensity_for_devices(devices)
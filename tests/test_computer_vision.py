@@ -0,0 +1,50 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import os
+
+from overstim.computer_vision import ComputerVision
+from overstim.frame_source import Region
+from overstim.synthetic import SyntheticFrameSource, SyntheticHud
+from overstim.utils import Config
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "templates")
+
+
+def test_recorded_regions_follow_the_calibration(tmp_path):
+    calibration_profile = tmp_path / "calibration.json"
+    calibration_profile.write_text(json.dumps({"coords": {"hacked": [870, 180, 4, 6]}}))
+    computer_vision = ComputerVision(Config(calibration_profile=str(calibration_profile)), TEMPLATE_PATH,
+                                     SyntheticFrameSource(SyntheticHud(TEMPLATE_PATH), [[]]))
+    height, width = computer_vision.templates["hacked"].shape
+    regions = computer_vision.get_regions()
+    assert Region(870, 180, height + 4, width + 6) in regions
+    assert Region(860, 172, height, width) not in regions
+
+
+def test_detections_are_only_timed_while_profiling():
+    computer_vision = ComputerVision(Config(), TEMPLATE_PATH, SyntheticFrameSource(SyntheticHud(TEMPLATE_PATH), [[]]))
+    computer_vision.wait_for_frame()
+    computer_vision.capture_frame()
+    computer_vision.detect_single("hacked")
+    assert not computer_vision.profiler.histograms and not computer_vision.metrics.counters
+    computer_vision.profiler.enabled = True
+    computer_vision.detect_single("hacked")
+    assert list(computer_vision.profiler.histograms) == ["detect hacked"]
@@ -0,0 +1,52 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import asyncio
+import os
+
+from overstim.computer_vision import ComputerVision
+from overstim.controller import Controller
+from overstim.synthetic import SyntheticFrameSource, SyntheticHud
+from overstim.utils import Config
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "templates")
+
+
+def create_controller(config: Config) -> Controller:
+    frame_source = SyntheticFrameSource(SyntheticHud(TEMPLATE_PATH), [[]])
+    return Controller(config, ComputerVision(config, TEMPLATE_PATH, frame_source), lambda info: None)
+
+
+def test_restart_fields_stay_pending_over_reloads():
+    config = Config()
+    controller = create_controller(config)
+    first_config = config._replace(gpu_id=1, max_vibe_intensity=0.8)
+    assert controller.update_config(first_config) == ["gpu_id"]
+    asyncio.run(controller.apply_config(first_config))
+    assert controller.config.max_vibe_intensity == 0.8
+    assert controller.config.gpu_id == 0
+
+    # The capture still runs on the first GPU, so the change is still pending after another reload
+    second_config = first_config._replace(max_vibe_intensity=0.6)
+    assert controller.update_config(second_config) == ["gpu_id"]
+    asyncio.run(controller.apply_config(second_config))
+    assert controller.config.max_vibe_intensity == 0.6
+    assert controller.config.gpu_id == 0
+    assert controller.applied_config is second_config
+    assert controller.update_config(second_config._replace(gpu_id=0)) == []
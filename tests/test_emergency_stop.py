@@ -0,0 +1,57 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import asyncio
+
+from overstim.mock_intiface import MockDevice, MockIntifaceServer
+from overstim.outputs import IntifaceOutput, OutputManager
+from overstim.utils import Config
+
+COMMAND_LATENCY = 0.05
+
+
+async def stop_during_command() -> MockIntifaceServer:
+    # A device with several actuators, which are commanded one after the other
+    async with MockIntifaceServer([MockDevice("Mock Vibe", [20, 20, 20, 20], latency=COMMAND_LATENCY)],
+                                  port=0) as server:
+        config = Config(websocket_address=server.address, max_command_rate=0)
+        outputs = OutputManager([IntifaceOutput(server.address, config)])
+        await outputs.start()
+        try:
+            while not outputs.devices:
+                await asyncio.sleep(0.01)
+            outputs.publish(1.0, [])
+            # The stop arrives while the command of the first actuator is awaited
+            await asyncio.sleep(COMMAND_LATENCY / 2)
+            outputs.halt()
+            await outputs.stop_devices()
+            await asyncio.sleep(6 * COMMAND_LATENCY)
+        finally:
+            await outputs.close()
+    return server
+
+
+def test_no_command_after_emergency_stop():
+    server = asyncio.run(stop_during_command())
+    messages = [command.message for command in server.commands]
+    assert "StopDeviceCmd" in messages
+    stop_index = messages.index("StopDeviceCmd")
+    assert [command for command in server.commands[stop_index:] if command.message == "ScalarCmd"] == []
+    # Only the actuator whose command was in progress vibrated
+    assert len([message for message in messages[:stop_index] if message == "ScalarCmd"]) <= 1
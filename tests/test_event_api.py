@@ -0,0 +1,76 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import asyncio
+import json
+import time
+
+import websockets
+
+from overstim.event_api import EventServer
+from overstim.session import DetectionFrame
+from overstim.triggers import Trigger, Response
+from overstim.utils import Config
+from overstim.vibe import VibeManager
+
+CONDITION = {"trigger": "HEALING_SONG", "active": True}
+
+
+async def ingest(server: EventServer, vibe_manager: VibeManager) -> None:
+    while True:
+        server.apply(await server.next_batches(), vibe_manager, {Trigger.HEALING_SONG: Response(intensity=0.5)})
+
+
+async def wait_until(condition, timeout: float = 2.0) -> None:
+    end_time = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < end_time
+        await asyncio.sleep(0.01)
+
+
+async def disconnect_during_condition() -> None:
+    server = EventServer(port=0)
+    vibe_manager = VibeManager(Config())
+    await server.start()
+    ingest_task = asyncio.create_task(ingest(server, vibe_manager))
+    try:
+        async with websockets.connect(server.address) as first, websockets.connect(server.address) as second:
+            await first.send(json.dumps(CONDITION))
+            assert json.loads(await first.recv())["applied"] == 1
+            await second.send(json.dumps(CONDITION))
+            assert json.loads(await second.recv())["applied"] == 1
+            assert vibe_manager.vibe_exists_for_trigger(Trigger.HEALING_SONG)
+
+            # Still held by the other producer
+            await first.close()
+            await asyncio.sleep(0.1)
+            assert vibe_manager.vibe_exists_for_trigger(Trigger.HEALING_SONG)
+            assert server.apply_conditions(DetectionFrame(0.0)).healing_song
+
+        # Neither producer is left to end the condition
+        await wait_until(lambda: not server.conditions)
+        assert not vibe_manager.vibe_exists_for_trigger(Trigger.HEALING_SONG)
+        assert not server.apply_conditions(DetectionFrame(0.0)).healing_song
+    finally:
+        ingest_task.cancel()
+        await server.stop()
+
+
+def test_conditions_end_when_producers_disconnect():
+    asyncio.run(disconnect_during_condition())
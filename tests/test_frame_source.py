@@ -0,0 +1,66 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import time
+
+import numpy
+
+from overstim.frame_source import FrameRecorder, RecordedFrameSource, Region
+
+RESOLUTION = (64, 32)
+REGIONS = [Region(4, 8, 6, 10)]
+
+
+def record(directory: str, frame_count: int, chunk_frames: int) -> None:
+    recorder = FrameRecorder(directory, RESOLUTION, REGIONS, chunk_frames=chunk_frames)
+    for index in range(frame_count):
+        recorder.add(float(index), numpy.full((RESOLUTION[1], RESOLUTION[0]), index, dtype=numpy.uint8))
+        # Keeps the writer from falling behind, so no frame is dropped
+        while not recorder.queue.empty():
+            time.sleep(0.001)
+    recorder.close()
+
+
+def test_no_empty_chunks(tmp_path):
+    record(str(tmp_path / "full"), 4, chunk_frames=2)
+    assert sorted(path.name for path in (tmp_path / "full").iterdir()) == [
+        "chunk_00000.bin", "chunk_00000.idx", "chunk_00001.bin", "chunk_00001.idx", "index.json"]
+    source = RecordedFrameSource(str(tmp_path / "full"), speed=0.0)
+    assert source.frame_count == 4
+    assert [source.get_latest_frame()[4, 8] for _ in range(4)] == [0, 1, 2, 3]
+
+    # Nothing recorded
+    record(str(tmp_path / "empty"), 0, chunk_frames=2)
+    assert sorted(path.name for path in (tmp_path / "empty").iterdir()) == ["index.json"]
+    assert RecordedFrameSource(str(tmp_path / "empty")).frame_count == 0
+
+
+def test_close_after_the_writer_failed(tmp_path):
+    recorder = FrameRecorder(str(tmp_path), RESOLUTION, REGIONS)
+    # Not a frame, which ends the writer
+    recorder.queue.put(("invalid",))
+    recorder.thread.join(1.0)
+    assert not recorder.thread.is_alive()
+    frame = numpy.zeros((RESOLUTION[1], RESOLUTION[0]), dtype=numpy.uint8)
+    for index in range(FrameRecorder.QUEUE_SIZE + 1):
+        recorder.add(float(index), frame)
+    assert recorder.queue.full()
+    start_time = time.perf_counter()
+    recorder.close()
+    assert time.perf_counter() - start_time < 1.0
@@ -0,0 +1,59 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+
+import random
+
+import pytest
+
+from overstim.mixer import VibeMixer
+from overstim.triggers import Pattern, Response, ResponseType, Trigger, Vibration
+
+
+def random_response(rng: random.Random) -> Response:
+    response_type = rng.choice(list(ResponseType))
+    if response_type is ResponseType.PATTERN:
+        pattern = Pattern(Vibration(rng.random(), rng.choice([0.0, 0.05, 0.3])) for _ in range(rng.randint(1, 60)))
+        pattern.append(Vibration(rng.random(), 0.1))
+        return Response(response_type, pattern=pattern, pattern_loop=rng.randint(1, 3))
+    return Response(response_type, intensity=rng.random(), duration=rng.random() * 3)
+
+
+def test_mix_matches_responses(monkeypatch):
+    # Small caches, so waveforms are dropped and moved while vibes play
+    monkeypatch.setattr(VibeMixer, "MAX_WAVEFORMS", 4)
+    monkeypatch.setattr(VibeMixer, "MAX_SEGMENTS", 64)
+    rng = random.Random(1)
+    mixer = VibeMixer(capacity=2)
+    vibes = []
+    current_time = 0.0
+    for _ in range(2000):
+        current_time += rng.choice([0.001, 0.01, 0.05])
+        if rng.random() < 0.3:
+            trigger, response = rng.choice(list(Trigger)), random_response(rng)
+            mixer.add(trigger, response, current_time, False)
+            vibes.append((current_time, response))
+        intensities = [response.get_intensity(current_time - start_time, False) for start_time, response in vibes]
+        vibes = [vibe for vibe, intensity in zip(vibes, intensities) if intensity is not None]
+        result = mixer.mix(current_time)
+        assert mixer.count == len(vibes)
+        assert result.silenced == (-1.0 in intensities)
+        if not result.silenced:
+            assert result.total == pytest.approx(sum(intensities))
+    assert len(mixer.waveform_rows) < 1000
@@ -0,0 +1,89 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import wave
+
+import numpy
+import pytest
+
+from overstim.music import MusicAnalysis, WavAudioSource
+from overstim.triggers import Trigger
+from overstim.utils import Config
+from overstim.vibe import VibeManager
+
+SAMPLE_RATE = 22050
+BLOCK_SIZE = MusicAnalysis.BLOCK_SIZE
+BLOCK_COUNT = 88
+# A drum hit every 11 blocks, about 117 BPM, starting within the block so it is not cut by the window
+BEAT_BLOCKS = list(range(5, BLOCK_COUNT, 11))
+DEPTH = 0.8
+
+
+def write_song(filename: str) -> None:
+    # A loud bass tone for the first half and a quiet one for the second, with drum hits of noise
+    sample_times = numpy.arange(BLOCK_SIZE * BLOCK_COUNT) / SAMPLE_RATE
+    bass_amplitude = numpy.where(numpy.arange(len(sample_times)) < len(sample_times) // 2, 0.4, 0.1)
+    samples = bass_amplitude * numpy.sin(2 * numpy.pi * 60.0 * sample_times)
+    random = numpy.random.default_rng(1)
+    for block in BEAT_BLOCKS:
+        start = block * BLOCK_SIZE + BLOCK_SIZE // 4
+        samples[start:start + BLOCK_SIZE] += 0.5 * random.uniform(-1.0, 1.0, BLOCK_SIZE) * numpy.exp(
+            -numpy.arange(BLOCK_SIZE) / (BLOCK_SIZE / 8))
+    with wave.open(filename, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        file.writeframes((numpy.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+
+
+class GainsRecorder(WavAudioSource):
+    # Keeps the gains of every analysed block, which are set before the next block is read
+    def __init__(self, filename: str, vibe_manager: VibeManager) -> None:
+        super().__init__(filename, realtime=False)
+        self.vibe_manager = vibe_manager
+        self.gains: list[dict[Trigger, float]] = []
+
+    def read(self, frames: int) -> numpy.ndarray | None:
+        if self.position:
+            self.gains.append(self.vibe_manager.gains)
+        return super().read(frames)
+
+
+def test_songs_follow_the_music(tmp_path):
+    filename = str(tmp_path / "song.wav")
+    write_song(filename)
+    vibe_manager = VibeManager(Config())
+    source = GainsRecorder(filename, vibe_manager)
+    analysis = MusicAnalysis(source, vibe_manager, DEPTH)
+    analysis.run()
+    assert len(source.gains) == BLOCK_COUNT
+    # Gains are reset at the end of the music
+    assert vibe_manager.gains == {}
+
+    # The speed song is at full intensity on the drum hits only, and decays in between
+    speed_gains = [gains[Trigger.SPEED_SONG] for gains in source.gains]
+    assert [block for block, gain in enumerate(speed_gains) if gain == 1.0] == BEAT_BLOCKS
+    assert all(1.0 - DEPTH <= gain < 0.5 for gain in speed_gains[BEAT_BLOCKS[0] + 5:BEAT_BLOCKS[1]])
+    assert analysis.analyzer.features.tempo == pytest.approx(60 * SAMPLE_RATE / (11 * BLOCK_SIZE), rel=0.01)
+
+    # The healing song follows the bass
+    healing_gains = [gains[Trigger.HEALING_SONG] for gains in source.gains]
+    assert min(healing_gains[:BLOCK_COUNT // 2]) > 0.95
+    assert max(healing_gains[BLOCK_COUNT // 2 + 1:]) < 0.35
+    assert min(healing_gains) >= 1.0 - DEPTH
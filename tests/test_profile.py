@@ -0,0 +1,66 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+
+import pytest
+
+from overstim.profile import PROFILE_VERSION, ProfileStore, config_from_dict, profile_from_dict
+from overstim.triggers import Trigger
+from overstim.heroes import Hero2
+from overstim.utils import Config
+
+
+def test_config_values_keep_their_type():
+    config = config_from_dict({"preview_window": True, "excluded_device_names": ["Lush"], "max_refresh_rate": 60,
+                               "max_vibe_intensity": 1, "log_level": "DEBUG"})
+    assert config.preview_window is True
+    assert config.excluded_device_names == ["Lush"]
+    assert config.max_refresh_rate == 60
+    assert config.max_vibe_intensity == 1.0 and isinstance(config.max_vibe_intensity, float)
+    assert config.log_level == "DEBUG"
+
+
+def test_config_values_of_other_types_are_rejected():
+    config = config_from_dict({"preview_window": "false", "excluded_device_names": "Lush", "max_refresh_rate": "60",
+                               "gpu_id": True, "intensity_slew_rate": "2", "device_curves": [1]})
+    default_config = Config()
+    for name in ["preview_window", "excluded_device_names", "max_refresh_rate", "gpu_id", "intensity_slew_rate",
+                 "device_curves"]:
+        assert getattr(config, name) == getattr(default_config, name)
+
+
+def test_trigger_enabled_must_be_bool():
+    profile = profile_from_dict({"triggers": {"MERCY": {"HEAL_BEAM": {"enabled": False}, "RESURRECT": {"enabled": 0}}}})
+    assert profile.get_trigger(Hero2.MERCY, Trigger.HEAL_BEAM).enabled is False
+    # Not a JSON bool, so the default
+    assert profile.get_trigger(Hero2.MERCY, Trigger.RESURRECT).enabled is True
+
+
+def test_invalid_version_is_rejected():
+    for version in ["2", None, 1.5, True, PROFILE_VERSION + 1]:
+        with pytest.raises(ValueError):
+            profile_from_dict({"version": version})
+
+
+def test_hand_edited_settings_file_loads_defaults(tmp_path):
+    filename = tmp_path / "OverStim_Settings.json"
+    for document in ['{"version": "1"}', '{"triggers": {"MERCY": []}}', '{"triggers": {"MERCY": {"HEAL_BEAM": 1}}}',
+                     '[]', '{']:
+        filename.write_text(document)
+        assert ProfileStore(str(filename)).load().config == Config()
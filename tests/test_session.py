@@ -0,0 +1,56 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import asyncio
+
+from overstim.heroes import Hero2
+from overstim.outputs import OutputManager
+from overstim.session import DetectionFrame, SessionRecorder, replay_session
+from overstim.triggers import Trigger, Response
+from overstim.utils import Config
+from overstim.vibe import VibeManager
+
+RESPONSES = {hero: {Trigger.ELIMINATION: Response(intensity=0.5, duration=10.0)} for hero in Hero2}
+
+
+class IntensityRecorder(VibeManager):
+    def __init__(self) -> None:
+        super().__init__(Config(intensity_slew_rate=0.0))
+        self.intensities: list[float] = []
+
+    def update(self, current_time: float) -> None:
+        super().update(current_time)
+        self.intensities.append(self.real_intensity)
+
+
+def test_replay_keeps_vibes_over_manual_hero_switches(tmp_path):
+    filename = str(tmp_path / "session.ostm")
+    recorder = SessionRecorder(filename, [])
+    for frame in [
+            DetectionFrame(0.0, hero=Hero2.MERCY, detected_hero=Hero2.MERCY, eliminations=1),
+            # Switched by hand, the vibe goes on
+            DetectionFrame(1.0, hero=Hero2.JUNO, detected_hero=Hero2.MERCY),
+            # Another hero is detected, which ends the vibe after this frame
+            DetectionFrame(2.0, hero=Hero2.JUNO, detected_hero=Hero2.MERCY, hero_auto_detect=True),
+            DetectionFrame(3.0, hero=Hero2.MERCY, detected_hero=Hero2.MERCY, hero_auto_detect=True)]:
+        recorder.write_frame(frame, RESPONSES)
+    recorder.close()
+    vibe_manager = IntensityRecorder()
+    asyncio.run(replay_session(filename, vibe_manager, OutputManager([])))
+    assert vibe_manager.intensities == [0.0, 0.5, 0.5, 0.0]
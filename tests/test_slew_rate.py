@@ -0,0 +1,57 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+
+import asyncio
+import time
+
+from overstim.mock_intiface import MockDevice, MockIntifaceServer
+from overstim.outputs import IntifaceOutput, OutputManager
+from overstim.utils import Config
+
+SLEW_RATE = 1.0
+IDLE_TIME = 1.0
+
+
+async def rise_after_idle() -> tuple[float, list[float]]:
+    async with MockIntifaceServer([MockDevice("Mock Vibe", [20])], port=0) as server:
+        config = Config(websocket_address=server.address, max_command_rate=0, intensity_slew_rate=SLEW_RATE)
+        outputs = OutputManager([IntifaceOutput(server.address, config)])
+        await outputs.start()
+        try:
+            while not outputs.devices:
+                await asyncio.sleep(0.01)
+            outputs.publish(0.1, [])
+            await asyncio.sleep(IDLE_TIME)
+            rise_time = time.time()
+            outputs.publish(1.0, [])
+            await asyncio.sleep(0.2)
+        finally:
+            await outputs.stop_devices()
+            await outputs.close()
+    return rise_time, [command.scalar for command in server.commands
+                       if command.message == "ScalarCmd" and command.timestamp >= rise_time]
+
+
+def test_ramp_after_idle():
+    # The level stays in sync at 0.1 while idle, and must not jump to the new intensity once it changes
+    rise_time, scalars = asyncio.run(rise_after_idle())
+    assert scalars
+    assert scalars[0] <= 0.1 + 0.05 + SLEW_RATE * 0.05
+    assert max(scalars) <= 0.1 + 0.05 + SLEW_RATE * 0.25
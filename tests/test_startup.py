@@ -0,0 +1,69 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from overstim import utils
+from overstim.main import STARTUP_BUDGET
+from overstim.utils import StartupTimer
+
+# Loaded by the controller in the background once the window is shown, never before
+DEFERRED_MODULES = ["cv2", "numpy", "buttplug", "dxcam_cpp"]
+# Importing is the first stage of the startup, creating and showing the window takes the rest
+IMPORT_BUDGET = STARTUP_BUDGET / 2
+
+IMPORT_SCRIPT = """
+import json, sys
+from overstim.utils import StartupTimer
+startup_timer = StartupTimer()
+from PySide6.QtWidgets import QApplication
+import overstim.main_window
+startup_timer.mark("imports")
+print(json.dumps({"import_time": startup_timer.total, "modules": sorted(sys.modules)}))
+"""
+
+
+def test_startup_timer_stages(monkeypatch):
+    times = iter([1.5, 1.75, 2.5])
+    monkeypatch.setattr(utils.time, "perf_counter", lambda: next(times))
+    startup_timer = StartupTimer(start_time=1.0)
+    startup_timer.mark("imports")
+    startup_timer.mark("application")
+    startup_timer.mark("show")
+    assert startup_timer.stages == [("imports", 0.5), ("application", 0.25), ("show", 0.75)]
+    assert startup_timer.total == 1.5
+    assert str(startup_timer) == "1500 ms (imports 500 ms, application 250 ms, show 750 ms)"
+
+
+def test_main_window_cold_import():
+    # The main window needs Qt and pynput, which are missing on some headless machines
+    pytest.importorskip("PySide6.QtWidgets")
+    pytest.importorskip("pynput")
+    # A fresh interpreter, so no module is imported already. Only the imports stage of the startup is measured.
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    values = json.loads(result.stdout.splitlines()[-1])
+    assert values["import_time"] < IMPORT_BUDGET
+    assert [module for module in DEFERRED_MODULES if module in values["modules"]] == []
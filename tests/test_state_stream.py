@@ -0,0 +1,82 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import asyncio
+import os
+
+import pytest
+
+from overstim.heroes import Hero2
+from overstim.outputs import OutputManager, OutputState, StateStreamOutput, create_outputs
+from overstim.state_stream import StateStreamReader
+from overstim.triggers import Trigger
+from overstim.utils import Config
+
+STREAM_NAME = f"overstim_test_{os.getpid()}"
+
+
+async def stream_lifecycle() -> None:
+    outputs = create_outputs(Config(using_intiface=False))
+    assert [type(output) for output in outputs.outputs] == [StateStreamOutput]
+    await outputs.start()
+    try:
+        # Turned on while running
+        await outputs.set_config(Config(using_intiface=False, state_stream_name=STREAM_NAME))
+        outputs.publish_state(OutputState(100.0, 0.5, 60.0, Hero2.MERCY, {Trigger.HEAL_BEAM: 0.5}))
+        await asyncio.sleep(0.01)
+        with StateStreamReader(STREAM_NAME) as reader:
+            record = reader.latest()
+            assert (record.timestamp, record.intensity, record.fps, record.hero) == (100.0, 0.5, 60.0, Hero2.MERCY)
+            assert record.trigger_intensities[Trigger.HEAL_BEAM] == 0.5
+
+            # Readers see the stop, and nothing is written after an emergency stop
+            outputs.halt()
+            await outputs.stop_devices()
+            outputs.publish_state(OutputState(101.0, 0.5, 60.0, Hero2.MERCY, {Trigger.HEAL_BEAM: 0.5}))
+            await asyncio.sleep(0.01)
+            record = reader.latest()
+            assert (record.intensity, record.hero) == (0.0, Hero2.MERCY)
+    finally:
+        await outputs.close()
+    # Removed when closing
+    with pytest.raises(FileNotFoundError):
+        StateStreamReader(STREAM_NAME)
+
+
+def test_state_stream_output():
+    asyncio.run(stream_lifecycle())
+
+
+async def failing_stream() -> None:
+    # A stream that can not be created does not keep the other outputs from starting
+    output = StateStreamOutput(Config(state_stream_name="invalid/name"))
+    other_output = StateStreamOutput(Config(state_stream_name=STREAM_NAME))
+    outputs = OutputManager([output, other_output])
+    await outputs.start()
+    try:
+        assert output.writer is None and other_output.writer is not None
+        outputs.publish_state(OutputState(100.0, 0.5, 60.0, Hero2.MERCY, {}))
+        await asyncio.sleep(0.01)
+        assert all(not task.done() for task in outputs.tasks)
+    finally:
+        await outputs.close()
+
+
+def test_failing_state_stream():
+    asyncio.run(failing_stream())
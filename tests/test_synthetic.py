@@ -0,0 +1,38 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+
+import os
+
+from overstim.synthetic import HudElement, SyntheticHud
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "templates")
+
+
+def test_shift_is_resolved_once_per_scene():
+    hud = SyntheticHud(TEMPLATE_PATH, seed=1)
+    scene = hud.resolve_scene([HudElement.from_str("elimination:1"), HudElement.from_str("mercy_heal_beam")])
+    assert all(element.shift is not None for element in scene)
+    # Placing the scene again, e.g. for another resolution, does not move it
+    areas = [hud.place(element) for element in scene]
+    hud.render(scene, (2560, 1440))
+    assert [hud.place(element) for element in scene] == areas
+    assert hud.resolve_scene(scene) == scene
+    # The labels keep the shift
+    assert [HudElement.from_str(str(element)) for element in scene] == scene
@@ -0,0 +1,45 @@
+#  OverStim - Controls sex toys based on the game Overwatch 2
+#  Copyright (C) 2023-2025 cryo-es
+#  Copyright (C) 2024-2025 Pharmercy69 <pharmercy69@protonmail.ch>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as
+#  published by the Free Software Foundation, either version 3 of the
+#  License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#  SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+import queue
+
+from overstim.utils import BackgroundQueueHandler
+
+
+def test_queued_records_keep_the_state_when_logged():
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("overstim.test_utils")
+    logger.propagate = False
+    logger.addHandler(BackgroundQueueHandler(log_queue))
+    try:
+        intensities = [0.5]
+        logger.warning("Vibes: %s", intensities)
+        try:
+            raise ValueError("device gone")
+        except ValueError as e:
+            logger.error("Failed", exc_info=e)
+        # Changed before the listener thread formats the records
+        intensities.append(1.0)
+    finally:
+        logger.handlers.clear()
+    formatter = logging.Formatter("%(message)s")
+    assert formatter.format(log_queue.get_nowait()) == "Vibes: [0.5]"
+    error = formatter.format(log_queue.get_nowait())
+    assert error.startswith("Failed\nTraceback") and error.endswith("ValueError: device gone")